@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+"""
+One solver and planner engine for any task described by a Problem (problem.py).
+The engine solves every goal (caching the transition matrices, the solutions in
+memory and, optionally, on disk, and solving goals in parallel processes), predicts
+goals from the human's moves and scores robot actions with the Effort, Legibility,
+and Value combination (both by the rules of the task, see Problem.goal_probs and
+Problem.action_scores), and runs team episodes. The SCA of either task makes its
+predictions and scores through an engine holding its tables (set_tables).
+Random choices use the engine's own random.Random, so runs with the same seed repeat.
+"""
+
+import multiprocessing
+import os
+import random
+import numpy as np
+
+from solver import value_iteration
+from value_store import ValueStore
+
+#engine whose goals are being solved by forked worker processes
+FORKED = None
+
+
+"""
+    This function solves goal g of the forked engine (run in a worker process)
+"""
+def solve_forked(g):
+    stats = {}
+    return g, FORKED.compute(g, stats), stats
+
+
+"""
+    This class implements the engine
+"""
+class Engine:
+    def __init__(self, problem, wV=0.9, wE=0.05, wL=0.05, gamma=0.9, epsilon=0.01,
+                 cache_dir=None, processes=1, value_dtype='float64', stable=None, seed=None):
+        self.problem = problem
+        self.G = list(problem.goals)
+
+        #set weights for Value, Effort, and Legibility
+        self.wV = wV
+        self.wE = wE
+        self.wL = wL
+
+        #solver settings
+        self.gamma = gamma
+        self.epsilon = epsilon
+        self.cache_dir = cache_dir
+        self.processes = processes
+        self.value_dtype = value_dtype
+        self.stable = stable
+
+        #transition matrices by transition key, and (values, policy) by goal
+        self.P = {}
+        self.solutions = {}
+        #convergence stats of every goal solved (see solver.value_iteration)
+        self.solve_stats = {}
+
+        #solved tables (see solve_all)
+        self.Vs = None
+        self.policies = None
+
+        self.rng = random.Random(seed)
+
+    """
+        This function returns the transition matrices used when working towards goal g
+    """
+    def transitions(self, g=None):
+        key = self.problem.transition_key(g)
+        if key not in self.P:
+            self.P[key] = self.problem.transition_matrices(g)
+        return self.P[key]
+
+    """
+        This function returns the file a solution of goal g is cached in
+    """
+    def cache_file(self, g):
+        return os.path.join(self.cache_dir, '%s-%s-%g-%g-%s.npz' % (self.problem.name, g, self.gamma, self.epsilon,
+                                                                   self.stable))
+
+    """
+        This function does value iteration for goal g (on the problem's abstract MDP
+        if it has one and asks for it)
+    """
+    def compute(self, g, stats=None):
+        if self.problem.abstract:
+            V, policy = self.problem.solve_abstract(g, self.gamma, self.epsilon, self.stable, stats)
+            return np.array(V), np.array(policy)
+        return value_iteration(self.transitions(g), self.problem.rewards(g), self.gamma, self.epsilon,
+                               self.stable, stats)
+
+    """
+        This function returns the values and policy of goal g, from memory, from the
+        disk cache, or by solving it
+    """
+    def solve(self, g):
+        if g in self.solutions:
+            return self.solutions[g]
+        if self.cache_dir != None and os.path.exists(self.cache_file(g)):
+            data = np.load(self.cache_file(g))
+            self.solutions[g] = (data['V'], data['policy'])
+            return self.solutions[g]
+        self.solve_stats[g] = {}
+        self.store_solution(g, self.compute(g, self.solve_stats[g]))
+        return self.solutions[g]
+
+    """
+        This function saves the solution of goal g in memory and in the disk cache
+    """
+    def store_solution(self, g, solution):
+        self.solutions[g] = solution
+        if self.cache_dir != None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.savez(self.cache_file(g), V=solution[0], policy=solution[1])
+
+    """
+        This function solves every goal (in parallel processes if asked to) and
+        keeps the values and policies in ValueStores
+    """
+    def solve_all(self):
+        global FORKED
+        todo = [g for g in self.G if g not in self.solutions and
+                (self.cache_dir == None or not os.path.exists(self.cache_file(g)))]
+        if self.processes > 1 and len(todo) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            #workers are forked, so they share the problem (and any transition
+            #matrices built so far) instead of having them pickled
+            FORKED = self
+            with multiprocessing.get_context('fork').Pool(min(self.processes, len(todo))) as pool:
+                for g, solution, stats in pool.map(solve_forked, todo):
+                    self.solve_stats[g] = stats
+                    self.store_solution(g, solution)
+            FORKED = None
+
+        solutions = dict((g, self.solve(g)) for g in self.G)
+        self.Vs = ValueStore(dict((g, solutions[g][0]) for g in self.G), dtype=self.value_dtype)
+        self.policies = ValueStore(dict((g, solutions[g][1]) for g in self.G), dtype=np.int16)
+        return self.Vs, self.policies
+
+    """
+        This function writes the solved tables into the directory path (e.g. as a
+        WorkQueue artifact)
+    """
+    def save(self, path):
+        if self.Vs is None:
+            self.solve_all()
+        self.Vs.save(os.path.join(path, 'values'))
+        self.policies.save(os.path.join(path, 'policies'))
+
+    """
+        This function reads tables written by save instead of solving (memory-mapped,
+        so processes on one host share them)
+    """
+    def load(self, path):
+        return self.set_tables(ValueStore.load(os.path.join(path, 'values')),
+                               ValueStore.load(os.path.join(path, 'policies')))
+
+    """
+        This function uses tables solved elsewhere (values and policies indexed by
+        goal, as ValueStores or dictionaries) instead of solving
+    """
+    def set_tables(self, Vs, policies):
+        if not isinstance(Vs, ValueStore):
+            Vs = ValueStore(Vs, dtype=self.value_dtype)
+        if not isinstance(policies, ValueStore):
+            policies = ValueStore(policies, dtype=np.int16)
+        self.Vs = Vs
+        self.policies = policies
+        return self
+
+    """
+        This function returns the possible next states of action a at state s and
+        their probabilities, when working towards goal g
+    """
+    def successors(self, a, s, g=None):
+        P = self.transitions(g)[a]
+        lo, hi = P.indptr[s], P.indptr[s + 1]
+        return P.indices[lo:hi], P.data[lo:hi]
+
+    """
+        This function draws the next state of action a at state s
+    """
+    def sample(self, a, s, g=None):
+        idx, pr = self.successors(a, s, g)
+        #deterministic transitions do not use up random numbers
+        if len(idx) == 1:
+            return int(idx[0])
+        return int(idx[min(np.searchsorted(np.cumsum(pr), self.rng.random(), side='right'), len(idx) - 1)])
+
+    """
+        This function returns the most likely goals, their probability and the
+        probabilities of all goals after the human took action aH and moved from
+        s_old to s (see Problem.goal_probs)
+    """
+    def goal_probs(self, s, s_old, aH=None):
+        return self.problem.goal_probs(self, s, s_old, aH)
+
+    """
+        This function returns the most likely next state, the combined value of
+        Effort, Legibility, and Value and the legibility of every robot action from
+        state s, given the predicted goal Gp and the probabilities of all goals (see
+        Problem.action_scores)
+    """
+    def action_scores(self, s, Gp, probs, g=None):
+        return self.problem.action_scores(self, s, Gp, probs, g)
+
+    """
+        This function returns the goals the robot can predict, the posterior and the
+        action scores for a robot decision recorded in a golden trace (see
+        golden_trace.check)
+    """
+    def decide(self, step):
+        if step['s_old'] == None:
+            p = 1.0 / len(self.G)
+            max_g, probs = self.G, [p] * len(self.G)
+        else:
+            max_g, p, probs = self.goal_probs(step['s'], step['s_old'], step['aH'])
+        succ, vals, _ = self.action_scores(step['s'], step['Gp'], probs, step['goal'])
+        return {'Gp': max_g, 'p': p, 'probs': probs, 'scores': vals}
+
+    """
+        This function returns a random one of the highest valued actions
+    """
+    def choose(self, vals):
+        vals = np.asarray(vals)
+        maxes = np.flatnonzero(vals == vals.max())
+        return int(maxes[self.rng.randint(0, len(maxes) - 1)])
+
+    """
+        This function runs one team episode towards the human's goal from state s,
+        robot and human taking turns as given by r_act and h_act. Returns the
+        steps as (state, 'R' or 'H', action, next state) tuples
+    """
+    def run(self, human_goal, s, h_act, r_act, max_t=1000):
+        if self.Vs is None:
+            self.solve_all()
+        s_old = None
+        aH = None
+        t = 0
+        sol = []
+        while s != self.problem.terminal and t < max_t:
+            if r_act(t) == True:
+                #predict the human's goal from their last move
+                if s_old == None:
+                    Gp, p, probs = (self.G[self.rng.randint(0, len(self.G) - 1)], 1.0 / len(self.G),
+                                    [1.0 / len(self.G)] * len(self.G))
+                else:
+                    max_g, p, probs = self.goal_probs(s, s_old, aH)
+                    if len(max_g) == 0:
+                        max_g = self.G
+                    Gp = max_g[self.rng.randint(0, len(max_g) - 1)]
+                succ, vals, _ = self.action_scores(s, Gp, probs, human_goal)
+                a = self.choose(vals)
+                s_new = self.sample(a, s, human_goal)
+                sol.append((s, 'R', a, s_new))
+                s = s_new
+            if s != self.problem.terminal and h_act(t) == True:
+                aH = self.policies[human_goal][s]
+                s_new = self.sample(aH, s, human_goal)
+                sol.append((s, 'H', aH, s_new))
+                s_old = s
+                s = s_new
+            t += 1
+        return sol
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+"""
+Golden traces: seeded reference episodes of a teammate algorithm (SCA of either
+task, or anything with the same record/set_rng hooks), kept in one compressed .npz
+file, for checking that a faster code path makes the same decisions.
+
+A GoldenTrace is given to SCA.team as its trajectory store. Every episode runs with
+its own random.Random(seed) (SCA.set_rng), so an episode repeats exactly, whatever
+else runs before it or in other processes. Each step keeps the actor, state,
+action and next state; robot steps also keep the predicted goal, its probability,
+the probabilities of all goals (the CG/CG_markov posterior) and the score of every
+action (SCA.scores). The solved value and policy tables can be stored too.
+
+    trace = GoldenTrace(len(sca.G), sca.AR)
+    trace.record(sca, range(100), lambda sca, store: sca.team(h_act, r_act, store=store))
+    trace.set_tables(sca.G, sca.Vs_human, sca.policies)
+    trace.save('golden.npz')
+
+Checking an alternative against it:
+- compare(golden, other) finds the first difference between two traces recorded
+  with the same seeds (e.g. the plain and the fast=True SCA)
+- check(golden, decide) asks decide(step) for the posterior and the scores of
+  every recorded robot decision, without running episodes (e.g. sca.engine.decide,
+  the Engine the SCA decides through). An Engine that solves its own tables
+  decides the same only if it solves the same tables: the tower SCA loads tables
+  solved without slip whatever its slip is
+- check_tables(golden, values, policies) compares solved tables
+Each returns None, or the first divergence as a dictionary (format_divergence
+prints it).
+"""
+
+import contextlib
+import io
+import json
+import random
+import numpy as np
+
+ACTORS = {'H': 0, 'R': 1}
+
+#columns of every step and whether they are compared exactly (ints) or within tol
+STEP_COLUMNS = ['actor', 's', 'a', 's_new', 'Gp', 'p', 'probs', 'scores']
+EXACT = set(['actor', 's', 'a', 's_new', 'Gp'])
+
+
+"""
+    This class implements a golden trace (recorder, and trajectory store for SCA.team)
+"""
+class GoldenTrace:
+    def __init__(self, num_goals, num_actions, meta=None):
+        self.num_goals = num_goals
+        self.num_actions = num_actions
+        self.meta = meta or {}
+        self.columns = dict((name, []) for name in STEP_COLUMNS)
+        self.episode_rows = [] #(seed, human goal, first step, number of steps)
+        self.goals = None
+        self.values = None
+        self.policies = None
+
+        #while recording: the algorithm and the seed of the current episode
+        self.sca = None
+        self.seed = -1
+        self.open = False
+
+    """
+        This function runs and records one episode per seed: run(sca, store) runs an
+        episode writing to store (e.g. calls sca.team(..., store=store)). Printing
+        is suppressed unless quiet is False
+    """
+    def record(self, sca, seeds, run, quiet=True):
+        self.sca = sca
+        for seed in seeds:
+            self.seed = seed
+            sca.set_rng(random.Random(seed))
+            if quiet:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    run(sca, self)
+            else:
+                run(sca, self)
+            self.end_episode()
+        sca.set_rng(random)
+        self.sca = None
+        if hasattr(sca, 'config'):
+            self.meta['config'] = sca.config
+        return self
+
+    #trajectory store interface (see trajectory_store.py)
+
+    def begin_episode(self, config, goal):
+        self.end_episode()
+        self.episode_rows.append([self.seed, goal, len(self.columns['s']), 0])
+        self.open = True
+
+    def append(self, actor, state, action, next_state, goal=-1, prob=np.nan, probs=None, agent=0):
+        c = self.columns
+        c['actor'].append(ACTORS[actor])
+        c['s'].append(state)
+        c['a'].append(action)
+        c['s_new'].append(next_state)
+        c['Gp'].append(goal)
+        c['p'].append(prob)
+        c['probs'].append(probs if probs is not None else [np.nan] * self.num_goals)
+        scores = self.sca.scores if (actor == 'R' and self.sca != None) else None
+        c['scores'].append(scores if scores is not None else [np.nan] * self.num_actions)
+
+    def end_episode(self):
+        if self.open:
+            self.episode_rows[-1][3] = len(self.columns['s']) - self.episode_rows[-1][2]
+            self.open = False
+
+    """
+        This function keeps the solved tables: values and policies indexed by goal
+    """
+    def set_tables(self, goals, values, policies):
+        self.goals = np.array(goals)
+        self.values = np.array([np.asarray(list(values[g]), dtype=np.float64) for g in goals])
+        self.policies = np.array([np.asarray(list(policies[g]), dtype=np.int64) for g in goals])
+
+    """
+        This function returns the steps as arrays
+    """
+    def arrays(self):
+        c = self.columns
+        return {'actor': np.array(c['actor'], dtype=np.int8),
+                's': np.array(c['s'], dtype=np.int64), 'a': np.array(c['a'], dtype=np.int64),
+                's_new': np.array(c['s_new'], dtype=np.int64), 'Gp': np.array(c['Gp'], dtype=np.int64),
+                'p': np.array(c['p'], dtype=np.float64),
+                'probs': np.array(c['probs'], dtype=np.float64).reshape(-1, self.num_goals),
+                'scores': np.array(c['scores'], dtype=np.float64).reshape(-1, self.num_actions),
+                'episodes': np.array(self.episode_rows, dtype=np.int64).reshape(-1, 4)}
+
+    def save(self, path):
+        data = self.arrays()
+        if self.values is not None:
+            data.update({'goals': self.goals, 'values': self.values, 'policies': self.policies})
+        data['meta'] = np.array(json.dumps(dict(self.meta, num_goals=self.num_goals, num_actions=self.num_actions)))
+        np.savez_compressed(path, **data)
+
+    """
+        This function reads a trace written by save (its steps are arrays from then on)
+    """
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        meta = json.loads(str(data['meta']))
+        trace = GoldenTrace(meta['num_goals'], meta['num_actions'], meta)
+        trace.columns = dict((name, data[name]) for name in STEP_COLUMNS)
+        trace.episode_rows = data['episodes'].tolist()
+        if 'values' in data:
+            trace.goals, trace.values, trace.policies = data['goals'], data['values'], data['policies']
+        return trace
+
+    """
+        This function yields every robot decision with what it was made from: the
+        state s, the state s_old and action aH of the last human move before it
+        (None before the first), the human's goal and the recorded results
+    """
+    def robot_steps(self):
+        data = self.arrays() if isinstance(self.columns['s'], list) else self.columns
+        for e, (seed, goal, first, steps) in enumerate(self.episode_rows):
+            s_old = None
+            aH = None
+            for i in range(first, first + steps):
+                if data['actor'][i] == ACTORS['H']:
+                    s_old = int(data['s'][i])
+                    aH = int(data['a'][i])
+                    continue
+                yield {'episode': e, 'seed': seed, 'step': i - first, 'goal': goal, 's': int(data['s'][i]),
+                       's_old': s_old, 'aH': aH, 'a': int(data['a'][i]), 'Gp': int(data['Gp'][i]),
+                       'p': float(data['p'][i]), 'probs': data['probs'][i], 'scores': data['scores'][i]}
+
+
+"""
+    This function returns whether two arrays of values are the same within tol
+    (NaNs and infinities have to match exactly)
+"""
+def same(x, y, tol):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.shape != y.shape:
+        return False
+    finite = np.isfinite(x) & np.isfinite(y)
+    return bool(np.all(np.abs(x[finite] - y[finite]) <= tol) and
+                np.array_equal(x[~finite], y[~finite], equal_nan=True))
+
+
+"""
+    This function returns the first divergence between two traces recorded with
+    the same seeds, comparing each step's columns (floats within tol)
+"""
+def compare(expected, actual, tol=0.0):
+    E = expected.arrays() if isinstance(expected.columns['s'], list) else expected.columns
+    A = actual.arrays() if isinstance(actual.columns['s'], list) else actual.columns
+    for e, (row_e, row_a) in enumerate(zip(expected.episode_rows, actual.episode_rows)):
+        if row_e[0] != row_a[0]:
+            return {'episode': e, 'seed': row_e[0], 'step': 0, 'field': 'seed', 'expected': row_e[0],
+                    'actual': row_a[0]}
+        n = min(row_e[3], row_a[3])
+        se = slice(row_e[2], row_e[2] + n)
+        sa = slice(row_a[2], row_a[2] + n)
+        #first differing step of each column, found with array operations
+        first = None
+        for name in STEP_COLUMNS:
+            x, y = E[name][se], A[name][sa]
+            if name in EXACT:
+                bad = np.flatnonzero(x != y)
+            else:
+                x2 = x.reshape(n, -1)
+                y2 = y.reshape(n, -1)
+                if x2.shape != y2.shape:
+                    bad = np.arange(min(n, 1))
+                else:
+                    both = np.isfinite(x2) & np.isfinite(y2)
+                    diff = np.where(both, np.abs(np.nan_to_num(x2) - np.nan_to_num(y2)) > tol,
+                                    ~((x2 == y2) | (np.isnan(x2) & np.isnan(y2))))
+                    bad = np.flatnonzero(diff.any(axis=1))
+            if len(bad) > 0 and (first == None or bad[0] < first[0]):
+                first = (int(bad[0]), name)
+        if first != None:
+            i, name = first
+            return {'episode': e, 'seed': row_e[0], 'step': i, 'field': name,
+                    'expected': E[name][row_e[2] + i].tolist(), 'actual': A[name][row_a[2] + i].tolist()}
+        if row_e[3] != row_a[3]:
+            return {'episode': e, 'seed': row_e[0], 'step': n, 'field': 'steps', 'expected': row_e[3],
+                    'actual': row_a[3]}
+    if len(expected.episode_rows) != len(actual.episode_rows):
+        return {'episode': min(len(expected.episode_rows), len(actual.episode_rows)), 'seed': None, 'step': 0,
+                'field': 'episodes', 'expected': len(expected.episode_rows), 'actual': len(actual.episode_rows)}
+    return None
+
+
+"""
+    This function returns the first recorded robot decision that decide(step) (a
+    step of robot_steps) does not reproduce. decide returns a dictionary with any
+    of 'p', 'probs' (compared within tol), 'Gp' (the goals it could predict) and
+    'scores' (compared within tol; the recorded action has to be one of the best)
+"""
+def check(expected, decide, tol=1e-9):
+    for step in expected.robot_steps():
+        got = decide(step)
+        for name in ('p', 'probs'):
+            if name in got and not same(step[name], got[name], tol):
+                return dict(step, field=name, expected=np.asarray(step[name]).tolist(),
+                            actual=np.asarray(got[name]).tolist())
+        if 'Gp' in got and step['Gp'] not in list(got['Gp']):
+            return dict(step, field='Gp', expected=step['Gp'], actual=list(got['Gp']))
+        if 'scores' in got:
+            scores = np.asarray(got['scores'], dtype=np.float64)
+            if not same(step['scores'], scores, tol):
+                return dict(step, field='scores', expected=step['scores'].tolist(), actual=scores.tolist())
+            if scores[step['a']] < scores.max() - tol:
+                return dict(step, field='a', expected=step['a'], actual=np.flatnonzero(scores >= scores.max() - tol).tolist())
+    return None
+
+
+"""
+    This function returns the first goal whose values (within tol) or policy differ
+    from the stored tables
+"""
+def check_tables(expected, values, policies, tol=1e-9):
+    for i, g in enumerate(expected.goals.tolist()):
+        V = np.asarray(list(values[g]), dtype=np.float64)
+        if not same(expected.values[i], V, tol):
+            s = int(np.argmax(np.abs(expected.values[i] - V)))
+            return {'goal': g, 'field': 'values', 'state': s, 'expected': float(expected.values[i][s]),
+                    'actual': float(V[s])}
+        pi = np.asarray(list(policies[g]))
+        bad = np.flatnonzero(expected.policies[i] != pi)
+        if len(bad) > 0:
+            s = int(bad[0])
+            return {'goal': g, 'field': 'policies', 'state': s, 'expected': int(expected.policies[i][s]),
+                    'actual': int(pi[s])}
+    return None
+
+
+"""
+    This function returns a divergence as text
+"""
+def format_divergence(d):
+    if d == None:
+        return 'no divergence'
+    if 'goal' in d and 'state' in d:
+        return 'goal %s, state %d: %s expected %s, got %s' % (d['goal'], d['state'], d['field'], d['expected'],
+                                                              d['actual'])
+    return 'episode %d (seed %s), step %d: %s expected %s, got %s' % (d['episode'], d['seed'], d['step'],
+                                                                      d['field'], d['expected'], d['actual'])
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""
+The problem interface the shared Engine (engine.py) works with. A task is added by
+writing an adapter that subclasses Problem (see Navigation/nav_problem.py and
+Tower_Assembly/tower_problem.py); solving, caching and parallel solves then come
+from the engine. Goal inference and action scoring differ between the tasks, so the
+adapter implements them (the same rules as the task's SCA) on the engine's tables.
+
+States are numbered 0 .. num_states-1 and actions 0 .. num_actions-1. Goals are state
+numbers. Transitions may depend on the goal being worked towards (for example when
+only the true goal ends the task); g is that goal, or None.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+
+"""
+    This class describes a problem. Subclasses set num_states, num_actions, goals,
+    terminal, slip and name, and implement next_states, rewards, legibility,
+    goal_probs and action_scores. Problems that can solve a goal on a smaller
+    abstract MDP implement solve_abstract and set abstract to use it
+"""
+class Problem:
+    name = 'problem'
+    num_states = 0
+    num_actions = 0
+    goals = []
+    terminal = -1
+    #probability that an action fails and the state stays the same
+    slip = 0.0
+    #whether the engine solves goals with solve_abstract
+    abstract = False
+
+    """
+        This function returns the next state of every state for action a (an array
+        of num_states state numbers), when working towards goal g
+    """
+    def next_states(self, a, g=None):
+        raise NotImplementedError
+
+    """
+        This function returns the reward of every state for goal g
+    """
+    def rewards(self, g):
+        raise NotImplementedError
+
+    """
+        This function returns the legibility probability of goal G for action a at
+        state s, when working towards goal g
+    """
+    def legibility(self, G, a, s, g=None):
+        raise NotImplementedError
+
+    """
+        This function returns the most likely goals, their probability and the
+        probabilities of all goals, after the human took action aH and moved from
+        s_old to s (engine holds the solved tables)
+    """
+    def goal_probs(self, engine, s, s_old, aH):
+        raise NotImplementedError
+
+    """
+        This function returns the most likely next state, the combined value of
+        Effort, Legibility, and Value and the legibility of every robot action from
+        state s, given the predicted goal Gp and the probabilities of all goals, when
+        the human works towards goal g (engine holds the solved tables and weights)
+    """
+    def action_scores(self, engine, s, Gp, probs, g=None):
+        raise NotImplementedError
+
+    """
+        This function returns the values and policy of goal g solved on an abstract
+        MDP, the same as value iteration on the full transition matrices gives
+        (arguments as solver.value_iteration)
+    """
+    def solve_abstract(self, g, gamma, epsilon, stable=None, stats=None):
+        raise NotImplementedError
+
+    """
+        This function returns the probability of perceived effort of moving from s
+        to s_new with action a
+    """
+    def effort(self, a, s, s_new):
+        if s == s_new:
+            return 0.1
+        return 0.9
+
+    """
+        This function returns the goal whose transitions are used when working
+        towards goal g. Goals with the same key share transition matrices
+    """
+    def transition_key(self, g):
+        return g
+
+    """
+        This function returns one sparse (states x states) transition matrix per
+        action for goal g. By default an action moves to next_states with
+        probability 1 - slip and stays otherwise; finishing never fails
+    """
+    def transition_matrices(self, g=None):
+        S = self.num_states
+        s = np.arange(S)
+        P = []
+        for a in range(self.num_actions):
+            nxt = np.asarray(self.next_states(a, g))
+            p_stay = np.where((nxt == s) | (nxt == self.terminal), 0.0, self.slip)
+            data = np.concatenate([1.0 - p_stay, p_stay])
+            keep = data > 0
+            M = sp.csr_matrix((data[keep], (np.concatenate([s, s])[keep], np.concatenate([nxt, s])[keep])),
+                              shape=(S, S))
+            M.sum_duplicates()
+            P.append(M)
+        return P
+
+
+"""
+    This function returns the most likely goals, their probability and the
+    probabilities of all goals after the human moved from s_old to s, from the
+    differences in the values of the two states for each goal (the rule of the
+    tower SCA.CG_markov). Vs holds the values of every goal in goals (Vs[g][s])
+"""
+def value_goal_probs(Vs, goals, s, s_old):
+    eq_p = 1.0 / len(goals)
+    eq_probs = [eq_p for i in range(len(goals))]
+
+    max_g = []
+    max_val = 0
+
+    #keep running sum of values for normalization
+    action_values = []
+    sum_vals = 0
+
+    non_neg = []
+    #iterate through goals, calculating the difference in mdp state value
+    #caused by each action
+    for g in goals:
+        val = Vs[g][s] - Vs[g][s_old]
+
+        #maintain maximum difference goal mdp
+        if val > max_val:
+            max_g = [g]
+            max_val = val
+        elif val == max_val:
+            max_g.append(g)
+
+        #consider only positive differences
+        if val >= 0:
+            sum_vals += val
+            non_neg.append(True)
+        else:
+            non_neg.append(False)
+
+        action_values.append(val)
+
+    if sum_vals == 0:
+        max_g = []
+        num = 0
+        for b in non_neg:
+            if b:
+                num += 1
+        if num > 0:
+            eq_p = 1 / num
+            for i in range(len(non_neg)):
+                if non_neg[i]:
+                    eq_probs[i] = eq_p
+                    max_g.append(goals[i])
+                else:
+                    eq_probs[i] = 0
+        return (max_g, eq_p, eq_probs)
+
+    #normalize the (positive) difference values for each goal mdp
+    #assign probability 0 if the difference is negative
+    probs = [val / sum_vals if val > 0 else 0 for val in action_values]
+    max_pr = max(max_val / sum_vals, eq_p)
+
+    return (max_g, max_pr, probs)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""
+Value iteration shared by the navigation and tower assembly tasks.
+
+Passing a stats dictionary records how the solve converged (see value_iteration),
+and stable stops the sweeps once the greedy policy has not changed for that many
+sweeps. Only the greedy policy matters for the robot's choices and it usually
+settles long before the values do, so stable trades value accuracy (the values
+are those of the last sweep) for solve time. format_stats prints a report.
+"""
+
+import math
+import time
+import numpy as np
+
+
+"""
+    This function does value iteration over a list of per-action transition matrices
+    (dense or sparse), with the same span stopping rule and iteration bound as
+    mdptoolbox.mdp.ValueIteration. Each sweep costs one sparse matrix-vector product
+    per action, so the work is proportional to the number of non-zero transitions.
+    With stable, it also stops after that many sweeps in a row without a change of
+    the greedy policy. If stats is a dictionary it is filled with:
+
+    - residuals: largest change of any state value in each sweep (Bellman residual)
+    - spans: span of the changes in each sweep (what the stopping rule tests)
+    - policy_changes: number of states whose greedy action changed in each sweep
+    - times: wall time in seconds from the start of the solve to the end of each sweep
+    - iterations, max_iter, time, and stopped ('epsilon', 'stable' or 'max_iter')
+
+    Returns the values and the greedy actions as arrays
+"""
+def value_iteration(P, R, gamma, epsilon=0.01, stable=None, stats=None):
+    start = time.time()
+    S = len(R)
+    V = np.zeros(S)
+    thresh = epsilon * (1 - gamma) / gamma
+
+    Q = np.empty([len(P), S])
+    for a in range(len(P)):
+        Q[a] = R + gamma * P[a].dot(V)
+    span = np.ptp(Q.max(axis=0) - V)
+    max_iter = int(math.ceil(math.log(thresh / span) / math.log(gamma))) if span > 0 else 1
+
+    track = stable != None or stats != None
+    if stats != None:
+        stats.update({'residuals': [], 'spans': [], 'policy_changes': [], 'times': [],
+                      'max_iter': max_iter, 'stopped': 'max_iter'})
+    #no policy before the first sweep, so every state counts as changed in it
+    policy = None
+    unchanged = 0
+
+    for i in range(max_iter):
+        for a in range(len(P)):
+            Q[a] = R + gamma * P[a].dot(V)
+        V_new = Q.max(axis=0)
+        variation = np.ptp(V_new - V)
+
+        if track:
+            policy_new = Q.argmax(axis=0)
+            changes = S if policy is None else int(np.count_nonzero(policy_new != policy))
+            policy = policy_new
+            unchanged = unchanged + 1 if changes == 0 else 0
+            if stats != None:
+                stats['residuals'].append(float(np.abs(V_new - V).max()))
+                stats['spans'].append(float(variation))
+                stats['policy_changes'].append(changes)
+                stats['times'].append(time.time() - start)
+
+        V = V_new
+        if variation < thresh:
+            if stats != None:
+                stats['stopped'] = 'epsilon'
+            break
+        if stable != None and unchanged >= stable:
+            if stats != None:
+                stats['stopped'] = 'stable'
+            break
+
+    if stats != None:
+        stats['iterations'] = len(stats['residuals'])
+        stats['time'] = time.time() - start
+    return V, Q.argmax(axis=0)
+
+
+"""
+    This function returns the convergence report of a stats dictionary filled by
+    value_iteration, one line per sweep
+"""
+def format_stats(stats):
+    lines = ['%d sweeps of at most %d, stopped by %s, %.4f s' % (stats['iterations'], stats['max_iter'],
+                                                                stats['stopped'], stats['time'])]
+    lines.append('sweep  residual      span          policy changes  time (s)')
+    for i in range(stats['iterations']):
+        lines.append('%-6d %-13.6g %-13.6g %-15d %.4f' % (i + 1, stats['residuals'][i], stats['spans'][i],
+                                                      stats['policy_changes'][i], stats['times'][i]))
+    return '\n'.join(lines)
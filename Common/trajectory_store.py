@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""
+Append-only columnar store for team trajectories. Every step of every episode is
+one row; each column is a typed numpy array written to disk in fixed size chunks
+(one .npy file per column per chunk), so old chunks are never rewritten and can be
+memory-mapped for analysis without loading the whole store. An episode index
+(first row, number of steps, configuration and true goal of each episode) and the
+list of configurations are kept next to the chunks.
+
+Reopening a store drops what a crashed writer left unfinished: episodes missing from
+the metadata and the rows of the episode that was open. Rows are kept in memory
+until their chunk is full. The full chunk, the index of the
+episodes finished so far (appended to the index file) and the metadata are then
+written, so writing costs the same for every episode however large the store is.
+flush() also writes the rows of the open chunk, and close() ends the current episode
+and flushes; call it when done recording.
+
+Layout of a store directory:
+    meta.json                  chunk size, number of goals, rows, episodes, configurations
+    episodes.bin               one row per episode (int64): id, config, first row, steps, goal
+    chunk_000000.state.npy     column 'state' of rows 0 .. chunk_size-1
+    ...
+"""
+
+import json
+import os
+import numpy as np
+
+#actor codes ('H' and 'R' as in the solution lists)
+ACTORS = {'H': 0, 'R': 1}
+
+#column names and types (probs has one column per goal)
+COLUMNS = [('episode', np.int64), ('step', np.int32), ('actor', np.int8), ('agent', np.int16),
+           ('state', np.int64), ('action', np.int16), ('next_state', np.int64),
+           ('goal', np.int64), ('prob', np.float32), ('probs', np.float32)]
+
+#columns of episodes.bin
+EPISODE_COLUMNS = ['episode', 'config', 'first', 'steps', 'goal']
+
+
+"""
+    This class implements the trajectory store
+"""
+class TrajectoryStore:
+    def __init__(self, path, num_goals=2, chunk_size=65536):
+        self.path = path
+
+        #reopen an existing store, its chunk size and number of goals win
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            self.chunk_size = meta['chunk_size']
+            self.num_goals = meta['num_goals']
+            self.rows = meta['rows']
+            self.configs = meta['configs']
+            #episodes appended after the metadata was last written (by a crashed writer) are dropped
+            size = meta['episodes'] * len(EPISODE_COLUMNS)
+            os.truncate(self.index_file(), size * 8)
+            index = np.fromfile(self.index_file(), dtype=np.int64, count=size)
+            self.index = index.reshape(-1, len(EPISODE_COLUMNS)).tolist()
+            #so are the rows of the episode it left open (in chunks written before the
+            #crash), so the next episode neither reuses their id nor follows them
+            self.rows = self.index[-1][2] + self.index[-1][3] if len(self.index) > 0 else 0
+        else:
+            os.makedirs(path, exist_ok=True)
+            open(self.index_file(), 'wb').close()
+            self.chunk_size = chunk_size
+            self.num_goals = num_goals
+            self.rows = 0
+            self.configs = []
+            self.index = []
+
+        #rows that are not yet in a full chunk are kept in memory
+        self.buffer = {}
+        for name, dtype in COLUMNS:
+            shape = (self.chunk_size, self.num_goals) if name == 'probs' else (self.chunk_size,)
+            self.buffer[name] = np.zeros(shape, dtype=dtype)
+        first = self.rows - self.rows % self.chunk_size
+        if first < self.rows:
+            for name, _ in COLUMNS:
+                column = np.load(self.chunk_file(first // self.chunk_size, name))
+                self.buffer[name][:self.rows - first] = column[:self.rows - first]
+
+        #episode being written, and number of episodes in the index file
+        self.current = None
+        self.saved = len(self.index)
+
+    def index_file(self):
+        return os.path.join(self.path, 'episodes.bin')
+
+    """
+        This function returns the file name of a column of a chunk
+    """
+    def chunk_file(self, chunk, name):
+        return os.path.join(self.path, 'chunk_%06d.%s.npy' % (chunk, name))
+
+    """
+        This function returns the id of a configuration (a dictionary of settings),
+        adding it to the store if it is new
+    """
+    def config_id(self, config):
+        config = json.loads(json.dumps(config, sort_keys=True))
+        if config not in self.configs:
+            self.configs.append(config)
+        return self.configs.index(config)
+
+    """
+        This function starts a new episode with the given configuration and true
+        goal, and returns its id
+    """
+    def begin_episode(self, config=None, goal=-1):
+        if self.current != None:
+            self.end_episode()
+        episode = len(self.index)
+        self.index.append([episode, self.config_id(config or {}), self.rows, 0, goal])
+        self.current = episode
+        return episode
+
+    """
+        This function appends one step ('H' or 'R' actor taking action at state and
+        moving to next_state) to the current episode. goal is the predicted goal,
+        prob its probability and probs the probabilities of all goals (-1 and NaN
+        if no prediction was made). agent numbers the humans and robots of a team
+    """
+    def append(self, actor, state, action, next_state, goal=-1, prob=np.nan, probs=None, agent=0):
+        entry = self.index[self.current]
+        i = self.rows % self.chunk_size
+
+        self.buffer['episode'][i] = self.current
+        self.buffer['step'][i] = entry[3]
+        self.buffer['actor'][i] = ACTORS[actor]
+        self.buffer['agent'][i] = agent
+        self.buffer['state'][i] = state
+        self.buffer['action'][i] = action
+        self.buffer['next_state'][i] = next_state
+        self.buffer['goal'][i] = goal
+        self.buffer['prob'][i] = prob
+        self.buffer['probs'][i] = np.nan if probs is None else probs
+
+        entry[3] += 1
+        self.rows += 1
+        #write the chunk out once it is full
+        if self.rows % self.chunk_size == 0:
+            self.write_chunk(self.chunk_size)
+            self.write_index()
+
+    """
+        This function ends the current episode (it is written with its chunk)
+    """
+    def end_episode(self):
+        self.current = None
+
+    """
+        This function writes the first n buffered rows as the last chunk
+    """
+    def write_chunk(self, n):
+        chunk = (self.rows - 1) // self.chunk_size
+        for name, _ in COLUMNS:
+            np.save(self.chunk_file(chunk, name), self.buffer[name][:n])
+
+    """
+        This function appends the finished episodes that are not in the index file
+        yet to it and writes the metadata
+    """
+    def write_index(self):
+        finished = len(self.index) if self.current == None else self.current
+        if finished > self.saved:
+            with open(self.index_file(), 'ab') as f:
+                f.write(np.array(self.index[self.saved:finished], dtype=np.int64).tobytes())
+            self.saved = finished
+        meta = {'chunk_size': self.chunk_size, 'num_goals': self.num_goals, 'rows': self.rows,
+                'episodes': self.saved, 'configs': self.configs}
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    """
+        This function writes the rows of the open chunk, the index of the finished
+        episodes and the metadata so the store can be read (or reopened) from disk.
+        The open chunk is rewritten by every flush
+    """
+    def flush(self):
+        n = self.rows % self.chunk_size
+        if n > 0:
+            self.write_chunk(n)
+        self.write_index()
+
+    """
+        This function ends the current episode and writes everything to disk
+    """
+    def close(self):
+        self.end_episode()
+        self.flush()
+
+    """
+        This function returns the episode index as a dictionary of arrays
+    """
+    def episode_index(self):
+        index = np.array(self.index, dtype=np.int64).reshape(-1, len(EPISODE_COLUMNS))
+        return {name: index[:, i] for i, name in enumerate(EPISODE_COLUMNS)}
+
+    """
+        This function returns the ids of the episodes whose configuration has all
+        the given settings, e.g. episodes(wL=0.05, depth=2)
+    """
+    def episodes(self, **settings):
+        ids = [i for i, c in enumerate(self.configs)
+               if all(k in c and c[k] == v for k, v in settings.items())]
+        index = self.episode_index()
+        return index['episode'][np.isin(index['config'], ids)]
+
+    """
+        This function returns rows first to last-1 of a column. Chunks on disk are
+        memory-mapped, so only the rows asked for are read
+    """
+    def read(self, name, first, last):
+        parts = []
+        written = self.rows - self.rows % self.chunk_size
+        while first < last:
+            chunk = first // self.chunk_size
+            start = first - chunk * self.chunk_size
+            stop = min(last - chunk * self.chunk_size, self.chunk_size)
+            if chunk * self.chunk_size < written:
+                parts.append(np.load(self.chunk_file(chunk, name), mmap_mode='r')[start:stop])
+            else:
+                parts.append(self.buffer[name][start:stop])
+            first += stop - start
+        if len(parts) == 1:
+            return parts[0]
+        if len(parts) == 0:
+            return self.buffer[name][:0]
+        return np.concatenate(parts)
+
+    """
+        This function returns the given columns (all by default) of one episode
+    """
+    def episode(self, episode, columns=None):
+        (_, _, first, steps, _) = self.index[episode]
+        return {name: self.read(name, first, first + steps) for name in (columns or [c for c, _ in COLUMNS])}
+
+    """
+        This function goes through the store one chunk at a time and yields the
+        given columns (all by default) of each chunk, so memory use does not
+        depend on the size of the store
+    """
+    def scan(self, columns=None):
+        for first in range(0, self.rows, self.chunk_size):
+            last = min(first + self.chunk_size, self.rows)
+            yield {name: self.read(name, first, last) for name in (columns or [c for c, _ in COLUMNS])}
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""
+Compact storage for per-goal tables (state values, policies). All tables are kept
+in one contiguous (tables, states) numpy array of a chosen type, identical tables
+are stored once, and store[goal][state] works as it does for the dictionaries of
+tuples the solvers produce (returning Python numbers).
+
+Float tables can be kept as float64 (exact), float32, or quantized to an integer
+type (int16 by default) with a per-table offset and scale. Integer tables (policies)
+are stored exactly in a smaller integer type. The largest difference between a
+stored and an original value is kept for every goal in errors. Error bounds:
+
+- float32: at most |v| * 2**-24 per value (about 6e-6 for values around 100)
+- quantized int16: at most (max - min) / 131070 per value (half a quantization step)
+
+With values off by at most e, the goal probabilities of SCA.CG_markov (built from
+value differences) keep their most likely goal unless its value gain was within
+4e of another goal's, and the Value term of SCA.action_scores (value differences
+divided by the largest difference max_V) moves by at most about 2e / max_V, so the
+robot's chosen action can only change where the two best action scores are within
+4 * wV * e / max_V of each other.
+"""
+
+import hashlib
+import json
+import numpy as np
+
+
+"""
+    This class gives [state] access to one stored table
+"""
+class ValueRow:
+    def __init__(self, data, offset=None, scale=None):
+        self.data = data
+        self.offset = offset
+        self.scale = scale
+
+    def __getitem__(self, s):
+        if self.scale == None:
+            return self.data[s].item()
+        return self.offset + self.scale * self.data[s].item()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.array().tolist())
+
+    """
+        This function returns the table as a numpy array (float64 if quantized)
+    """
+    def array(self):
+        if self.scale == None:
+            return self.data
+        return self.offset + self.scale * self.data.astype(np.float64)
+
+
+"""
+    This class implements the table store
+"""
+class ValueStore:
+    def __init__(self, tables=None, dtype='float64'):
+        self.dtype = np.dtype(dtype)
+        self.goals = []
+        self.row_of = {} #row of data holding each goal's table
+        self.errors = {} #largest difference between stored and original value of each goal
+        self.offsets = []
+        self.scales = []
+
+        rows = []
+        seen = {}
+        for g, table in (tables or {}).items():
+            v = np.asarray(table)
+            stored, offset, scale = self.convert(v)
+
+            #identical tables share one row
+            key = hashlib.sha1(stored.tobytes()).hexdigest()
+            row = None
+            for r in seen.get(key, []):
+                if self.offsets[r] == offset and self.scales[r] == scale and np.array_equal(rows[r], stored):
+                    row = r
+            if row == None:
+                row = len(rows)
+                rows.append(stored)
+                self.offsets.append(offset)
+                self.scales.append(scale)
+                seen.setdefault(key, []).append(row)
+
+            self.goals.append(g)
+            self.row_of[g] = row
+            self.errors[g] = float(np.abs(ValueRow(stored, offset, scale).array() - v).max()) if len(v) > 0 else 0.0
+
+        self.data = np.array(rows, dtype=self.dtype)
+        self.make_rows()
+
+    """
+        This function converts a table to the store's type. Float tables going to an
+        integer type are quantized between their minimum and maximum
+    """
+    def convert(self, v):
+        if self.dtype.kind == 'f':
+            return v.astype(self.dtype), None, None
+        if v.dtype.kind != 'f':
+            stored = v.astype(self.dtype)
+            if not np.array_equal(stored, v):
+                raise ValueError('table does not fit in ' + str(self.dtype))
+            return stored, None, None
+
+        info = np.iinfo(self.dtype)
+        lo = float(v.min())
+        scale = (float(v.max()) - lo) / (int(info.max) - int(info.min))
+        if scale == 0:
+            scale = 1.0
+        q = np.round((v - lo) / scale) + info.min
+        return q.astype(self.dtype), lo - info.min * scale, scale
+
+    """
+        This function builds the [goal] views of the stored rows
+    """
+    def make_rows(self):
+        self.rows = {}
+        for g in self.goals:
+            r = self.row_of[g]
+            self.rows[g] = ValueRow(self.data[r], self.offsets[r], self.scales[r])
+
+    def __getitem__(self, g):
+        return self.rows[g]
+
+    def __iter__(self):
+        return iter(self.goals)
+
+    def __len__(self):
+        return len(self.goals)
+
+    def __contains__(self, g):
+        return g in self.rows
+
+    def keys(self):
+        return list(self.goals)
+
+    def items(self):
+        return [(g, self.rows[g]) for g in self.goals]
+
+    """
+        This function returns the table of goal g as a numpy array
+    """
+    def array(self, g):
+        return self.rows[g].array()
+
+    """
+        This function writes the store to path.npy (the tables) and path.json
+    """
+    def save(self, path):
+        np.save(path + '.npy', self.data)
+        meta = {'dtype': self.dtype.str, 'goals': self.goals, 'rows': [self.row_of[g] for g in self.goals],
+                'offsets': self.offsets, 'scales': self.scales, 'errors': [self.errors[g] for g in self.goals]}
+        with open(path + '.json', 'w') as f:
+            json.dump(meta, f)
+
+    """
+        This function reads a store written by save. With mmap the tables are
+        memory-mapped, so processes loading the same file share its memory
+    """
+    @staticmethod
+    def load(path, mmap=True):
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        store = ValueStore(dtype=meta['dtype'])
+        store.data = np.load(path + '.npy', mmap_mode='r' if mmap else None)
+        store.goals = meta['goals']
+        store.row_of = dict(zip(store.goals, meta['rows']))
+        store.errors = dict(zip(store.goals, meta['errors']))
+        store.offsets = meta['offsets']
+        store.scales = meta['scales']
+        store.make_rows()
+        return store
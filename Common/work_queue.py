@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+
+"""
+Work queue on a shared directory, for running sweeps with workers on several hosts
+(or several local processes pointing at one temporary directory). Layout of root:
+
+- tasks/<task>.json: one file per task (its settings)
+- claims/<task>.lock: held by the worker running the task, created with O_EXCL so
+  only one worker can claim a task (atomic on local filesystems and NFSv3 or later).
+  It holds the owner and the time of the claim, and is never rewritten
+- claims/<task>.lock.<host>-<pid>-<claim time>.beat: heartbeat of the claim's owner
+- done/<task>: written once the task's result is safely stored
+- results/<worker>.jsonl: results of each worker, one JSON line per task
+- artifacts/<name>/: solved tables and other inputs, built once and shared
+
+A running worker rewrites the heartbeat time in its own heartbeat file every
+heartbeat seconds, so a worker that lost its claim never overwrites the claim of
+the worker that took it over. A claim whose contents and heartbeat another worker
+sees unchanged for timeout seconds (of its own clock, so the clocks of the hosts do
+not have to agree) belongs to a crashed worker: that worker moves it aside (a
+rename, so only one of them succeeds) and runs the task again. Workers only remove
+claims they still own. A task
+can run twice when a worker crashes after storing its result but before marking
+the task done (or, rarely, when two workers take over the same abandoned claim at
+once); merge keeps one result per task and ignores result lines cut off by a
+crash, so merged results hold every task exactly once.
+"""
+
+import glob
+import itertools
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+
+
+"""
+    This function returns one task (dictionary of settings) for every combination
+    of the given values, e.g. sweep_tasks(wV=[0.5, 0.9], human_goal=[0, 1])
+"""
+def sweep_tasks(**grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[n] for n in names])]
+
+
+"""
+    This function writes a file so that readers never see it half written
+"""
+def write_atomic(path, text):
+    tmp = '%s.tmp.%s.%d' % (path, socket.gethostname(), os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+"""
+    This function removes a file, if it exists
+"""
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+"""
+    This function returns the contents of a lock as a dictionary (empty if the lock
+    is still being written)
+"""
+def lock_info(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return {}
+
+
+"""
+    This class implements the work queue
+"""
+class WorkQueue:
+    def __init__(self, root, timeout=60.0, heartbeat=10.0, poll=1.0):
+        self.root = root
+        self.timeout = timeout #seconds without a heartbeat before a claim counts as abandoned
+        self.heartbeat = heartbeat
+        self.poll = poll #seconds between looks for claimable tasks
+        for d in ('tasks', 'claims', 'done', 'results', 'artifacts'):
+            os.makedirs(os.path.join(root, d), exist_ok=True)
+
+        #artifacts already loaded by this process
+        self.loaded = {}
+        #locks held by this process (owner and claim time by path), and the contents
+        #of other locks with the time this process first saw them
+        self.held = {}
+        self.seen = {}
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    """
+        This function adds tasks (dictionaries of settings) numbered from start and
+        returns their ids. Adding the same numbers again keeps the existing tasks
+    """
+    def add(self, tasks, start=0):
+        ids = []
+        for i, task in enumerate(tasks):
+            task_id = '%08d' % (start + i)
+            path = self.path('tasks', task_id + '.json')
+            if not os.path.exists(path):
+                write_atomic(path, json.dumps(task))
+            ids.append(task_id)
+        return ids
+
+    def task_ids(self):
+        return sorted(os.path.basename(p)[:-5] for p in glob.glob(self.path('tasks', '*.json')))
+
+    def task(self, task_id):
+        with open(self.path('tasks', task_id + '.json')) as f:
+            return json.load(f)
+
+    def is_done(self, task_id):
+        return os.path.exists(self.path('done', task_id))
+
+    def pending(self):
+        return [t for t in self.task_ids() if not self.is_done(t)]
+
+    """
+        This function creates the lock at path for owner, unless it exists. Returns
+        whether it was created
+    """
+    def create_lock(self, path, owner):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        now = time.time()
+        self.held[path] = {'owner': owner, 'host': socket.gethostname(), 'pid': os.getpid(), 'claimed': now}
+        os.write(fd, json.dumps(dict(self.held[path], time=now)).encode())
+        os.close(fd)
+        return True
+
+    """
+        This function returns the contents of the lock at path, or None if there is
+        no lock
+    """
+    def read_lock(self, path):
+        try:
+            with open(path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    """
+        This function returns the heartbeat file of the owner of the lock at path,
+        given the lock's contents info
+    """
+    def beat_path(self, path, info):
+        return '%s.%s-%s-%s.beat' % (path, info.get('host'), info.get('pid'), info.get('claimed'))
+
+    """
+        This function returns whether this process still owns the lock at path (it
+        may have been taken over after a missed heartbeat)
+    """
+    def holds(self, path):
+        if path not in self.held:
+            return False
+        info = lock_info(self.read_lock(path) or '')
+        return info.get('owner') == self.held[path]['owner'] and info.get('claimed') == self.held[path]['claimed']
+
+    """
+        This function removes the heartbeat file of this process for the lock at
+        path, and the lock if this process still owns it
+    """
+    def unlock(self, path):
+        if self.holds(path):
+            remove(path)
+        if path in self.held:
+            remove(self.beat_path(path, self.held.pop(path)))
+
+    """
+        This function returns whether the lock at path is abandoned: its contents
+        and its owner's heartbeat have not changed for timeout seconds since this
+        process first saw them
+    """
+    def is_stale(self, path):
+        text = self.read_lock(path)
+        if text == None:
+            self.seen.pop(path, None)
+            return False
+        text += '\n' + str(self.read_lock(self.beat_path(path, lock_info(text))))
+        now = time.time()
+        if path not in self.seen or self.seen[path][0] != text:
+            self.seen[path] = (text, now)
+            return False
+        return now - self.seen[path][1] > self.timeout
+
+    """
+        This function moves the lock at path aside if it is abandoned, and removes
+        its owner's heartbeat
+    """
+    def clear_stale(self, path, worker):
+        if self.is_stale(path):
+            stale = '%s.stale.%s' % (path, worker)
+            try:
+                os.rename(path, stale)
+            except OSError:
+                #another worker moved it aside first
+                pass
+            else:
+                remove(self.beat_path(path, lock_info(self.read_lock(stale) or '')))
+            self.seen.pop(path, None)
+
+    """
+        This function tries to claim a task for worker. An abandoned claim is moved
+        aside first. Returns whether the claim succeeded
+    """
+    def try_claim(self, task_id, worker):
+        lock = self.path('claims', task_id + '.lock')
+        self.clear_stale(lock, worker)
+        if not self.create_lock(lock, worker):
+            return False
+        #the task may have finished between the look at done/ and the claim
+        if self.is_done(task_id):
+            self.release(task_id)
+            return False
+        return True
+
+    """
+        This function returns a task claimed for worker, or None if no task can be
+        claimed now
+    """
+    def claim(self, worker):
+        for task_id in self.pending():
+            if self.try_claim(task_id, worker):
+                return task_id
+        return None
+
+    def release(self, task_id):
+        self.unlock(self.path('claims', task_id + '.lock'))
+
+    """
+        This function rewrites the heartbeat time of the lock at path (a claim or an
+        artifact lock) until stop is set, or until another worker takes it over. The
+        heartbeat goes to this process's own file, so it cannot overwrite the lock
+        of a worker that took over between the check and the write
+    """
+    def keep_alive(self, path, stop):
+        beat = self.beat_path(path, self.held[path])
+        while not stop.wait(self.heartbeat):
+            if not self.holds(path):
+                break
+            write_atomic(beat, json.dumps({'time': time.time()}))
+
+    """
+        This function runs tasks as worker until every task is done: work(task,
+        context) returns the (JSON serializable) result of a task, and context is
+        what setup() returns (e.g. solved tables loaded with artifact). Waits for
+        tasks claimed by other workers, since their workers may have crashed.
+        Returns the number of tasks this worker ran
+    """
+    def run(self, work, worker=None, setup=None, max_tasks=None):
+        if worker == None:
+            worker = '%s-%d' % (socket.gethostname(), os.getpid())
+        context = setup() if setup != None else None
+        results = open(self.path('results', worker + '.jsonl'), 'a+')
+        #end a line cut off when this worker crashed before, so the next one stays whole
+        if results.tell() > 0:
+            results.seek(results.tell() - 1)
+            if results.read(1) != '\n':
+                results.write('\n')
+        ran = 0
+        try:
+            while max_tasks == None or ran < max_tasks:
+                task_id = self.claim(worker)
+                if task_id == None:
+                    if len(self.pending()) == 0:
+                        break
+                    time.sleep(self.poll)
+                    continue
+
+                stop = threading.Event()
+                lock = self.path('claims', task_id + '.lock')
+                beat = threading.Thread(target=self.keep_alive, args=(lock, stop), daemon=True)
+                beat.start()
+                try:
+                    start = time.time()
+                    result = work(self.task(task_id), context)
+                    results.write(json.dumps({'task': task_id, 'worker': worker, 'time': time.time() - start,
+                                              'result': result}) + '\n')
+                    results.flush()
+                    os.fsync(results.fileno())
+                    write_atomic(self.path('done', task_id), worker)
+                finally:
+                    stop.set()
+                    beat.join()
+                    self.release(task_id)
+                ran += 1
+        finally:
+            results.close()
+        return ran
+
+    """
+        This function returns artifact name, built once by build(path) (which writes
+        files into the directory path) and read by load(path). One worker builds it
+        while the others wait; each process loads it once
+    """
+    def artifact(self, name, build, load):
+        if name in self.loaded:
+            return self.loaded[name]
+        final = self.path('artifacts', name)
+        lock = final + '.lock'
+        owner = '%s-%d' % (socket.gethostname(), os.getpid())
+        while not os.path.exists(final):
+            self.clear_stale(lock, owner)
+            if not self.create_lock(lock, owner):
+                time.sleep(self.poll)
+                continue
+
+            #build into a private directory and move it in place in one step
+            tmp = '%s.tmp.%s.%d' % (final, socket.gethostname(), os.getpid())
+            stop = threading.Event()
+            beat = threading.Thread(target=self.keep_alive, args=(lock, stop), daemon=True)
+            beat.start()
+            try:
+                shutil.rmtree(tmp, ignore_errors=True)
+                os.makedirs(tmp)
+                build(tmp)
+                if not os.path.exists(final):
+                    os.rename(tmp, final)
+            finally:
+                stop.set()
+                beat.join()
+                shutil.rmtree(tmp, ignore_errors=True)
+                self.unlock(lock)
+        self.loaded[name] = load(final)
+        return self.loaded[name]
+
+    """
+        This function combines the results of all workers, one per task in task
+        order (the first stored result of a task that ran twice), writes them to
+        results.jsonl in root and returns them with the ids of tasks without one
+    """
+    def merge(self):
+        merged = {}
+        for path in sorted(glob.glob(self.path('results', '*.jsonl'))):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        #line cut off by a crash
+                        continue
+                    if row['task'] not in merged:
+                        merged[row['task']] = row
+        rows = [merged[t] for t in sorted(merged)]
+        write_atomic(self.path('results.jsonl'), ''.join(json.dumps(row) + '\n' for row in rows))
+        missing = [t for t in self.task_ids() if t not in merged]
+        return rows, missing
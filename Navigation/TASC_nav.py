@@ -7,20 +7,30 @@ goal probabilities.
 """
 
 import numpy as np
+import os
+import sys
 from mdp import MDP
-from scipy.spatial.distance import euclidean
+from nav_problem import NavigationProblem
 import random
 
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from engine import Engine
+
 
 """
     This class implements the SCA algorithm
 """
 class SCA:
-    def __init__(self, wV=0.9, wE=0.05, wL=0.05):
+    def __init__(self, wV=0.9, wE=0.05, wL=0.05, depth=1, discount=0.9,
+                 table_size=100000, bucket=10, beam=None, slip=0.0, drift=0.0, fast=False, rng=None, mdp=None):
         random.seed()
 
-        #create instance of problem MDP
-        self.mdp = MDP()
+        #create instance of problem MDP (slip and drift make the moves noisy), unless a solved one is given
+        if mdp == None:
+            mdp = MDP(slip=slip, drift=drift, fast=fast)
+        self.mdp = mdp
 
         #pull out variables from MDP
         self.S = self.mdp.states #number of states
@@ -51,6 +61,10 @@ class SCA:
         self.wE = wE
         self.wL = wL
 
+        #goal prediction and action scores come from the engine (rules in nav_problem.py)
+        self.problem = NavigationProblem(self.mdp)
+        self.engine = Engine(self.problem, wV, wE, wL).set_tables(self.Vs_robot, self.policies)
+
         #set current state and previous state
         self.s = None
         self.s_old = None
@@ -62,6 +76,48 @@ class SCA:
         #for printing
         self.move_strings = {0 : 'up', 1 : 'up right', 2 : 'right', 3 : 'left', 4 : 'up left', 5 : 'idle'}
 
+        #lookahead settings: depth is the number of robot decisions planned ahead
+        #(1 plans only the next action), discount weighs later decisions, beam
+        #limits how many successors are expanded below the first decision
+        self.depth = depth
+        self.discount = discount
+        self.beam = beam
+
+        #best possible combined score of a single action (effort is at most 0.9)
+        self.max_score = self.wE*0.9 + self.wL + self.wV
+
+        #transposition table keyed on (state, posterior bucket, depth), kept in LRU order
+        self.table = OrderedDict()
+        self.table_size = table_size
+        self.bucket = bucket
+        self.search_stats = {'nodes': 0, 'hits': 0, 'pruned': 0}
+
+        #settings saved with every episode written to a trajectory store
+        self.config = {'task': 'navigation', 'wV': wV, 'wE': wE, 'wL': wL, 'depth': depth,
+                       'discount': discount, 'beam': beam, 'slip': self.mdp.slip, 'drift': self.mdp.drift}
+        self.store = None
+        #steps are not printed while they are recorded
+        self.quiet = False
+
+        #random choices (see set_rng) and the scores of the robot's last decision
+        self.set_rng(random if rng == None else rng)
+        self.scores = None
+
+    """
+        This function makes the robot's choices and the sampled outcomes use rng
+        (a random.Random, or the random module)
+    """
+    def set_rng(self, rng):
+        self.rng = rng
+        self.mdp.rng = rng
+
+    """
+        This function prints a step, unless steps are being recorded
+    """
+    def log(self, *args):
+        if not self.quiet:
+            print(*args)
+
     """
         This function returns the index location of a state in the mdp state space
     """
@@ -84,36 +140,11 @@ class SCA:
     """
         This function returns the legibility probability of goal G given a robot action a
     """
-    def PrG(self,G,a):
-        #set g to the goal that is not G (assumes two goals)
-        if G == self.G[0]:
-            g = self.G[1]
-        else:
-            g = self.G[0]
-
+    def PrG(self,G,a,s=None):
         #s is current state
-        s = self.s
-        #s_new is predicted new state given action a
-        s_new = self.mdp.act(a, self.s)
-
-        #d is the euclidean distance between the indices of G and s minus
-        #the euclidean distance between the indices of G and s_new
-        d = euclidean(self.square(G),self.square(s)) - euclidean(self.square(G),self.square(s_new))
-        #d2 is the euclidean distance between the indices of g and s minus
-        #the euclidean distance between the indices of g and s_new
-        d2 = euclidean(self.square(g),self.square(s)) - euclidean(self.square(g),self.square(s_new))
-
-        #if the distances are the same, both goals are equally likely
-        if d == d2:
-            return 0.5
-        #if s_new takes the robot farther from G and closer to g, 0% chance G is the goal
-        elif d<=0 and d2>0:
-            return 0
-        #if s_new takes the robot farther from g and closer to G, 100% chance G is the goal
-        elif d > 0 and d2 <= 0:
-            return 1
-        #otherwise, return a probability based on the distance between the two (could be changed)
-        return((d/d2)/((d/d2)+(d2/d)))
+        if s == None:
+            s = self.s
+        return self.problem.legibility(G, a, s)
 
 
     """
@@ -125,18 +156,9 @@ class SCA:
             r = 1#random.randint(0,len(self.G)-1)
             return (self.G[r],0.5)
 
-        max_g = []
-        max_pr = -1
-
-        for g in self.G:
-            p = self.PrG(g, a)
-            if p > max_pr:
-                max_g = [g]
-                max_pr = p
-            elif p == max_pr:
-                max_g.append(g)
+        (max_g, max_pr) = self.goal_probs(a, self.s)
 
-        return (max_g[random.randint(0,len(max_g)-1)], max_pr)
+        return (max_g[self.rng.randint(0,len(max_g)-1)], max_pr)
 
         """
         #set up all possible goals
@@ -164,6 +186,14 @@ class SCA:
         return (self.Gp,p)
         """
 
+    """
+        This function returns the most likely goals and their probability for action a
+        at state s (see NavigationProblem.goal_probs)
+    """
+    def goal_probs(self, a, s):
+        (max_g, max_pr, _) = self.engine.goal_probs(s, self.s_old, a)
+        return (max_g, max_pr)
+
     """
         This function returns an action prediction based on the goal
     """
@@ -173,7 +203,7 @@ class SCA:
         poss_actions.append(self.policies[G][self.s])
 
         #return a random possible action
-        r = random.randint(0,len(poss_actions)-1)
+        r = self.rng.randint(0,len(poss_actions)-1)
 
         return poss_actions[r]
 
@@ -182,12 +212,13 @@ class SCA:
         #choose human action based on the policies
         self.aH = self.policies[self.human_goal][self.s]
         #calculate new state
-        s_new = self.mdp.act(self.aH, self.s)
+        s_new = self.mdp.sample(self.aH, self.s)
         #print("s_new:", s_new)
 
         #append the indices of the new visited states to the solution (first human action, then robot action)
-        sol.append((self.square(self.mdp.act(self.aH,self.s)), 'H'))
-        print("STATE human:",self.square(self.s)," AH:", self.move_strings[self.aH])
+        sol.append((self.square(s_new), 'H'))
+        self.record('H', self.s, self.aH, s_new)
+        self.log("STATE human:",self.square(self.s)," AH:", self.move_strings[self.aH])
 
         #save old state, new state
         self.s_old = self.s
@@ -202,60 +233,21 @@ class SCA:
         #robot action
         aR = None
 
-        #predict the human's goal and action
+        #predict the human's goal
         (self.Gp,p) = self.CG(self.aH)
-        ap = self.CA(self.Gp)
-        print("Predicted goal:",self.Gp, " Prob:", p)
+        self.log("Predicted goal:",self.Gp, " Prob:", p)
+
+        #score every action, then look further ahead if asked to
+        succ, vals, Ls = self.action_scores(self.s, self.Gp, p)
+        for a in range(self.AR):
+            self.log(str(self.move_strings[a]) + " " + str(Ls[a]))
+        if self.depth > 1:
+            vals = self.lookahead(succ, vals, p)
+        self.scores = list(vals)
 
         #look through all possible actions
         for a in range(self.AR):
-            #see what the next state would be
-            s_new = self.mdp.act(a, self.s)
-            #see what the next state would be after one predicted action by human
-            #s_one = self.mdp.act(ap,self.s)
-            #calculate probability of effort
-            E = self.PrE(a, self.s, s_new)
-
-            """
-            #if the probability of both goals is 0, then legibility is 0
-            if ((self.PrG(self.G[0],a) + self.PrG(self.G[1],a))) == 0:
-                L = 0
-            #otherwise if both goals are possible
-            elif p == 0.5:
-                #calculate legibility
-                L = (0.5*self.PrG(self.G[0],a) + 0.5*self.PrG(self.G[1],a) + 1 - abs(self.PrG(self.G[0],a)-self.PrG(self.G[1],a)))/2
-            #otherwise if only one goal is possible
-            else:
-                #calculate legibility
-                L = (self.PrG(self.G[0],a) + 1 - abs(self.PrG(self.G[0],a)-self.PrG(self.G[1],a)- 1))/2
-            """
-            if self.Gp == 92:
-                L = p * self.PrG(self.Gp, a) + (1 - p) * self.PrG(98, a)
-            else:
-                L = p * self.PrG(self.Gp, a) + (1 - p) * self.PrG(92, a)
-            print(str(self.move_strings[a]) + " " + str(L))
-
-            #calculate value of new state for both goals
-            v0 = (self.Vs_robot[self.G[0]][s_new]/self.maxVs[self.G[0]])
-            v1 = (self.Vs_robot[self.G[1]][s_new]/self.maxVs[self.G[1]])
-            """
-            #if value of both is zero, set V to 0
-            if (v0 + v1 == 0):
-                V = 0
-            #else if both goals are possible, calculate V
-            elif p == 0.5:
-                V = (0.5*v0+0.5*v1+1 - abs(v0-v1))/2
-            #else if only one goal is possible, calculate V
-            else:
-                V = (v0+1 - abs(v0-v1- 1))/2
-            """
-            if self.Gp == 92:
-                V = p * v0 + (1 - p) * v1
-            else:
-                V = p * v1 + (1 - p) * v0
-
-            #combined value of Effort, Legibility, and Value
-            val = self.wE*E + self.wL*L + self.wV*V
+            val = vals[a]
 
             #if the value of this action is greater than previously seen, save it
             if val > mx:
@@ -265,25 +257,140 @@ class SCA:
                 maxes.append(a)
 
         #choose a random one of the max valued actions
-        aR = maxes[random.randint(0,len(maxes)-1)]
+        aR = maxes[self.rng.randint(0,len(maxes)-1)]
 
 
-        sol.append((self.square(self.mdp.act(aR,self.s)), 'R'))
-        print("STATE robot:",self.square(self.s)," AR:", self.move_strings[aR])
-        s_new = self.mdp.act(aR,self.s)
+        s_new = self.mdp.sample(aR,self.s)
+        sol.append((self.square(s_new), 'R'))
+        self.record('R', self.s, aR, s_new, self.Gp, p, [p if g == self.Gp else 1 - p for g in self.G])
+        self.log("STATE robot:",self.square(self.s)," AR:", self.move_strings[aR])
 
         #save old state, new state
         self.s = s_new
 
+    """
+        This function saves a step in the trajectory store, if there is one
+    """
+    def record(self, actor, s, a, s_new, Gp=-1, p=np.nan, probs=None):
+        if self.store != None:
+            self.store.append(actor, s, a, s_new, Gp, p, probs)
+
+    """
+        This function returns the next state, the combined value of Effort, Legibility,
+        and Value, and the legibility for every robot action from state s, given the
+        predicted goal Gp and its probability p (see NavigationProblem.action_scores)
+    """
+    def action_scores(self, s, Gp, p):
+        return self.engine.action_scores(s, Gp, [p if g == Gp else 1 - p for g in self.G])
+
+    """
+        This function adds the discounted value of the next depth-1 robot decisions
+        to the score of every action from the current state. Actions whose score
+        cannot beat the best one even with perfect future decisions are pruned
+        and get a value of -inf
+    """
+    def lookahead(self, succ, scores, p):
+        self.search_stats = {'nodes': 0, 'hits': 0, 'pruned': 0}
+        bound = self.future_bound(self.depth - 1)
+
+        #expand each distinct next state once, most promising first
+        order = sorted(set(succ), key=lambda s_new: -scores[succ.index(s_new)])
+        best = -np.inf
+        values = {}
+        for s_new in order:
+            score = scores[succ.index(s_new)]
+            if score + bound < best:
+                self.search_stats['pruned'] += 1
+                continue
+            values[s_new] = score + self.discount * self.respond(s_new, self.Gp, p, self.depth - 1)
+            best = max(best, values[s_new])
+
+        return [values.get(s_new, -np.inf) for s_new in succ]
+
+    """
+        This function returns the expected value of the robot's next depth decisions
+        after the human responds from state s, with the human following the policy
+        of the predicted goal Gp with probability p and of the other goal otherwise
+    """
+    def respond(self, s, Gp, p, depth):
+        if depth == 0:
+            return 0
+        if s == self.S - 1 or s in self.G:
+            return self.future_bound(depth) / self.discount
+
+        #group the goals by the state the human's predicted action leads to
+        outcomes = {}
+        for g in self.G:
+            w = p if g == Gp else 1 - p
+            if w > 0:
+                aH = self.policies[g][s]
+                s_h = self.mdp.act(aH, s)
+                (w_old, _) = outcomes.get(s_h, (0, aH))
+                outcomes[s_h] = (w_old + w, aH)
+
+        v = 0
+        for s_h, (w, aH) in outcomes.items():
+            if s_h == self.S - 1 or s_h in self.G:
+                v += w * self.future_bound(depth) / self.discount
+                continue
+            #predict the goal again from the predicted human move
+            (max_g, p_h) = self.goal_probs(aH, s_h)
+            v += w * self.plan(s_h, max_g[0], p_h, depth)
+        return v
+
+    """
+        This function returns the value of the best robot action from state s with
+        depth robot decisions left, using the transposition table
+    """
+    def plan(self, s, Gp, p, depth):
+        key = (s, Gp, int(round(p * self.bucket)), depth)
+        if key in self.table:
+            self.table.move_to_end(key)
+            self.search_stats['hits'] += 1
+            return self.table[key]
+        self.search_stats['nodes'] += 1
+
+        succ, scores, _ = self.action_scores(s, Gp, p)
+        bound = self.future_bound(depth - 1)
+
+        order = sorted(set(succ), key=lambda s_new: -scores[succ.index(s_new)])
+        if self.beam != None:
+            self.search_stats['pruned'] += max(0, len(order) - self.beam)
+            order = order[:self.beam]
+
+        best = -np.inf
+        for s_new in order:
+            score = scores[succ.index(s_new)]
+            if score + bound < best:
+                self.search_stats['pruned'] += 1
+                continue
+            best = max(best, score + self.discount * self.respond(s_new, Gp, p, depth - 1))
+
+        self.table[key] = best
+        if len(self.table) > self.table_size:
+            self.table.popitem(last=False)
+        return best
 
     """
-        This function picks the actions for each teammate
+        This function returns the most the next depth robot decisions can add to
+        the value of an action
     """
-    def team(self, h_act, r_act):
+    def future_bound(self, depth):
+        return sum(self.max_score * self.discount**i for i in range(1, depth + 1))
+
+
+    """
+        This function picks the actions for each teammate. If a trajectory store is
+        given, every step is written to it instead of printing the steps and the solution.
+        The episode starts at state s (4 if not given)
+    """
+    def team(self, h_act, r_act, store=None, s=None):
         #start at a random state (or choose a state here)
-        self.s = random.randint(0,self.mdp.l-1)
-        #for these experiments I started at state 4
-        self.s = 4
+        self.s = self.rng.randint(0,self.mdp.l-1)
+        #for these experiments I started at state 4 (unless s is given)
+        self.s = 4 if s == None else s
+        self.s_old = None
+        self.aH = None
 
         #start at time 0
         t = 0
@@ -292,6 +399,10 @@ class SCA:
         sol = []
         #start by appending the indices of the initial state
         sol.append(self.square(self.s))
+        self.store = store
+        self.quiet = store != None
+        if store != None:
+            store.begin_episode(self.config, self.human_goal)
         #while not in the last state (a terminal state that all goals lead to)
         while self.s != self.S - 1:
             if r_act(t) == True:
@@ -301,10 +412,14 @@ class SCA:
 
             #increase time by 1
             t += 1
-            print(t)
+            self.log(t)
 
         #print the total solution
-        print(sol)
+        if store != None:
+            store.end_episode()
+            self.store = None
+        else:
+            print(sol)
 
         return sol
 
@@ -321,4 +436,5 @@ def main():
     sca.team(h_act, r_act)
 
 
-main()
+if __name__ == '__main__':
+    main()
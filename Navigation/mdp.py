@@ -1,24 +1,64 @@
 #!/usr/bin/env python
 
-import mdptoolbox
 import numpy as np
 import math
+import os
+import random
+import sys
+import scipy.sparse as sp
 from copy import deepcopy
+from collections import deque
+
+import nav_kernels
+import nav_map
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+import solver
+
+"""
+    This function does value iteration (see solver.value_iteration for stable and
+    stats) and returns the values and the policy as tuples
+"""
+def value_iteration(P, R, gamma, epsilon=0.01, stable=None, stats=None):
+    V, policy = solver.value_iteration(P, R, gamma, epsilon, stable, stats)
+    return tuple(V.tolist()), tuple(policy.tolist())
 
 """
     This class implements an MDP for a two-goal 10x10 state space
 """
 class MDP:
-    def __init__(self):
+    def __init__(self, slip=0.0, drift=0.0, fast=False, stable=None, layout=None, solve=True):
         #define state space
         self.actions = 6 #number of possible actions
-        self.l = 10 #the state space is 10x10
-        self.states = (self.l**2) + 1 #total number of states
-        self.goals = [92,98] #goal states
-        self.obstacles = [64] #where obstacles are located
+
+        #grid size, goals and obstacles come from a layout (see nav_map.py), by
+        #default the one named 'mdp' in layouts.jsonl
+        if layout == None:
+            layout = nav_map.named_layout('mdp')
+        self.l = layout.l
+        self.states = layout.states #total number of states
+        self.goals = layout.goals() #goal states
+        self.obstacles = layout.obstacles() #where obstacles are located
         
-        #initialize transition matrix
-        self.P = np.zeros([self.actions,self.states,self.states])
+        #probability that a move fails and the agent stays in place, and probability
+        #that it drifts to the cell of a neighbouring direction instead
+        self.slip = slip
+        self.drift = drift
+
+        #random numbers for sampling outcomes (the random module unless a
+        #random.Random is set, e.g. one per episode for reproducible runs)
+        self.rng = random
+
+        #neighbouring directions of each move, fanning west, northwest, north, northeast, east
+        self.drift_actions = {0 : [1, 4], 1 : [0, 2], 2 : [1], 3 : [4], 4 : [0, 3]}
+
+        #initialize transition matrices, one sparse (states x states) matrix per action
+        self.P = None
+
+        #use the compiled kernels in nav_kernels (plain Python if Numba is missing)
+        self.fast = fast
+        self.blocked = None
+        self.is_goal = None
         
         #initialize reward for both the human and the robot
         self.R_human = -1 * np.ones(self.states)
@@ -26,6 +66,12 @@ class MDP:
         
         #set gamma for learning
         self.gamma = 0.9
+
+        #stop value iteration once the policy has been stable for this many sweeps
+        #(None solves to epsilon), and convergence stats of every solve, indexed by
+        #('human', goal), ('robot', goal) and ('robot', None) (see solver.value_iteration)
+        self.stable = stable
+        self.solve_stats = {}
         
         #initialize values states
         self.V = None
@@ -36,8 +82,8 @@ class MDP:
         self.policy = None
         self.policies = {}
         
-        #set up mdp information
-        self.setup()
+        #set up mdp information (without solving, the tables are read with load)
+        self.setup(solve)
         #print("state space", self.states)
         
         
@@ -62,23 +108,26 @@ class MDP:
         This function returns the next state given the current state and action
     """     
     def act(self,a,s):
+        if self.fast:
+            return nav_kernels.act(a, s, self.l, self.states, self.blocked, self.is_goal)
+        #obstacles and goals are looked up in the bitmaps made by make_maps
         #if s is a goal state or the terminal state, go to terminal state no matter what action is taken
-        if s in self.goals or s == self.states - 1:
+        if s == self.states - 1 or self.is_goal[s]:
             return self.states - 1
         #if a=0, try to move north
-        elif a == 0 and s + self.l < self.states-1 and s + self.l not in self.obstacles:
+        elif a == 0 and s + self.l < self.states-1 and not self.blocked[s + self.l]:
             return s + self.l
         #if a=1, try to move northeast
-        elif a == 1 and s + self.l + 1 < self.states-1 and (s%self.l) < (self.l-1) and s + self.l + 1 not in self.obstacles:
+        elif a == 1 and s + self.l + 1 < self.states-1 and (s%self.l) < (self.l-1) and not self.blocked[s + self.l + 1]:
             return s + self.l + 1
         #if a=2, try to move east
-        elif a == 2 and s + 1 < self.states-1 and (s%self.l) < (self.l-1) and s + 1 not in self.obstacles:
+        elif a == 2 and s + 1 < self.states-1 and (s%self.l) < (self.l-1) and not self.blocked[s + 1]:
             return s + 1
         #if a=3, try to move west
-        elif a == 3 and s-1 > 0 and (s%self.l) > 0 and s - 1 not in self.obstacles:
+        elif a == 3 and s-1 > 0 and (s%self.l) > 0 and not self.blocked[s - 1]:
             return s - 1
         #if a=3, try to move northwest
-        elif a == 4 and s + self.l - 1 < self.states-1 and (s%self.l) > 0 and s + self.l - 1 not in self.obstacles:
+        elif a == 4 and s + self.l - 1 < self.states-1 and (s%self.l) > 0 and not self.blocked[s + self.l - 1]:
             return s + self.l - 1
         #if a=5, stay
         elif a == 5:
@@ -90,25 +139,144 @@ class MDP:
         This function makes the transition probability matrix
     """ 
     def make_transition(self):
-        for a in range(self.actions):
-            for s in range(self.states):
-                #no probability of failure, so 100% chance of transitioning to desired state
-                self.P[a,s,self.act(a,s)] = 1
+        self.P = [self.transition_matrix(a) for a in range(self.actions)]
+
+    """
+        This function returns the possible outcomes of action a as (action whose move
+        happens, probability) pairs
+    """
+    def outcomes(self, a):
+        #idle always stays, and without noise every move succeeds
+        if a == 5 or (self.slip == 0 and self.drift == 0):
+            return [(a, 1.0)]
+        out = [(a, 1.0 - self.slip - self.drift), (5, self.slip)]
+        for b in self.drift_actions[a]:
+            out.append((b, self.drift / len(self.drift_actions[a])))
+        return [(b, p) for (b, p) in out if p > 0]
+
+    """
+        This function returns the next state of every state for action a, vectorized
+        version of act
+    """
+    def next_states(self, a):
+        s = np.arange(self.states)
+        col = s % self.l
+        terminal = self.states - 1
+
+        #target cell of the move and whether the move stays on the grid
+        if a == 0:
+            target, ok = s + self.l, s + self.l < terminal
+        elif a == 1:
+            target, ok = s + self.l + 1, (s + self.l + 1 < terminal) & (col < self.l - 1)
+        elif a == 2:
+            target, ok = s + 1, (s + 1 < terminal) & (col < self.l - 1)
+        elif a == 3:
+            target, ok = s - 1, (s - 1 > 0) & (col > 0)
+        elif a == 4:
+            target, ok = s + self.l - 1, (s + self.l - 1 < terminal) & (col > 0)
+        else:
+            target, ok = s, np.ones(self.states, dtype=bool)
+
+        #moves onto obstacles fail
+        ok[ok] &= ~self.blocked[target[ok]]
+        nxt = np.where(ok, target, s)
+
+        #goals and the terminal state go to the terminal state no matter what
+        nxt[self.is_goal] = terminal
+        nxt[terminal] = terminal
+        return nxt
+
+    """
+        This function builds the sparse transition matrix of action a
+    """
+    def transition_matrix(self, a):
+        rows = []
+        cols = []
+        data = []
+        for (b, p) in self.outcomes(a):
+            rows.append(np.arange(self.states))
+            cols.append(self.next_states(b))
+            data.append(np.full(self.states, p))
+        #outcomes landing on the same cell are summed
+        P = sp.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(self.states, self.states))
+        P.sum_duplicates()
+        return P
+
+    """
+        This function returns the possible next states of action a at state s and
+        their probabilities
+    """
+    def successors(self, a, s):
+        P = self.P[a]
+        lo, hi = P.indptr[s], P.indptr[s + 1]
+        return P.indices[lo:hi], P.data[lo:hi]
+
+    """
+        This function draws the next state of action a at state s
+    """
+    def sample(self, a, s):
+        idx, pr = self.successors(a, s)
+        #deterministic transitions do not use up random numbers
+        if len(idx) == 1:
+            return int(idx[0])
+        r = self.rng.random()
+        for j, q in zip(idx, pr):
+            r -= q
+            if r < 0:
+                return int(j)
+        return int(idx[-1])
             
     """
-        This function sets up the rewards and the transition function
+        This function sets up the rewards and the transition function, and solves
+        the values and policies unless solve is False
     """   
-    def setup(self):
+    def setup(self, solve=True):
+        self.make_maps()
         self.make_rewards_human()
         self.make_transition()
-        self.value_iter_human()
+        if solve:
+            self.value_iter_human()
         
         self.make_rewards()
-        self.value_iter()
+        if solve:
+            self.value_iter()
+
+    """
+        This function writes the solved values and policies into the file path (.npz)
+    """
+    def save(self, path):
+        np.savez(path, goals=np.array(self.goals), V=np.array(self.V), policy=np.array(self.policy),
+                 Vs_human=np.array([self.Vs_human[g] for g in self.goals]),
+                 Vs_robot=np.array([self.Vs_robot[g] for g in self.goals]),
+                 policies=np.array([self.policies[g] for g in self.goals]))
+
+    """
+        This function reads the values and policies written by save (of the same
+        layout) instead of solving
+    """
+    def load(self, path):
+        data = np.load(path)
+        self.V = tuple(data['V'].tolist())
+        self.policy = tuple(data['policy'].tolist())
+        for i, g in enumerate(data['goals'].tolist()):
+            self.Vs_human[g] = tuple(data['Vs_human'][i].tolist())
+            self.Vs_robot[g] = tuple(data['Vs_robot'][i].tolist())
+            self.policies[g] = tuple(data['policies'][i].tolist())
+        return self
 
 
     def square(self,s):
         return(s%self.l,int(s/self.l))                   
+
+    """
+        This function makes the obstacle and goal bitmaps used by the compiled kernels
+    """
+    def make_maps(self):
+        self.blocked = np.zeros(self.states, dtype=bool)
+        self.blocked[self.obstacles] = True
+        self.is_goal = np.zeros(self.states, dtype=bool)
+        self.is_goal[self.goals] = True
         
     """
         This function does value iteration on human's mdp
@@ -124,28 +292,28 @@ class MDP:
                 if g != g_other:
                     R_copy_human[g_other] = -1
             #solve values for when the human's goal is g
-            vi_copy_human = mdptoolbox.mdp.ValueIteration(self.P, R_copy_human, self.gamma)
-            vi_copy_human.run()
+            self.solve_stats[('human', g)] = {}
+            V, policy = value_iteration(self.P, R_copy_human, self.gamma, stable=self.stable,
+                                        stats=self.solve_stats[('human', g)])
             
             #save values and policies in dictionary indexed by goal
-            self.Vs_human[g] = vi_copy_human.V
-            self.policies[g] = vi_copy_human.policy
+            self.Vs_human[g] = V
+            self.policies[g] = policy
             print("human values:", self.Vs_human[g])
             print("human policies:", self.policies[g])
             #print("human values:", len(self.Vs_human[92]))
             #print("human policies:", len(self.policies[92]))
-        for s in range(100):
-            print(str(self.square(s)) + " " + str(self.policies[92][s]))
+        for s in range(self.states - 1):
+            print(str(self.square(s)) + " " + str(self.policies[self.goals[0]][s]))
     
     """
         This function does value iteration on the robot's mdp
     """
     def value_iter(self):
         #solve values and policies for the robot for all goals set to 100 reward
-        vi = mdptoolbox.mdp.ValueIteration(self.P, self.R_robot, self.gamma)
-        vi.run()
-        self.V = vi.V
-        self.policy = vi.policy
+        self.solve_stats[('robot', None)] = {}
+        self.V, self.policy = value_iteration(self.P, self.R_robot, self.gamma, stable=self.stable,
+                                              stats=self.solve_stats[('robot', None)])
         vis = []
         #for all possible goals
         for g in self.goals:
@@ -157,18 +325,173 @@ class MDP:
                     R_copy_robot[g_other] = -1
             
             #solve values for when the goal is g
-            vi_copy_robot = mdptoolbox.mdp.ValueIteration(self.P, R_copy_robot, self.gamma)
-            vi_copy_robot.run()
+            self.solve_stats[('robot', g)] = {}
+            V, policy = value_iteration(self.P, R_copy_robot, self.gamma, stable=self.stable,
+                                        stats=self.solve_stats[('robot', g)])
             
             #save values in dictionary indexed by goal
-            self.Vs_robot[g] = vi_copy_robot.V
+            self.Vs_robot[g] = V
+
+        for s in range(self.states - 1):
+            print(str(self.square(s)) + " " + str(self.Vs_robot[self.goals[0]][s]))        
+
+    """
+        This function applies goal and obstacle edits in place. Only the rows of the
+        transition matrix around the edited cells are rebuilt, and every goal's values
+        are re-solved warm-started from the previous solution. Returns a report of how
+        many rows were patched and how many states were touched
+    """
+    def update(self, goals=None, obstacles=None):
+        old_goals = set(self.goals)
+        old_obstacles = set(self.obstacles)
+        if goals is not None:
+            self.goals = list(goals)
+        if obstacles is not None:
+            self.obstacles = list(obstacles)
+        goal_edits = old_goals ^ set(self.goals)
+        edits = goal_edits | (old_obstacles ^ set(self.obstacles))
+        self.make_maps()
 
-        for s in range(100):
-            print(str(self.square(s)) + " " + str(self.Vs_robot[92][s]))        
+        #a cell's row can only change if it was edited or if it can step onto an edited cell
+        offsets = [0, -self.l, -self.l - 1, -1, 1, -self.l + 1]
+        rows = set()
+        for c in edits:
+            for o in offsets:
+                if 0 <= c + o < self.states - 1:
+                    rows.add(c + o)
+
+        #rebuild those rows and keep the ones that actually changed
+        patched = set()
+        for a in range(self.actions):
+            changes = {}
+            for s in sorted(rows):
+                row = {}
+                for (b, p) in self.outcomes(a):
+                    s_new = self.act(b, s)
+                    row[s_new] = row.get(s_new, 0) + p
+                idx, pr = self.successors(a, s)
+                if row != dict(zip(idx.tolist(), pr.tolist())):
+                    changes[s] = row
+            if len(changes) > 0:
+                P = self.P[a].tolil()
+                for s, row in changes.items():
+                    P[s, :] = 0
+                    for s_new, p in row.items():
+                        P[s, s_new] = p
+                self.P[a] = P.tocsr()
+                patched |= set(changes)
+
+        #reward 100 for new goals, -1 for cells that stopped being goals
+        for c in goal_edits:
+            self.R_human[c] = 100 if c in self.goals else -1
+            self.R_robot[c] = 100 if c in self.goals else -1
+
+        #forget goals that were removed
+        for g in old_goals - set(self.goals):
+            del self.Vs_human[g]
+            del self.Vs_robot[g]
+            del self.policies[g]
+
+        preds = self.predecessors()
+        #the greedy action can also change where a row or a reward changed without changing the value
+        recheck = set(patched) | goal_edits
+        touched = {}
+
+        #re-solve the values for all goals
+        V, policy, t = self.propagate(self.V, self.policy, self.R_robot, recheck, preds)
+        self.V = tuple(V.tolist())
+        self.policy = policy
+        touched[None] = t
+
+        #re-solve the values for each goal
+        for g in self.goals:
+            R_g = deepcopy(self.R_human)
+            for g_other in self.goals:
+                if g != g_other:
+                    R_g[g_other] = -1
+            if g in self.Vs_human:
+                V, policy, t = self.propagate(self.Vs_human[g], self.policies[g], R_g, recheck, preds)
+            else:
+                #a new goal has no previous solution, so start from the values for all goals
+                V, policy, t = self.propagate(self.V, self.policy, R_g, range(self.states), preds)
+            #the human and the robot get their own copies, as after a solve from scratch
+            self.Vs_human[g] = tuple(V.tolist())
+            self.Vs_robot[g] = tuple(V.tolist())
+            self.policies[g] = policy
+            touched[g] = t
+
+        states_touched = set()
+        for t in touched.values():
+            states_touched |= t
+        return {'patched_rows': len(patched),
+                'touched': dict((g, len(t)) for g, t in touched.items()),
+                'states_touched': len(states_touched)}
+
+    """
+        This function returns, for each state, the states that can transition into it
+    """
+    def predecessors(self):
+        reach = sum(self.P).T.tocsr()
+        return [reach.indices[reach.indptr[s]:reach.indptr[s + 1]] for s in range(self.states)]
+
+    """
+        This function does asynchronous value iteration from a previous solution V,
+        starting at the states of recheck (the only ones whose row or reward changed)
+        whose Bellman residual is above tol and pushing a state's predecessors only
+        when its value changes, so on return every residual is at most tol (if it
+        was before the edit). value_iteration stops on the span
+        of the changes, which leaves all values off the fixed point by about the
+        same offset; the terminal state (true value R/(1-gamma)) shows it, and the
+        backups keep it, so states whose true values did not change keep their
+        values. A solve of the edited layout from scratch differs from the result
+        by at most a constant (none if it stops after as many sweeps). The greedy
+        action is recomputed at the touched states and at recheck. Returns the
+        values as an array
+    """
+    def propagate(self, V, policy, R, recheck, preds, tol=1e-9):
+        V = np.array(V, dtype=float)
+        policy = np.array(policy)
+        terminal = self.states - 1
+        shift = (1 - self.gamma) * (V[terminal] - R[terminal] / (1 - self.gamma))
+
+        recheck = set(recheck)
+        queue = deque(s for s in sorted(recheck) if abs(self.backup(V, R, s).max() + shift - V[s]) > tol)
+        queued = set(queue)
+        touched = set()
+        while len(queue) > 0:
+            s = queue.popleft()
+            queued.discard(s)
+            touched.add(s)
+            v = self.backup(V, R, s).max() + shift
+            if abs(v - V[s]) > tol:
+                V[s] = v
+                for p in preds[s]:
+                    if p not in queued:
+                        queue.append(p)
+                        queued.add(p)
+
+        #the greedy policy can only change where a state, one of its successors or its row moved
+        #(actions tied within tol go to the first, as in a solve from scratch)
+        for s in touched | recheck:
+            Q = self.backup(V, R, s)
+            policy[s] = np.argmax(Q >= Q.max() - tol)
+
+        return V, tuple(policy.tolist()), touched
+
+    """
+        This function returns the action values of state s, reading only its non-zero successors
+    """
+    def backup(self, V, R, s):
+        Q = np.empty(self.actions)
+        for a in range(self.actions):
+            idx, pr = self.successors(a, s)
+            Q[a] = R[s] + self.gamma * pr.dot(V[idx])
+        return Q
     
       
         
 def main():
     mdp = MDP()
     
-main()
+if __name__ == '__main__':
+    main()
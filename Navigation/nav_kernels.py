@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+Compiled kernels for the navigation task. The grid is passed as boolean bitmaps
+(blocked and goal cells) instead of Python lists so the kernels can be compiled
+with Numba. Compiled code is cached on disk next to this file, so only the first
+run on a machine pays the compilation cost. Without Numba the same functions run
+as plain Python and give identical results.
+"""
+
+import math
+import numpy as np
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    #without Numba, leave the kernels as plain Python functions
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+
+"""
+    This function returns the next state given the current state and action
+    (same rules as MDP.act)
+"""
+@njit(cache=True)
+def act(a, s, l, states, blocked, is_goal):
+    terminal = states - 1
+    #if s is a goal state or the terminal state, go to terminal state no matter what action is taken
+    if s == terminal or is_goal[s]:
+        return terminal
+    #north
+    elif a == 0 and s + l < terminal and not blocked[s + l]:
+        return s + l
+    #northeast
+    elif a == 1 and s + l + 1 < terminal and (s % l) < (l - 1) and not blocked[s + l + 1]:
+        return s + l + 1
+    #east
+    elif a == 2 and s + 1 < terminal and (s % l) < (l - 1) and not blocked[s + 1]:
+        return s + 1
+    #west
+    elif a == 3 and s - 1 > 0 and (s % l) > 0 and not blocked[s - 1]:
+        return s - 1
+    #northwest
+    elif a == 4 and s + l - 1 < terminal and (s % l) > 0 and not blocked[s + l - 1]:
+        return s + l - 1
+    return s
+
+
+"""
+    This function returns the euclidean distance between the grid indices of two states
+"""
+@njit(cache=True)
+def square_dist(s1, s2, l):
+    dx = np.float64(s1 % l - s2 % l)
+    dy = np.float64(s1 // l - s2 // l)
+    return math.sqrt(dx * dx + dy * dy)
+
+
+"""
+    This function returns the legibility probability of goal G for action a at
+    state s, against the other goal g (same rules as SCA.PrG)
+"""
+@njit(cache=True)
+def PrG(G, g, a, s, l, states, blocked, is_goal):
+    return move_PrG(G, g, s, act(a, s, l, states, blocked, is_goal), l)
+
+
+"""
+    This function returns the legibility probability of goal G against the other
+    goal g for a move from s to s_new
+"""
+@njit(cache=True, error_model='numpy')
+def move_PrG(G, g, s, s_new, l):
+    #distance gained towards G and towards g
+    d = np.float64(square_dist(G, s, l) - square_dist(G, s_new, l))
+    d2 = np.float64(square_dist(g, s, l) - square_dist(g, s_new, l))
+
+    if d == d2:
+        return 0.5
+    elif d <= 0 and d2 > 0:
+        return 0.0
+    elif d > 0 and d2 <= 0:
+        return 1.0
+    #moving away from one goal only (the ratio below would divide by zero)
+    elif d == 0:
+        return 1.0
+    elif d2 == 0:
+        return 0.0
+    return (d / d2) / ((d / d2) + (d2 / d))
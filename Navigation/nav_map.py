@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+"""
+Navigation layouts (grid size, obstacles, goals and start) read from map files, kept
+as boolean bitmaps over the states so that checking a cell is one array lookup.
+One layout feeds both the solver (MDP(layout=...)) and the browser pages
+(write_page).
+
+Map files:
+- text grids, one line per row of the grid starting at row 0 (states 0..l-1):
+  '#' (or 'X', '@') is an obstacle, 'G' a goal, 'S' the start, anything else free
+- PGM occupancy grids (P2 or P5): pixels darker than threshold are obstacles, goals
+  and the start are given separately. P5 maps are memory-mapped, so very large maps
+  are never read into Python lists
+- layout files, one JSON object per line, either a layout
+  {"name": ..., "l": 10, "goals": [92, 98], "obstacles": [64], "start": 5}
+  or a map file with optional goals and start {"name": ..., "map": "maze.pgm", ...};
+  read_layouts yields them one at a time. layouts.jsonl has the layouts of the
+  MTurk pages, the MDP's default and the sweep (nav_sweep.py), found by name with
+  named_layout
+
+The grid is square (l x l) like the MDP's.
+"""
+
+import json
+import os
+import re
+import sys
+import numpy as np
+
+import mdp
+
+OBSTACLE_CHARS = '#X@'
+#layout file of the MTurk pages, the MDP's default and the sweep
+LAYOUTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'layouts.jsonl')
+
+
+"""
+    This class implements a layout
+"""
+class Layout:
+    def __init__(self, l, blocked, is_goal, start=None, name=None):
+        self.l = l
+        self.states = l**2 + 1
+        self.blocked = blocked #obstacle bitmap over the states (the terminal state is never blocked)
+        self.is_goal = is_goal #goal bitmap over the states
+        self.start = start
+        self.name = name
+
+    """
+        This function makes a layout from lists of goal and obstacle states
+    """
+    @staticmethod
+    def from_lists(l, goals, obstacles, start=None, name=None):
+        blocked = np.zeros(l**2 + 1, dtype=bool)
+        blocked[np.asarray(obstacles, dtype=np.int64)] = True
+        is_goal = np.zeros(l**2 + 1, dtype=bool)
+        is_goal[np.asarray(goals, dtype=np.int64)] = True
+        return Layout(l, blocked, is_goal, start, name)
+
+    def goals(self):
+        return np.flatnonzero(self.is_goal).tolist()
+
+    """
+        This function returns the obstacle states as an array
+    """
+    def obstacles(self):
+        return np.flatnonzero(self.blocked)
+
+    """
+        This function returns the layout with (more) goals and a start set
+    """
+    def with_goals(self, goals=None, start=None):
+        if goals != None and len(goals) > 0:
+            self.is_goal[np.asarray(goals, dtype=np.int64)] = True
+        if start != None:
+            self.start = start
+        if (self.blocked & self.is_goal).any():
+            raise ValueError('goal on an obstacle: ' + str(np.flatnonzero(self.blocked & self.is_goal).tolist()))
+        return self
+
+
+"""
+    This function reads a text grid map
+"""
+def read_text(path, name=None):
+    blocked = None
+    is_goal = None
+    start = None
+    l = None
+    row = 0
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line == '':
+                continue
+            if l == None:
+                l = len(line)
+                blocked = np.zeros(l**2 + 1, dtype=bool)
+                is_goal = np.zeros(l**2 + 1, dtype=bool)
+            if len(line) != l or row >= l:
+                raise ValueError('%s: the grid has to be square, row %d has %d cells' % (path, row, len(line)))
+            cells = np.frombuffer(line.encode('latin-1'), dtype=np.uint8)
+            blocked[row * l:(row + 1) * l] = np.isin(cells, np.frombuffer(OBSTACLE_CHARS.encode(), dtype=np.uint8))
+            is_goal[row * l:(row + 1) * l] = cells == ord('G')
+            s = line.find('S')
+            if s >= 0:
+                start = row * l + s
+            row += 1
+    if row != l:
+        raise ValueError('%s: the grid has to be square, %d rows of %d cells' % (path, row, l))
+    return Layout(l, blocked, is_goal, start, name)
+
+
+"""
+    This function reads a PGM occupancy grid. Pixels darker than threshold are obstacles
+"""
+def read_pgm(path, threshold=128, goals=None, start=None, name=None):
+    with open(path, 'rb') as f:
+        #header: magic, width, height and maxval, with # comments
+        fields = []
+        while len(fields) < 4:
+            line = f.readline()
+            if line == b'':
+                raise ValueError(path + ': truncated PGM header')
+            fields += line.split(b'#')[0].split()
+        offset = f.tell()
+    magic = fields[0]
+    width, height, maxval = int(fields[1]), int(fields[2]), int(fields[3])
+    if width != height:
+        raise ValueError('%s: the grid has to be square, it is %dx%d' % (path, width, height))
+
+    if magic == b'P5':
+        pixels = np.memmap(path, dtype=np.uint8 if maxval < 256 else '>u2', mode='r', offset=offset,
+                           shape=(width * height,))
+    elif magic == b'P2':
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            pixels = np.fromstring(f.read().decode('ascii'), dtype=np.int64, sep=' ')
+    else:
+        raise ValueError('%s: not a PGM file' % path)
+
+    blocked = np.zeros(width**2 + 1, dtype=bool)
+    blocked[:-1] = pixels[:width * height] < threshold
+    is_goal = np.zeros(width**2 + 1, dtype=bool)
+    return Layout(width, blocked, is_goal, None, name).with_goals(goals, start)
+
+
+"""
+    This function reads a map file, by its extension
+"""
+def read_map(path, goals=None, start=None, threshold=128, name=None):
+    if path.lower().endswith('.pgm'):
+        return read_pgm(path, threshold, goals, start, name)
+    return read_text(path, name).with_goals(goals, start)
+
+
+"""
+    This function yields the layouts of a layout file one at a time. Map files are
+    found relative to the layout file
+"""
+def read_layouts(path):
+    with open(path) as f:
+        for i, line in enumerate(f):
+            if line.strip() == '' or line.lstrip().startswith('#'):
+                continue
+            spec = json.loads(line)
+            name = spec.get('name', str(i))
+            if 'map' in spec:
+                yield read_map(os.path.join(os.path.dirname(path), spec['map']), spec.get('goals'),
+                               spec.get('start'), spec.get('threshold', 128), name)
+            else:
+                yield Layout.from_lists(spec['l'], spec['goals'], spec.get('obstacles', []), spec.get('start'),
+                                        name).with_goals()
+
+
+"""
+    This function returns the layout called name in a layout file (by default
+    layouts.jsonl next to this file)
+"""
+def named_layout(name, path=LAYOUTS):
+    for layout in read_layouts(path):
+        if layout.name == name:
+            return layout
+    raise ValueError('%s: no layout named %s' % (path, name))
+
+
+"""
+    This function writes a copy of a browser page (MTurk_Nav.html or
+    MTurk_Modified_Nav.html) set up for a layout: grid size, goals, obstacles, the
+    start state of every game and, if Vs (values by goal, e.g. MDP.Vs_human) is
+    given, the human's values
+"""
+def write_page(layout, page, out, Vs=None):
+    text = open(page).read()
+    goals = '[' + ', '.join(str(g) for g in layout.goals()) + ']'
+    settings = {'l': str(layout.l), 'states': str(layout.states)}
+    lists = {'goals': goals, 'goalStates': goals, 'possibleGoalStates': goals,
+             'obstacleStates': '[' + ', '.join(str(o) for o in layout.obstacles().tolist()) + ']'}
+    for var, value in settings.items():
+        text = re.sub(r'var %s = [^;]*;' % var, lambda m: 'var %s = %s;' % (var, value), text)
+    #lists are also assigned again when a game is reset (possibleGoalStates)
+    for var, value in lists.items():
+        text = re.sub(r'\b((?:var )?%s = )\[[^\]]*\];' % var, lambda m: m.group(1) + value + ';', text)
+    if layout.start != None:
+        #games are [wV, wE, wL, start]
+        text = re.sub(r'(gameIterations\.set\(\d+, *\[[^\]]*, *)\d+\]', lambda m: '%s%d]' % (m.group(1), layout.start), text)
+    if Vs != None:
+        values = '\n    '.join('VsHuman.set(%d, [%s]);' % (g, ', '.join(repr(float(v)) for v in Vs[g]))
+                                 for g in layout.goals()) + '\n'
+        first = re.search(r'VsHuman\.set\(', text).start()
+        text = re.sub(r'VsHuman\.set\(\d+, *\[[^\]]*\]\);[ \t]*\n?[ \t]*', '', text)
+        text = text[:first] + values + text[first:]
+    with open(out, 'w') as f:
+        f.write(text)
+
+
+def main():
+    if len(sys.argv) != 5:
+        print('usage: python nav_map.py LAYOUT_FILE NAME PAGE OUT\n'
+              'solves layout NAME of LAYOUT_FILE and writes PAGE set up for it to OUT')
+        return
+    for layout in read_layouts(sys.argv[1]):
+        if layout.name == sys.argv[2]:
+            solved = mdp.MDP(layout=layout, fast=True)
+            write_page(layout, sys.argv[3], sys.argv[4], solved.Vs_human)
+            return
+    print('no layout named', sys.argv[2])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""
+Adapter that describes the navigation task as a Problem for the shared Engine
+(Common/engine.py). Goal inference and action scoring follow the navigation SCA
+(TASC_nav.py), which makes its decisions through it.
+"""
+
+import hashlib
+import os
+import sys
+import numpy as np
+from scipy.spatial.distance import euclidean
+
+import nav_kernels
+from mdp import MDP
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from problem import Problem
+
+
+"""
+    This class adapts MDP to the Problem interface
+"""
+class NavigationProblem(Problem):
+    def __init__(self, mdp=None, slip=0.0, drift=0.0):
+        if mdp == None:
+            mdp = MDP(slip=slip, drift=drift, fast=True)
+        if mdp.blocked is None:
+            mdp.make_maps()
+        self.mdp = mdp
+
+        self.num_states = mdp.states
+        self.num_actions = mdp.actions
+        self.terminal = mdp.states - 1
+        self.slip = mdp.slip
+        self.goals = list(mdp.goals)
+        #obstacles are named by a digest of their bitmap, since maps can have many
+        self.name = 'nav-%d-%s-%s-%g-%g' % (mdp.l, '_'.join(str(g) for g in mdp.goals),
+                                             hashlib.sha1(np.packbits(mdp.blocked).tobytes()).hexdigest()[:12],
+                                             mdp.slip, mdp.drift)
+        #largest value of the MDP, and the values it was taken from (see max_value)
+        self.max_V = None
+        self.V = None
+
+    """
+        This function returns the next state of every state for action a (every goal
+        ends the walk, whichever the human is heading to)
+    """
+    def next_states(self, a, g=None):
+        return self.mdp.next_states(a)
+
+    """
+        This function returns None, since all goals share the transition matrices
+    """
+    def transition_key(self, g):
+        return None
+
+    """
+        This function builds the transition matrices with the MDP's own builder (slip
+        and drift)
+    """
+    def transition_matrices(self, g=None):
+        return [self.mdp.transition_matrix(a) for a in range(self.num_actions)]
+
+    """
+        This function returns the reward of every state for goal g (same as
+        MDP.value_iter_human)
+    """
+    def rewards(self, g):
+        R = -1 * np.ones(self.num_states)
+        R[g] = 100
+        return R
+
+    """
+        This function returns the legibility probability of goal G against goal other
+        for action a at state s (the euclidean rules of SCA.PrG)
+    """
+    def pr_goal(self, G, other, a, s):
+        if self.mdp.fast:
+            return nav_kernels.PrG(G, other, a, s, self.mdp.l, self.mdp.states, self.mdp.blocked, self.mdp.is_goal)
+        #s_new is predicted new state given action a
+        return move_pr_goal(G, other, s, self.mdp.act(a, s), self.mdp.l, fast=False)
+
+    """
+        This function returns the legibility probability of goal G for action a at
+        state s, against the most competitive other goal (same as SCA.PrG for two goals)
+    """
+    def legibility(self, G, a, s, g=None):
+        return min(self.pr_goal(G, other, a, s) for other in self.goals if other != G)
+
+    """
+        This function returns the goals most legible from the human's action aH at
+        state s and their probability (same as SCA.goal_probs, see move_goal_probs)
+    """
+    def goal_probs(self, engine, s, s_old, aH):
+        return move_goal_probs(self.goals, s, self.mdp.act(aH, s), self.mdp.l, fast=self.mdp.fast)
+
+    """
+        This function returns the largest value of the MDP, found again only when its
+        values were solved again (e.g. by MDP.update)
+    """
+    def max_value(self):
+        if self.V is not self.mdp.V:
+            self.V = self.mdp.V
+            self.max_V = np.max(self.V)
+        return self.max_V
+
+    """
+        This function scores the robot actions from state s as SCA.action_scores: the
+        legibility and the value of the next state are weighted by the probability p
+        of the predicted goal Gp and 1 - p of the other goal, and values are
+        normalized by the largest value of the MDP
+    """
+    def action_scores(self, engine, s, Gp, probs, g=None):
+        p = probs[self.goals.index(Gp)]
+        other = self.goals[1] if Gp == self.goals[0] else self.goals[0]
+        max_V = self.max_value()
+
+        succ = []
+        vals = []
+        Ls = []
+        for a in range(self.num_actions):
+            #see what the next state would be, and every state the action can end up in
+            s_new = self.mdp.act(a, s)
+            idx, pr = self.mdp.successors(a, s)
+            #calculate expected probability of effort
+            E = 0
+            for j, q in zip(idx, pr):
+                E += q * self.effort(a, s, j)
+
+            L = p * self.legibility(Gp, a, s) + (1 - p) * self.legibility(other, a, s)
+
+            #calculate expected value of new state for both goals
+            v_Gp = 0
+            v_other = 0
+            for j, q in zip(idx, pr):
+                v_Gp += q * engine.Vs[Gp][j]
+                v_other += q * engine.Vs[other][j]
+            V = p * (v_Gp / max_V) + (1 - p) * (v_other / max_V)
+
+            #combined value of Effort, Legibility, and Value
+            succ.append(s_new)
+            vals.append(engine.wE*E + engine.wL*L + engine.wV*V)
+            Ls.append(L)
+
+        return succ, vals, Ls
+
+
+"""
+    This function returns the legibility probability of goal G against goal other
+    for a move from s to s_new on a grid of side l (the euclidean rules of SCA.PrG),
+    with the compiled kernel if fast
+"""
+def move_pr_goal(G, other, s, s_new, l, fast=True):
+    if fast:
+        return nav_kernels.move_PrG(G, other, s, s_new, l)
+    square = lambda x: (x % l, x // l)
+
+    #d is the euclidean distance between the indices of G and s minus
+    #the euclidean distance between the indices of G and s_new
+    d = euclidean(square(G), square(s)) - euclidean(square(G), square(s_new))
+    #d2 is the same for the other goal
+    d2 = euclidean(square(other), square(s)) - euclidean(square(other), square(s_new))
+
+    #if the distances are the same, both goals are equally likely
+    if d == d2:
+        return 0.5
+    #if s_new takes the robot farther from G and closer to other, 0% chance G is the goal
+    elif d <= 0 and d2 > 0:
+        return 0
+    #if s_new takes the robot farther from other and closer to G, 100% chance G is the goal
+    elif d > 0 and d2 <= 0:
+        return 1
+    #if s_new takes the robot farther from only one goal, the other one is the goal
+    #(the ratio below would divide by zero)
+    elif d == 0:
+        return 1
+    elif d2 == 0:
+        return 0
+    #otherwise, return a probability based on the distance between the two
+    return (d/d2)/((d/d2)+(d2/d))
+
+
+"""
+    This function returns the goals most legible from a move from s to s_new, their
+    probability and the probabilities of all goals. Each goal is scored against its
+    most competitive other goal; the predicted goals get that probability and every
+    other goal the rest (the rule of SCA.goal_probs, made for two goals)
+"""
+def move_goal_probs(goals, s, s_new, l, fast=True):
+    max_g = []
+    max_pr = -1
+
+    for g in goals:
+        p = min(move_pr_goal(g, other, s, s_new, l, fast) for other in goals if other != g)
+        if p > max_pr:
+            max_g = [g]
+            max_pr = p
+        elif p == max_pr:
+            max_g.append(g)
+
+    return (max_g, max_pr, [max_pr if g in max_g else 1 - max_pr for g in goals])
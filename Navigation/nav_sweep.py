@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""
+Sweep over weights, layouts and human goals of the navigation task, run by any
+number of workers (on one or several hosts) sharing a directory through a
+WorkQueue (Common/work_queue.py). Each layout is solved once and its tables are
+shared by all workers as an artifact; the episodes are run by the navigation SCA
+(TASC_nav.py).
+
+    python nav_sweep.py init DIR     #write the sweep's tasks
+    python nav_sweep.py work DIR     #run tasks until none are left (start one per core/host)
+    python nav_sweep.py merge DIR    #combine the workers' results into DIR/results.jsonl
+"""
+
+import contextlib
+import io
+import os
+import random
+import sys
+
+from mdp import MDP
+from nav_map import named_layout
+from TASC_nav import SCA
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from work_queue import WorkQueue, sweep_tasks
+
+#layouts swept (by name in layouts.jsonl)
+LAYOUTS = [named_layout(name) for name in ['mdp', 'open', 'wide_goals']]
+
+
+"""
+    This function returns the tasks of the sweep
+"""
+def make_tasks(episodes=10):
+    tasks = []
+    for task in sweep_tasks(layout=list(range(len(LAYOUTS))), human_goal=[0, 1], wV=[0.5, 0.7, 0.9],
+                            wL=[0.05, 0.25], start=[0, 5, 9]):
+        task['wE'] = round(1 - task['wV'] - task['wL'], 10)
+        task['episodes'] = episodes
+        tasks.append(task)
+    return tasks
+
+
+"""
+    This function returns the name of the artifact holding the tables of a layout
+"""
+def layout_name(layout, slip=0.0, drift=0.0):
+    return 'nav-%s-%s-%g-%g' % ('_'.join(str(g) for g in layout.goals()),
+                                '_'.join(str(o) for o in layout.obstacles()) or 'open', slip, drift)
+
+
+"""
+    This function returns the MDP of a layout, solved or with its tables left to
+    MDP.load
+"""
+def make_mdp(layout, solve, slip=0.0, drift=0.0):
+    #MDP prints its solution while it is built
+    with contextlib.redirect_stdout(io.StringIO()):
+        return MDP(slip=slip, drift=drift, fast=True, solve=solve, layout=layout)
+
+
+"""
+    This function returns the MDP of a layout with the tables shared by all workers:
+    read from the artifact if it exists, otherwise solved once and saved there first
+"""
+def layout_mdp(layout, queue):
+    return queue.artifact(layout_name(layout),
+                          lambda path: make_mdp(layout, True).save(os.path.join(path, 'tables.npz')),
+                          lambda path: make_mdp(layout, False).load(os.path.join(path, 'tables.npz')))
+
+
+"""
+    This function runs the episodes of one task and returns their lengths and the
+    number of robot moves
+"""
+def run_task(task, queue):
+    sca = SCA(wV=task['wV'], wE=task['wE'], wL=task['wL'], mdp=layout_mdp(LAYOUTS[task['layout']], queue))
+    sca.human_goal = sca.G[task['human_goal']]
+
+    steps = []
+    robot = []
+    for e in range(task['episodes']):
+        sca.set_rng(random.Random(e))
+        #the steps and the solution are printed while the episode runs
+        with contextlib.redirect_stdout(io.StringIO()):
+            sol = sca.team(lambda t: t % 2 == 1, lambda t: t % 2 == 0, s=task['start'])
+        #the first entry of the solution is the start
+        steps.append(len(sol) - 1)
+        robot.append(sum(1 for step in sol[1:] if step[1] == 'R'))
+    return {'steps': steps, 'robot_steps': robot}
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('init', 'work', 'merge'):
+        print(__doc__)
+        return
+    queue = WorkQueue(sys.argv[2])
+    if sys.argv[1] == 'init':
+        print(len(queue.add(make_tasks())), 'tasks')
+    elif sys.argv[1] == 'work':
+        print(queue.run(lambda task, context: run_task(task, queue)), 'tasks run')
+    else:
+        rows, missing = queue.merge()
+        print(len(rows), 'results,', len(missing), 'tasks missing')
+
+
+if __name__ == '__main__':
+    main()
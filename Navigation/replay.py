@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+"""
+Run this program to replay recorded navigation games through goal inference.
+Games are read in the format the MTurk pages (MTurk_Nav.html, MTurk_Modified_Nav.html)
+write to dataStrings: a "Game i.j" line followed by one line per frame. Logs are read
+in chunks of human moves and each chunk is added to running totals, so memory use does
+not depend on the size of the logs. Goals are inferred with the rules of the SCAs.
+Prints the prediction accuracy by move number and the calibration of the predicted
+probabilities.
+
+Usage: python replay.py [page.html] [log ...]
+Without logs, a synthetic log is written to synthetic_log.txt and replayed.
+"""
+
+import os
+import re
+import sys
+import random
+import numpy as np
+
+from nav_problem import move_goal_probs
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from problem import value_goal_probs
+
+#grid moves (dx, dy) of the actions of the MTurk pages: up, up right, right,
+#down right, down, down left, left, up left, idle
+MOVES = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 0)]
+
+#columns of a frame written by addRobotFrame/addHumanFrame
+ACTOR = 5
+STATE = 6
+ACTION = 8
+HUMAN_GOAL = 18
+
+
+"""
+    This function reads the grid size, goals, obstacles, start state and the
+    state values of every goal from an MTurk page
+"""
+def page_settings(path):
+    text = open(path).read()
+    l = int(re.search(r'var l = (\d+);', text).group(1))
+    goals = [int(g) for g in re.search(r'var goals = \[([^\]]*)\]', text).group(1).split(',')]
+    obstacles = re.search(r'var obstacleStates = \[([^\]]*)\]', text).group(1)
+    obstacles = [int(o) for o in obstacles.split(',') if o.strip() != '']
+    start = int(re.search(r'gameIterations\.set\(0, *\[[^\]]*, *(\d+)\]', text).group(1))
+
+    Vs = {}
+    for g, values in re.findall(r'VsHuman\.set\((\d+), *\[([^\]]*)\]\)', text):
+        Vs[int(g)] = [float(v) for v in values.split(',')]
+    return {'l': l, 'goals': goals, 'obstacles': obstacles, 'start': start,
+            'Vs': np.array([Vs[g] for g in goals])}
+
+
+"""
+    This function reads the human moves of the given log files and yields them in
+    chunks of at most chunk_size moves. Each chunk is a dictionary of arrays: game
+    number, move number within the game, state, action and true goal
+"""
+def read_moves(paths, chunk_size=100000):
+    columns = ['game', 'move', 's', 'a', 'goal']
+    chunk = {name: [] for name in columns}
+    game = -1
+    move = 0
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('Game '):
+                    game += 1
+                    move = 0
+                    continue
+                frame = [x.strip() for x in line.split(',')]
+                #robot frames (one line per candidate action) are skipped
+                if len(frame) <= HUMAN_GOAL or frame[ACTOR] != 'H':
+                    continue
+
+                chunk['game'].append(game)
+                chunk['move'].append(move)
+                chunk['s'].append(int(frame[STATE]))
+                chunk['a'].append(int(frame[ACTION]))
+                chunk['goal'].append(int(frame[HUMAN_GOAL]))
+                move += 1
+
+                if len(chunk['s']) == chunk_size:
+                    yield {name: np.array(chunk[name], dtype=np.int64) for name in columns}
+                    chunk = {name: [] for name in columns}
+    if len(chunk['s']) > 0:
+        yield {name: np.array(chunk[name], dtype=np.int64) for name in columns}
+
+
+"""
+    This class replays human moves through goal inference and keeps running totals
+    of prediction accuracy and calibration
+"""
+class Replay:
+    def __init__(self, goals, Vs, l, model='markov', bins=10, max_moves=30):
+        self.goals = list(goals)
+        #state values of every goal state
+        self.Vs = {g: np.asarray(V, dtype=float) for g, V in zip(self.goals, Vs)}
+        self.l = l
+        #'markov' uses the differences in state value (as the tower SCA.CG_markov),
+        #'distance' the euclidean legibility of the navigation SCA (as SCA.PrG)
+        self.model = model
+
+        #goal number of every goal state
+        self.goal_index = np.full(l * l, -1)
+        self.goal_index[self.goals] = np.arange(len(self.goals))
+        self.moves = np.array(MOVES)
+
+        #running totals: accuracy by move number (the last entry counts all later
+        #moves), calibration by confidence bin, and the Brier score
+        self.bins = bins
+        self.max_moves = max_moves
+        self.move_n = np.zeros(max_moves)
+        self.move_correct = np.zeros(max_moves)
+        self.bin_n = np.zeros(bins)
+        self.bin_conf = np.zeros(bins)
+        self.bin_correct = np.zeros(bins)
+        self.brier = 0.0
+
+    """
+        This function returns the state reached by each action from each state
+    """
+    def next_states(self, s, a):
+        return s + self.moves[a, 0] + self.l * self.moves[a, 1]
+
+    """
+        This function returns the probability of every goal (rows) for every move
+        from s to s_new (columns), from the goal inference of the SCAs
+        (problem.value_goal_probs and nav_problem.move_goal_probs). The navigation
+        rule is made for two goals, so its probabilities are scaled to sum to one
+    """
+    def goal_probs(self, s, s_new):
+        probs = np.zeros((len(self.goals), len(s)))
+        for i in range(len(s)):
+            if self.model == 'markov':
+                (_, _, probs[:, i]) = value_goal_probs(self.Vs, self.goals, s_new[i], s[i])
+            else:
+                (_, _, probs[:, i]) = move_goal_probs(self.goals, s[i], s_new[i], self.l)
+        return probs / probs.sum(axis=0)
+
+    """
+        This function adds a chunk of moves (from read_moves) to the totals
+    """
+    def update(self, chunk):
+        s = chunk['s']
+        probs = self.goal_probs(s, self.next_states(s, chunk['a']))
+        true = self.goal_index[chunk['goal']]
+        cols = np.arange(len(s))
+
+        #ties count as a random choice among the most likely goals (as in SCA)
+        conf = probs.max(axis=0)
+        is_max = probs == conf
+        correct = is_max[true, cols] / is_max.sum(axis=0)
+
+        move = np.minimum(chunk['move'], self.max_moves - 1)
+        self.move_n += np.bincount(move, minlength=self.max_moves)
+        self.move_correct += np.bincount(move, weights=correct, minlength=self.max_moves)
+
+        b = np.minimum((conf * self.bins).astype(int), self.bins - 1)
+        self.bin_n += np.bincount(b, minlength=self.bins)
+        self.bin_conf += np.bincount(b, weights=conf, minlength=self.bins)
+        self.bin_correct += np.bincount(b, weights=correct, minlength=self.bins)
+
+        probs[true, cols] -= 1
+        self.brier += (probs**2).sum()
+
+    """
+        This function returns the accuracy, Brier score, expected calibration error,
+        accuracy by move number and the calibration table
+    """
+    def report(self):
+        n = self.move_n.sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            by_move = self.move_correct / self.move_n
+            conf = self.bin_conf / self.bin_n
+            acc = self.bin_correct / self.bin_n
+        ece = np.nansum(self.bin_n * np.abs(acc - conf)) / n
+        return {'moves': int(n), 'accuracy': self.move_correct.sum() / n, 'brier': self.brier / n, 'ece': ece,
+                'by_move': [(i, int(self.move_n[i]), by_move[i]) for i in range(self.max_moves) if self.move_n[i] > 0],
+                'calibration': [(i / self.bins, (i + 1) / self.bins, int(self.bin_n[i]), conf[i], acc[i])
+                                for i in range(self.bins) if self.bin_n[i] > 0]}
+
+
+"""
+    This function writes a log of synthetic games in the MTurk page format. The
+    human walks to a random goal, taking the best move for it (by state value) or,
+    with probability noise, a random move. The robot moves towards the goal it
+    predicts from the human's last move
+"""
+def synthetic_log(path, settings, games=1000, noise=0.2, weights=(0.3, 0.0, 0.7), max_t=100, seed=None):
+    rng = random.Random(seed)
+    l = settings['l']
+    goals = settings['goals']
+    Vs = settings['Vs']
+    replay = Replay(goals, Vs, l)
+    blocked = set(settings['obstacles'])
+
+    #valid actions of every state (idle is always possible)
+    valid = {}
+    for s in range(l * l):
+        valid[s] = [8]
+        for a, (dx, dy) in enumerate(MOVES[:8]):
+            x, y = s % l + dx, s // l + dy
+            if 0 <= x < l and 0 <= y < l and x + l * y not in blocked:
+                valid[s].append(a)
+
+    def best(s, g):
+        vals = [Vs[g][replay.next_states(s, a)] for a in valid[s]]
+        return [a for a, v in zip(valid[s], vals) if v == max(vals)]
+
+    with open(path, 'w') as f:
+        for i in range(games):
+            f.write('Game %d.%d\n' % (i // 4, 1 + i % 4))
+            goal = rng.randrange(len(goals))
+            s = settings['start']
+            probs = [1.0 / len(goals)] * len(goals)
+            timestamp = 0
+            t = 0
+            while s != goals[goal] and t < max_t:
+                timestamp += rng.randint(500, 3000)
+                if t % 2 == 0:
+                    #robot: best move for its most likely goal
+                    G = max(range(len(goals)), key=lambda j: (probs[j], rng.random()))
+                    a = rng.choice(best(s, G))
+                    padded = [str(p) for p in probs] + ['undefined'] * (4 - len(goals))
+                    for c in range(len(MOVES)):
+                        V = Vs[G][replay.next_states(s, c)] / Vs[G].max() if c in valid[s] else 0
+                        frame = list(weights) + [timestamp, t, 'R', s, c, a, V, 0, 0, V] + padded + [goals[G], goals[goal]]
+                        f.write(', '.join(str(x) for x in frame) + ', \n')
+                else:
+                    #human: best move for the true goal, or a random move
+                    if rng.random() < noise:
+                        a = rng.choice(valid[s][1:])
+                    else:
+                        a = rng.choice(best(s, goal))
+                    frame = list(weights) + [timestamp, t, 'H', s, 'N/A', a] + ['N/A'] * 9 + [goals[goal]]
+                    f.write(', '.join(str(x) for x in frame) + ', \n')
+                    probs = list(replay.goal_probs(np.array([s]), np.array([replay.next_states(s, a)]))[:, 0])
+                s = int(replay.next_states(s, a))
+                t += 1
+
+
+"""
+    This function prints a replay report
+"""
+def print_report(name, report):
+    print(name + ": moves:", report['moves'], " accuracy: %.3f  brier: %.3f  ece: %.3f"
+          % (report['accuracy'], report['brier'], report['ece']))
+    print("  move  count  accuracy")
+    for (i, n, acc) in report['by_move']:
+        print("  %4d  %5d  %.3f" % (i, n, acc))
+    print("  confidence    count  mean conf  accuracy")
+    for (lo, hi, n, conf, acc) in report['calibration']:
+        print("  %.1f-%.1f  %8d  %9.3f  %8.3f" % (lo, hi, n, conf, acc))
+
+
+"""
+    Replay the given logs (or a synthetic one) with both inference models
+"""
+def main():
+    page = 'MTurk_Nav.html'
+    logs = sys.argv[1:]
+    if len(logs) > 0 and logs[0].endswith('.html'):
+        page = logs.pop(0)
+    settings = page_settings(page)
+    if len(logs) == 0:
+        synthetic_log('synthetic_log.txt', settings, seed=0)
+        logs = ['synthetic_log.txt']
+
+    for model in ['markov', 'distance']:
+        replay = Replay(settings['goals'], settings['Vs'], settings['l'], model=model)
+        for chunk in read_moves(logs):
+            replay.update(chunk)
+        print_report(model, replay.report())
+
+
+if __name__ == '__main__':
+    main()
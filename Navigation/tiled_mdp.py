@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+"""
+    Hierarchical version of the navigation MDP for very large grids.
+
+    The navigation MDP is deterministic with a reward of -1 per step and 100 for
+    reaching the goal, so the value of a state only depends on its shortest path
+    distance to the goal. This class finds those distances in two levels:
+
+    - the grid is cut into tiles, and inside every tile the distances from each
+      cell to the tile's exit cells are found once; tiles with the same layout
+      share the result
+    - a small abstract graph links the entry and exit cells of all tiles, and is
+      searched once per goal
+    - values are composed for a tile only when it is asked for, from the tile's
+      distances and the goal's abstract distances
+
+    The moves and their edge cases are the same as MDP.act, goals are absorbing and
+    obstacle cells cannot be entered. The composed distances are exact, so the only
+    difference to a flat solve is how far the flat value iteration ran: with
+    horizon=None the values are the exact fixed point, and with horizon=k they match
+    k sweeps of value_iteration started from zero, up to floating point rounding
+    (|difference| < 1e-9).
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from collections import OrderedDict
+from scipy.sparse.csgraph import dijkstra
+
+
+class TiledMDP:
+    def __init__(self, l, goals, obstacles, tile=50, gamma=0.9, horizon=None, cache_size=256):
+        #define state space (l x l cells plus the terminal state, as in MDP)
+        self.actions = 6
+        self.l = l
+        self.states = (self.l**2) + 1
+        self.goals = list(goals)
+        self.gamma = gamma
+        self.horizon = horizon
+        self.tile = tile
+
+        #obstacles can be given as a list of cells or as a boolean bitmap
+        if isinstance(obstacles, np.ndarray) and obstacles.dtype == bool:
+            self.blocked = obstacles.reshape(-1)[:self.l**2]
+        else:
+            self.blocked = np.zeros(self.l**2, dtype=bool)
+            self.blocked[list(obstacles)] = True
+        self.is_goal = np.zeros(self.l**2, dtype=bool)
+        self.is_goal[self.goals] = True
+
+        #number of tiles along each side
+        self.n = (self.l + self.tile - 1) // self.tile
+
+        #intra-tile distances by tile layout, and composed values by (goal, tile), in LRU order
+        self.cache_size = cache_size
+        self.tile_cache = OrderedDict()
+        self.value_cache = OrderedDict()
+
+        #abstract distances to each goal, solved on first use
+        self.D = {}
+
+        self.make_abstract_graph()
+
+    """
+        This function returns the cells of tile t as global x and y index arrays
+    """
+    def tile_cells(self, t):
+        tx, ty = t % self.n, t // self.n
+        x0, y0 = tx * self.tile, ty * self.tile
+        w = min(self.tile, self.l - x0)
+        h = min(self.tile, self.l - y0)
+        y, x = np.divmod(np.arange(w * h), w)
+        return x + x0, y + y0
+
+    """
+        This function returns the tile of every given cell
+    """
+    def tile_of(self, s):
+        return (s % self.l) // self.tile + self.n * ((s // self.l) // self.tile)
+
+    """
+        This function returns, for each move (north, northeast, east, west, northwest),
+        the target cells of the given cells, whether the move succeeds (same rules as
+        MDP.act; idle is left out since it never shortens a path), and whether it
+        stays on the grid regardless of obstacles
+    """
+    def moves(self, x, y):
+        s = x + self.l * y
+        top = y < self.l - 1
+        out = [(s + self.l, top),
+               (s + self.l + 1, top & (x < self.l - 1)),
+               (s + 1, x < self.l - 1),
+               (s - 1, (x > 0) & (s - 1 > 0)),
+               (s + self.l - 1, top & (x > 0))]
+
+        result = []
+        for target, on_grid in out:
+            #goals are absorbing and obstacles cannot be entered
+            on_grid = on_grid & ~self.is_goal[s]
+            ok = on_grid.copy()
+            ok[ok] &= ~self.blocked[target[ok]]
+            result.append((target, ok, on_grid))
+        return result
+
+    """
+        This function returns the intra-tile distances of tile t: the local index of
+        every border cell with a move off the tile, and a (border cells x tile cells)
+        matrix of distances from each tile cell to each of those border cells
+        without leaving the tile. Whether a border cell really is an exit depends on
+        the neighbouring tile, so that is left to the caller. Tiles with the same
+        layout share the result
+    """
+    def tile_distances(self, t):
+        x, y = self.tile_cells(t)
+        s = x + self.l * y
+        x0, y0 = x[0], y[0]
+        w, h = x[-1] - x0 + 1, y[-1] - y0 + 1
+        key = (w, h, x0 == 0, y0 == 0, x0 + w == self.l, y0 + h == self.l,
+               self.blocked[s].tobytes(), self.is_goal[s].tobytes())
+        if key in self.tile_cache:
+            self.tile_cache.move_to_end(key)
+            return self.tile_cache[key]
+
+        #edges between cells of this tile
+        local = np.arange(len(s))
+        rows, cols = [], []
+        border = np.zeros(len(s), dtype=bool)
+        for target, ok, on_grid in self.moves(x, y):
+            tx, ty = target % self.l, target // self.l
+            inside = (tx >= x0) & (tx < x0 + w) & (ty >= y0) & (ty < y0 + h)
+            rows.append(local[ok & inside])
+            cols.append((tx[ok & inside] - x0) + w * (ty[ok & inside] - y0))
+            border |= on_grid & ~inside
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        G = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(s), len(s)))
+
+        #distances from every cell to the border cells, searched backwards from the border
+        exits = local[border]
+        X = dijkstra(G.T, indices=exits, unweighted=True) if len(exits) > 0 else np.zeros([0, len(s)])
+
+        self.tile_cache[key] = (exits, X)
+        if len(self.tile_cache) > self.cache_size:
+            self.tile_cache.popitem(last=False)
+        return exits, X
+
+    """
+        This function builds the abstract graph. Its nodes are the cells where paths
+        enter or leave a tile; entries link to the exits of their tile by the
+        intra-tile distance, and exits link to the cells they step into by 1
+    """
+    def make_abstract_graph(self):
+        self.node_of = np.full(self.l**2, -1, dtype=np.int64)
+        self.cells = []
+        rows, cols, weights = [], [], []
+
+        def nodes(c):
+            new = c[self.node_of[c] < 0]
+            self.node_of[new] = np.arange(len(self.cells), len(self.cells) + len(new))
+            self.cells.extend(new.tolist())
+            return self.node_of[c]
+
+        #cross-tile edges, found tile by tile so no whole-map move arrays are built
+        for t in range(self.n**2):
+            x, y = self.tile_cells(t)
+            s = x + self.l * y
+            for target, ok, _ in self.moves(x, y):
+                cross = ok.copy()
+                cross[ok] = self.tile_of(target[ok]) != t
+                if cross.any():
+                    rows.append(nodes(s[cross]))
+                    cols.append(nodes(target[cross]))
+                    weights.append(np.ones(cross.sum()))
+
+        #intra-tile edges from entries to exits
+        for t in range(self.n**2):
+            x, y = self.tile_cells(t)
+            s = x + self.l * y
+            exits, X = self.tile_distances(t)
+            linked = self.node_of[s[exits]] >= 0
+            exits, X = exits[linked], X[linked]
+            entries = np.nonzero(self.node_of[s] >= 0)[0]
+            if len(exits) == 0 or len(entries) == 0:
+                continue
+            d = X[:, entries]
+            b, e = np.nonzero(np.isfinite(d) & (d > 0))
+            rows.append(self.node_of[s[entries[e]]])
+            cols.append(self.node_of[s[exits[b]]])
+            weights.append(d[b, e])
+
+        self.num_nodes = len(self.cells)
+        self.cells = np.array(self.cells, dtype=np.int64)
+        #edge lists are kept compact since they dominate memory on large maps
+        self.edges = (np.concatenate(rows + [np.zeros(0, dtype=np.int64)]).astype(np.int32),
+                      np.concatenate(cols + [np.zeros(0, dtype=np.int64)]).astype(np.int32),
+                      np.concatenate(weights + [np.zeros(0)]).astype(np.float32))
+
+    """
+        This function returns the distances from every cell of the goal's tile to
+        the goal without leaving the tile
+    """
+    def goal_tile_distances(self, g):
+        t = self.tile_of(g)
+        x, y = self.tile_cells(t)
+        s = x + self.l * y
+        index = dict((c, i) for i, c in enumerate(s.tolist()))
+        rows, cols = [], []
+        for target, ok, _ in self.moves(x, y):
+            inside = np.array([ok[i] and int(target[i]) in index for i in range(len(s))], dtype=bool)
+            rows.append(np.nonzero(inside)[0])
+            cols.append(np.array([index[int(c)] for c in target[inside]], dtype=np.int64))
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        G = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(s), len(s)))
+        return s, dijkstra(G.T, indices=index[g], unweighted=True)
+
+    """
+        This function searches the abstract graph backwards from goal g and returns
+        the distance from every abstract node to g
+    """
+    def solve_goal(self, g):
+        if g in self.D:
+            return self.D[g]
+        rows, cols, weights = self.edges
+
+        #link the nodes of the goal's tile to a target node. These links are 1 longer
+        #than the distance to the goal, since the graph search drops zero-weight edges;
+        #every path to the target ends with exactly one of them, so 1 is taken off after
+        s, d_g = self.goal_tile_distances(g)
+        linked = (self.node_of[s] >= 0) & np.isfinite(d_g)
+        target = self.num_nodes
+        rows = np.concatenate([rows, self.node_of[s[linked]]])
+        cols = np.concatenate([cols, np.full(linked.sum(), target)])
+        weights = np.concatenate([weights, d_g[linked] + 1])
+
+        G = sp.csr_matrix((weights, (rows, cols)), shape=(target + 1, target + 1))
+        self.D[g] = dijkstra(G.T, indices=target)[:-1] - 1
+        return self.D[g]
+
+    """
+        This function returns the shortest path distance from every cell of tile t to goal g
+    """
+    def tile_distance_to_goal(self, g, t):
+        x, y = self.tile_cells(t)
+        s = x + self.l * y
+        D = self.solve_goal(g)
+
+        #leave the tile through the best exit
+        exits, X = self.tile_distances(t)
+        linked = self.node_of[s[exits]] >= 0
+        exits, X = exits[linked], X[linked]
+        d = np.full(len(s), np.inf)
+        if len(exits) > 0:
+            d = (X + D[self.node_of[s[exits]]][:, None]).min(axis=0)
+
+        #or reach the goal without leaving its tile
+        if self.tile_of(g) == t:
+            _, d_g = self.goal_tile_distances(g)
+            d = np.minimum(d, d_g)
+        d[s == g] = 0
+        return s, d
+
+    """
+        This function returns the values of every cell of tile t for goal g
+    """
+    def tile_values(self, g, t):
+        key = (g, t)
+        if key in self.value_cache:
+            self.value_cache.move_to_end(key)
+            return self.value_cache[key]
+
+        s, d = self.tile_distance_to_goal(g, t)
+        V = self.distance_values(d)
+        #goal cells go straight to the terminal state
+        other = self.is_goal[s] & (s != g)
+        V[other] = -1 + self.gamma * self.terminal_value(self.horizon_left(1))
+        V[s == g] = 100 + self.gamma * self.terminal_value(self.horizon_left(1))
+
+        self.value_cache[key] = (s, V)
+        if len(self.value_cache) > self.cache_size:
+            self.value_cache.popitem(last=False)
+        return s, V
+
+    """
+        This function returns the number of steps left after k steps (None means no limit)
+    """
+    def horizon_left(self, k):
+        if self.horizon == None:
+            return None
+        return self.horizon - k
+
+    """
+        This function returns the value of the terminal state with k steps left
+    """
+    def terminal_value(self, k):
+        if k == None:
+            return -1 / (1 - self.gamma)
+        return -(1 - self.gamma**max(k, 0)) / (1 - self.gamma)
+
+    """
+        This function turns distances to the goal into values: -1 for every step, then
+        the goal's value discounted by the distance
+    """
+    def distance_values(self, d):
+        d = np.asarray(d, dtype=float)
+        k = np.inf if self.horizon == None else self.horizon
+        reach = np.isfinite(d) & (d < k)
+        V = np.full(len(d), self.terminal_value(self.horizon))
+
+        dr = d[reach]
+        steps = -(1 - self.gamma**dr) / (1 - self.gamma)
+        if self.horizon == None:
+            V_goal = 100 + self.gamma * self.terminal_value(None)
+        else:
+            V_goal = 100 + self.gamma * (-(1 - self.gamma**(k - dr - 1)) / (1 - self.gamma))
+        V[reach] = steps + self.gamma**dr * V_goal
+        return V
+
+    """
+        This function returns the value of state s for goal g
+    """
+    def value(self, g, s):
+        if s == self.states - 1:
+            return self.terminal_value(self.horizon)
+        cells, V = self.tile_values(g, self.tile_of(s))
+        return V[np.searchsorted(cells, s)]
+
+    """
+        This function returns the next state given the current state and action (same as MDP.act)
+    """
+    def act(self, a, s):
+        if s == self.states - 1 or self.is_goal[s]:
+            return self.states - 1
+        if a == 5:
+            return s
+        target, ok, _ = self.moves(np.array([s % self.l]), np.array([s // self.l]))[a]
+        return int(target[0]) if ok[0] else s
+
+    """
+        This function returns the greedy action at state s for goal g (first best action on ties)
+    """
+    def policy(self, g, s):
+        q = [self.value(g, self.act(a, s)) for a in range(self.actions)]
+        return int(np.argmax(q))
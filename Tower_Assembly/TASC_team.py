@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+"""
+SCA for teams of several robots and several humans building one tower. Every human
+has their own goal (the tower is finished when it matches it; if the humans' goals
+differ, when it matches any goal tower) and their own goal posterior, predicted from
+their own last move, and every robot helps one human (robot j pairs with human j %
+number of humans). The robots choose their actions together: each robot scores its
+actions with the usual Effort, Legibility, and Value combination under its human's
+posterior, and the joint action is found by coordinate ascent with a penalty for two
+robots moving the same block, so a team step costs about as much per agent as a
+single robot decision. The robots then act one after another; a robot whose action
+an earlier robot made invalid or changed chooses again at the current state. Team
+decisions look one step ahead (no depth or beam).
+"""
+
+import numpy as np
+
+from TASC_tower import SCA
+
+
+"""
+    This class implements the SCA algorithm for teams of robots and humans
+"""
+class TeamSCA(SCA):
+    def __init__(self, num_robots=2, num_humans=2, wV=0.9, wE=0.05, wL=0.05, human_goal=0,
+                 human_goals=None, sweeps=10, conflict=1.0, **kwargs):
+        if kwargs.get('depth', 1) != 1 or kwargs.get('beam') != None:
+            raise ValueError('team decisions look one step ahead, depth and beam are not supported')
+        SCA.__init__(self, wV, wE, wL, human_goal=human_goal, **kwargs)
+        self.num_robots = num_robots
+        self.num_humans = num_humans
+
+        #goal of every human (indices into the goals, human_goal for everyone by default)
+        if human_goals == None:
+            human_goals = [human_goal] * num_humans
+        if len(human_goals) != num_humans:
+            raise ValueError('%d goals given for %d humans' % (len(human_goals), num_humans))
+        self.human_goals = [self.G[i] for i in human_goals]
+        #the tower is finished at the humans' goal, or at any goal tower if their goals differ
+        self.human_goal = self.human_goals[0] if len(set(self.human_goals)) == 1 else None
+
+        #coordinate ascent settings: at most sweeps passes over the robots, and the
+        #score lost by each pair of robots moving the same block
+        self.sweeps = sweeps
+        self.conflict = conflict
+
+        #state before and after each human's last move (None until they moved)
+        self.moves = [(None, None) for i in range(num_humans)]
+        self.config.update({'num_robots': num_robots, 'num_humans': num_humans, 'human_goals': list(human_goals)})
+
+    """
+        This function returns the predicted goal, its probability and the
+        probabilities of all goals of human i, from their last move
+    """
+    def human_posterior(self, i):
+        (s_old, s) = self.moves[i]
+        if s_old == None:
+            eq_p = 1.0 / len(self.G)
+            return (self.G[self.rng.randint(0, len(self.G) - 1)], eq_p, [eq_p for g in self.G])
+        max_g, max_pr, probs = self.goal_probs(s, s_old)
+        if len(max_g) == 0:
+            max_g = self.G
+        return (max_g[self.rng.randint(0, len(max_g) - 1)], max_pr, probs)
+
+    """
+        This function returns the block an action moves from state s, or -1 if the
+        action leaves the state as it is (idle or invalid)
+    """
+    def moved_block(self, a, s, s_new):
+        if s_new == s:
+            return -1
+        return self.t.a_dict[a][0]
+
+    """
+        This function returns whether action a does at state s_now what it did at
+        state s: nothing in both, or moving its block to the same place
+    """
+    def same_move(self, a, s, s_now):
+        s_new = self.t.act(a, s, g_num=self.human_goal)
+        s_now_new = self.t.act(a, s_now, g_num=self.human_goal)
+        if s_new == s or s_now_new == s_now:
+            return s_new == s and s_now_new == s_now
+        if s_new == self.t.terminal_state or s_now_new == self.t.terminal_state:
+            return s_new == s_now_new
+        b = self.t.a_dict[a][0]
+        return self.t.num_to_state[s_new][b] == self.t.num_to_state[s_now_new][b]
+
+    """
+        This function returns one action per robot. unary[j][a] is the score of
+        action a for robot j and blocks[a] the block it moves (-1 for none)
+    """
+    def joint_action(self, unary, blocks):
+        unary = np.array(unary)
+        blocks = np.array(blocks)
+        moves = blocks >= 0
+        #number of robots moving each block
+        used = np.zeros(self.t.num_blocks, dtype=int)
+
+        #start from the best action of each robot given the robots before it
+        actions = []
+        for j in range(self.num_robots):
+            a = self.pick(unary[j] - self.conflict * np.where(moves, used[blocks], 0))
+            actions.append(a)
+            if moves[a]:
+                used[blocks[a]] += 1
+
+        #coordinate ascent: move one robot at a time to its best action given the
+        #others, until no robot changes its action
+        for sweep in range(self.sweeps):
+            changed = False
+            for j in range(self.num_robots):
+                if moves[actions[j]]:
+                    used[blocks[actions[j]]] -= 1
+                vals = unary[j] - self.conflict * np.where(moves, used[blocks], 0)
+                if vals[actions[j]] < vals.max():
+                    actions[j] = self.pick(vals)
+                    changed = True
+                if moves[actions[j]]:
+                    used[blocks[actions[j]]] += 1
+            if not changed:
+                break
+
+        return actions
+
+    """
+        This function returns a random one of the highest valued actions
+    """
+    def pick(self, vals):
+        maxes = np.flatnonzero(vals == vals.max())
+        return int(maxes[self.rng.randint(0, len(maxes) - 1)])
+
+    """
+        This function chooses and takes the actions of all robots
+    """
+    def robots_action(self, sol):
+        s = self.s
+        posteriors = [self.human_posterior(i) for i in range(self.num_humans)]
+
+        #score every action once per human posterior (robots helping the same human share it)
+        unary = []
+        scores = {}
+        for j in range(self.num_robots):
+            i = j % self.num_humans
+            if i not in scores:
+                (Gp, p, probs) = posteriors[i]
+                scores[i] = self.action_scores(s, Gp, probs)
+            unary.append(scores[i][1])
+        succ = scores[0][0]
+        blocks = [self.moved_block(a, s, succ[a]) for a in range(self.AR)]
+
+        actions = self.joint_action(unary, blocks)
+
+        #the robots act one after another on the shared tower. A robot whose action the
+        #robots before it made invalid or changed chooses again at the current state,
+        #with the penalty for moving a block another robot moved
+        moved = np.zeros(self.t.num_blocks, dtype=int)
+        for j, aR in enumerate(actions):
+            if self.s == self.S - 1:
+                break
+            (Gp, p, probs) = posteriors[j % self.num_humans]
+            if self.s != s and not self.same_move(aR, s, self.s):
+                succ_now, vals = self.action_scores(self.s, Gp, probs)
+                blocks_now = np.array([self.moved_block(a, self.s, succ_now[a]) for a in range(self.AR)])
+                aR = self.pick(np.array(vals) - self.conflict * np.where(blocks_now >= 0, moved[blocks_now], 0))
+            s_new = self.t.sample(aR, self.s, g_num=self.human_goal)
+            if s_new != self.s and s_new != self.S - 1:
+                moved[self.t.a_dict[aR][0]] += 1
+            sol.append((self.num_to_output(s_new), 'R', j))
+            self.record('R', self.s, aR, s_new, Gp, p, probs, agent=j)
+            self.log("STATE robot", j, ":", self.num_to_output(self.s), " AR:", self.move_strings[aR])
+            self.s = s_new
+
+    """
+        This function takes the actions of all humans, one after another, each
+        following the policy of their own goal
+    """
+    def humans_action(self, sol):
+        for i in range(self.num_humans):
+            if self.s == self.S - 1:
+                break
+            aH = self.policies[self.human_goals[i]][self.s]
+            s_new = self.t.sample(aH, self.s, g_num=self.human_goal)
+            sol.append((self.num_to_output(s_new), 'H', i))
+            self.record('H', self.s, aH, s_new, agent=i)
+            self.log("STATE human", i, ":", self.num_to_output(self.s), " AH:", self.move_strings[aH])
+            self.moves[i] = (self.s, s_new)
+            self.s = s_new
+
+    """
+        This function picks the actions for each team, robots and humans taking
+        turns as given by r_act and h_act
+    """
+    def team(self, h_act, r_act, s=None, store=None, max_t=1000):
+        if s == None:
+            s = self.t.state_to_num[self.t.initial_state]
+        self.s = s
+        self.moves = [(None, None) for i in range(self.num_humans)]
+        t = 0
+
+        sol = [self.num_to_output(self.s)]
+        self.begin_episode(store)
+        while self.s != self.S - 1 and t < max_t:
+            if r_act(t) == True:
+                self.robots_action(sol)
+            if self.s != self.S - 1 and h_act(t) == True:
+                self.humans_action(sol)
+            t += 1
+            self.log(t)
+
+        #close the episode if it was cut off before the tower was finished
+        if self.store != None:
+            self.store.end_episode()
+            self.store = None
+        elif store == None:
+            print(sol)
+        return sol
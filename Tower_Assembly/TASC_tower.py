@@ -7,22 +7,38 @@ goal probabilities.
 """
 
 import numpy as np
+import os
 import random
 import pickle
+import sys
+import time
 
+from collections import OrderedDict
 from io import BytesIO
 from scipy.spatial.distance import euclidean
 from tower_assembly import TowerAssembly
+from tower_problem import TowerProblem
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from engine import Engine
+from value_store import ValueStore
+
+"""
+    Raised inside the lookahead search when the decision deadline has passed
+"""
+class SearchTimeout(Exception):
+    pass
 
 """
     This class implements the SCA algorithm
 """
 class SCA:
-    def __init__(self, wV=0.9, wE=0.05, wL=0.05, human_goal=0):
+    def __init__(self, wV=0.9, wE=0.05, wL=0.05, human_goal=0, depth=1, discount=0.9,
+                 table_size=100000, bucket=10, beam=None, slip=0.0, fast=False, value_dtype='float64', rng=None):
         np.random.seed(1)
 
         #create instance of tower assembly and load MDP data
-        self.t = TowerAssembly()
+        self.t = TowerAssembly(slip=slip, fast=fast)
         self.t.num_to_state = pickle.load(open('num_to_state.pkl', 'rb'))
         self.t.state_to_num = pickle.load(open('state_to_num.pkl', 'rb'))
         self.t.terminal_state = len(self.t.num_to_state.keys())
@@ -32,23 +48,28 @@ class SCA:
         self.AR = self.t.get_num_actions() #number of robot actions
 
         self.Gp = None #predicted goal
-        self.Vs_human = pickle.load(open('Vs_human.pkl', 'rb')) #dictionary indexed by goal state. Gives state values from perspective of human (planned goal)
+        #value and policy tables are kept in ValueStores (value_dtype 'float32' or 'int16' saves memory, see value_store.py)
+        self.Vs_human = ValueStore(pickle.load(open('Vs_human.pkl', 'rb')), dtype=value_dtype) #indexed by goal state. Gives state values from perspective of human (planned goal)
         #self.Vs_robot = pickle.load(open('Vs_robot.pkl', 'rb')) #dictionary indexed by predicted goal state. Gives state values from perspective of robot (predicted goal)
-        self.Vs_robot = pickle.load(open('Vs_human.pkl', 'rb')) #dictionary indexed by predicted goal state. Gives state values from perspective of robot (predicted goal)
-        self.policies = pickle.load(open('policies.pkl', 'rb')) #policies learned in MDP
+        self.Vs_robot = self.Vs_human #indexed by predicted goal state. Gives state values from perspective of robot (predicted goal), same values as the human's
+        self.policies = ValueStore(pickle.load(open('policies.pkl', 'rb')), dtype=np.int8) #policies learned in MDP
+        if fast:
+            self.t.make_arrays()
 
         #find maximum state value given robot's predicted goal
         self.maxVs = {}
         for G in self.Vs_robot:
-            self.maxVs[G] = 0
-            for v in self.Vs_robot[G]:
-                self.maxVs[G] = max(v,self.maxVs[G])
+            self.maxVs[G] = max(0, self.Vs_robot.array(G).max().item())
 
         #set weights for Value, Effort, and Legibility
         self.wV = wV
         self.wE = wE
         self.wL = wL
 
+        #goal prediction and action scores come from the engine (rules in tower_problem.py)
+        self.problem = TowerProblem(self.t, self.G)
+        self.engine = Engine(self.problem, wV, wE, wL).set_tables(self.Vs_human, self.policies)
+
         #set current state and previous state
         self.s = None
         self.s_old = None
@@ -62,6 +83,52 @@ class SCA:
         for i in range(self.t.get_num_actions()):
             self.move_strings[i] = str(self.t.a_dict[i])
 
+        #lookahead settings: depth is the number of robot decisions planned ahead
+        #(1 plans only the next action), discount weighs later decisions, beam
+        #limits how many successors are expanded below the first decision
+        self.depth = depth
+        self.discount = discount
+        self.beam = beam
+
+        #best possible combined score of a single action (effort is at most 0.9)
+        self.max_score = self.wE*0.9 + self.wL + self.wV
+
+        #transposition table keyed on (state, human goal, posterior bucket, depth), kept in LRU order
+        self.table = OrderedDict()
+        self.table_size = table_size
+        self.bucket = bucket
+        self.search_stats = {'nodes': 0, 'hits': 0, 'pruned': 0, 'expanded': 0}
+
+        #absolute time by which an anytime decision has to be made (None means no limit)
+        self.deadline = None
+        self.decision_stats = None
+
+        #settings saved with every episode written to a trajectory store
+        self.config = {'task': 'tower', 'wV': wV, 'wE': wE, 'wL': wL, 'human_goal': human_goal,
+                       'depth': depth, 'discount': discount, 'beam': beam, 'slip': slip, 'value_dtype': value_dtype}
+        self.store = None
+        #steps are not printed while they are recorded
+        self.quiet = False
+
+        #random choices (see set_rng) and the scores of the robot's last decision
+        self.set_rng(random if rng == None else rng)
+        self.scores = None
+
+    """
+        This function makes the robot's choices and the sampled outcomes use rng
+        (a random.Random, or the random module)
+    """
+    def set_rng(self, rng):
+        self.rng = rng
+        self.t.rng = rng
+
+    """
+        This function prints a step, unless steps are being recorded
+    """
+    def log(self, *args):
+        if not self.quiet:
+            print(*args)
+
     """
         Thus function is for writing the solution in terms of state rather than action
     """
@@ -82,57 +149,13 @@ class SCA:
         else:
             return 0.9
 
-    """
-        Simple distance function between two states in this tower assembly problem
-    """
-    def dist(self, g, s):
-        d = 0
-        for i in range(self.t.num_blocks):
-            if g[i][0] == 1:
-                d += abs(g[i][0] - s[i][0])
-            elif g[i][1] == 1:
-                d += abs(g[i][1] - s[i][1])
-            elif g[i][2] != 0 and (s[i][0] == 1 or (s[i][2] != 0 and s[i][2] != g[i][2])):
-                d += 2
-            elif g[i][2] != 0 and s[i][1] == 1:
-                d += 1
-        return d
-
     """
         This function returns the legibility probability of goal G given a robot action a
     """
     def PrG(self,G,a,s_num=None):
         if s_num == None:
             s_num = self.s
-        s = self.t.num_to_state[s_num]
-        g = self.t.num_to_state[G]
-
-        #s_new is predicted new state given action a
-        s_new = self.t.num_to_state[self.t.act(a, s_num, g_num=self.human_goal)]
-
-        #rudimentary distance metric between states
-        d_G = self.dist(g, s) - self.dist(g, s_new)
-
-        #if the move is away from the goal, return probability of 0
-        if d_G < 0:
-            return 0
-
-        #calculate euclidean distance difference measure for all goals
-        #keep track of total sum of ds for normalization purposes
-        sum_dist = 0
-        for i in self.G:
-            g = self.t.num_to_state[i]
-            d = self.dist(g, s) - self.dist(g, s_new)
-
-            #disregard negative and 0 ds
-            if d > 0:
-                sum_dist +=d
-
-        #if nothing changed (idle)
-        if sum_dist == 0:
-            return 0
-
-        return (d_G/sum_dist)
+        return self.problem.legibility(G, a, s_num, self.human_goal)
 
     """
         This function predicts the goal state and probability based off of
@@ -145,61 +168,20 @@ class SCA:
 
         #if the person doesn't take an action, pick a random goal and assign equal % probability
         if a == None:
-            print(eq_probs)
-            r = random.randint(0,len(self.G)-1)
+            self.log(eq_probs)
+            r = self.rng.randint(0,len(self.G)-1)
             return (self.G[r], eq_p, eq_probs)
 
-        max_g = []
-        max_val = 0
-
-        #keep running sum of values for normalization
-        action_values = []
-        sum_vals = 0
-
-        non_neg = []
-        #iterate through goals, calculating the difference in mdp state value
-        #caused by each action
-        for g in self.G:
-            val = self.Vs_human[g][self.s] - self.Vs_human[g][self.s_old]
-
-            #maintain maximum difference goal mdp
-            if val > max_val:
-                max_g = [g]
-                max_val = val
-            elif val == max_val:
-                max_g.append(g)
-
-            #consider only positive differences
-            if val >= 0:
-                sum_vals += val
-                non_neg.append(True)
-            else:
-                non_neg.append(False)
-
-            action_values.append(val)
-
-        if sum_vals == 0:
-            max_g = []
-            num = 0
-            for b in non_neg:
-                if b:
-                    num += 1
-            if num > 0:
-                eq_p = 1 / num
-                for i in range(len(non_neg)):
-                    if non_neg[i]:
-                        eq_probs[i] = eq_p
-                        max_g.append(self.G[i])
-                    else:
-                        eq_probs[i] = 0
-            return (max_g[random.randint(0,len(max_g)-1)], eq_p, eq_probs)
-
-        #normalize the (positive) difference values for each goal mdp
-        #assign probability 0 if the difference is negative
-        probs = [val / sum_vals if val > 0 else 0 for val in action_values]
-        max_pr = max(max_val / sum_vals, eq_p)
-
-        return (max_g[random.randint(0,len(max_g)-1)], max_pr, probs)
+        max_g, max_pr, probs = self.goal_probs(self.s, self.s_old)
+        return (max_g[self.rng.randint(0,len(max_g)-1)], max_pr, probs)
+
+    """
+        This function returns the most likely goals, their probability and the
+        probabilities of all goals after the human moved from s_old to s (see
+        TowerProblem.goal_probs)
+    """
+    def goal_probs(self, s, s_old):
+        return self.engine.goal_probs(s, s_old)
 
 
     """
@@ -211,7 +193,7 @@ class SCA:
         poss_actions.append(self.policies[G][self.s])
 
         #return a random possible action
-        r = random.randint(0,len(poss_actions)-1)
+        r = self.rng.randint(0,len(poss_actions)-1)
 
         return poss_actions[r]
 
@@ -220,19 +202,20 @@ class SCA:
         #choose human action based on the policies
         self.aH = self.policies[self.human_goal][self.s]
         #calculate new state
-        s_new = self.t.act(self.aH, self.s, g_num=self.human_goal)
+        s_new = self.t.sample(self.aH, self.s, g_num=self.human_goal)
         #print("s_new:", s_new)
 
         #append the indices of the new visited states to the solution (first human action, then robot action)
-        sol.append((self.num_to_output(self.t.act(self.aH,self.s, g_num=self.human_goal)), 'H'))
-        print("STATE human:",self.num_to_output(self.s)," AH:", self.move_strings[self.aH])
+        sol.append((self.num_to_output(s_new), 'H'))
+        self.record('H', self.s, self.aH, s_new)
+        self.log("STATE human:",self.num_to_output(self.s)," AH:", self.move_strings[self.aH])
 
         #save old state, new state
         self.s_old = self.s
         self.s = s_new
 
 
-    def robot_action(self, sol):
+    def robot_action(self, sol, deadline=None):
         #collect maximum value options for robot actions
         mx = -np.inf
         maxes = []
@@ -240,46 +223,26 @@ class SCA:
         #robot action
         aR = None
 
-        #predict the human's goal and action
+        #predict the human's goal
         #self.Gp, p, probs = self.CG_euclid(self.aH)
         self.Gp, p, probs = self.CG_markov(self.aH)
-        ap = self.CA(self.Gp)
-        print("Predicted goal:", self.t.num_to_state[self.Gp] , " Prob:", p)
-        print("Probs: " + str(probs))
+        self.log("Predicted goal:", self.t.num_to_state[self.Gp] , " Prob:", p)
+        self.log("Probs: " + str(probs))
 
-        V_list = []
-        for a in range(self.AR):
-            s_new = self.t.act(a, self.s, g_num=self.human_goal)
-            for i, g in enumerate(self.G):
-                V_g = self.Vs_robot[g][s_new] - self.Vs_robot[g][self.s]
-                V_list.append(V_g)
-        max_V = np.max(np.absolute(V_list))
+        #score every action, then look further ahead if asked to
+        if deadline != None:
+            vals = self.anytime_values(probs, deadline)
+        else:
+            succ, vals = self.action_scores(self.s, self.Gp, probs)
+            if self.depth > 1:
+                vals = self.lookahead(succ, vals, probs, self.depth)
+        self.scores = list(vals)
 
         #look through all possible actions
         for a in range(self.AR):
-            #see what the next state would be
-            s_new = self.t.act(a, self.s, g_num=self.human_goal)
-            #see what the next state would be after one predicted action by human
-            #s_one = self.mdp.act(ap,self.s)
-            #calculate probability of effort
-            E = self.PrE(a, self.s, s_new)
-
-            #calculate probability that action a will be percieved as towards
-            #predicted goal
-            L = self.PrG(self.Gp, a)
-
-            #calculate expected value of new state
-            V = 0
-            if max_V > 0:
-                for i, g in enumerate(self.G):
-                    V += probs[i] * ((self.Vs_robot[g][s_new] - self.Vs_robot[g][self.s]) / max_V)
-                #normalize
-                V = (V/2) + 0.5
-
-            #combined value of Effort, Legibility, and Value
-            val = self.wE*E + self.wL*L + self.wV*V
+            val = vals[a]
 #            print('Probs ' + str(probs))
-            print('Val ' + str(self.t.a_dict[a]) + " " + str(val))
+            self.log('Val ' + str(self.t.a_dict[a]) + " " + str(val))
 
             #if the value of this action is greater than previously seen, save it
             if val > mx:
@@ -289,23 +252,200 @@ class SCA:
                 maxes.append(a)
 
         #choose a random one of the max valued actions
-        aR = maxes[random.randint(0,len(maxes)-1)]
+        aR = maxes[self.rng.randint(0,len(maxes)-1)]
 
 
-        sol.append((self.num_to_output(self.t.act(aR,self.s, g_num=self.human_goal)), 'R'))
-        print("STATE robot:",self.num_to_output(self.s)," AR:", self.move_strings[aR])
-        s_new = self.t.act(aR,self.s, g_num=self.human_goal)
+        s_new = self.t.sample(aR,self.s, g_num=self.human_goal)
+        sol.append((self.num_to_output(s_new), 'R'))
+        self.record('R', self.s, aR, s_new, self.Gp, p, probs)
+        self.log("STATE robot:",self.num_to_output(self.s)," AR:", self.move_strings[aR])
 
         #save old state, new state
         self.s = s_new
 
 
     """
-        This function picks the actions for each teammate
+        This function saves a step in the trajectory store, if there is one. The
+        episode ends when the terminal state is reached
     """
-    def team(self, h_act, r_act, s=None):
+    def record(self, actor, s, a, s_new, Gp=-1, p=np.nan, probs=None, agent=0):
+        if self.store != None:
+            self.store.append(actor, s, a, s_new, Gp, p, probs, agent)
+            if s_new == self.S - 1:
+                self.store.end_episode()
+                self.store = None
+
+    """
+        This function returns the next state and the combined value of Effort,
+        Legibility, and Value for every robot action from state s (see
+        TowerProblem.action_scores)
+    """
+    def action_scores(self, s, Gp, probs):
+        succ, vals, _ = self.engine.action_scores(s, Gp, probs, self.human_goal)
+        return succ, vals
+
+    """
+        This function adds the discounted value of the next depth-1 robot decisions
+        to the score of every action from the current state. Actions whose score
+        cannot beat the best one even with perfect future decisions are pruned
+        and get a value of -inf
+    """
+    def lookahead(self, succ, scores, probs, depth, order=None):
+        self.search_stats = {'nodes': 0, 'hits': 0, 'pruned': 0, 'expanded': 0}
+        bound = self.future_bound(depth - 1)
+
+        #expand each distinct next state once, most promising first
+        if order == None:
+            order = sorted(set(succ), key=lambda s_new: -scores[succ.index(s_new)])
+        best = -np.inf
+        values = {}
+        for s_new in order:
+            score = scores[succ.index(s_new)]
+            if score + bound < best:
+                self.search_stats['pruned'] += 1
+                continue
+            values[s_new] = score + self.discount * self.respond(s_new, probs, depth - 1)
+            self.search_stats['expanded'] += 1
+            best = max(best, values[s_new])
+
+        return [values.get(s_new, -np.inf) for s_new in succ]
+
+    """
+        This function scores the robot actions from the current state within a time
+        budget of deadline seconds. The one-step scores are always computed; the
+        lookahead is then deepened one decision at a time, up to self.depth, trying
+        the actions the goal policies suggest for the most likely goals first. The
+        values of the deepest fully searched level are returned, and what was
+        searched is saved in self.decision_stats
+    """
+    def anytime_values(self, probs, deadline):
+        start = time.time()
+        self.deadline = start + deadline
+        stats = {'depth': 1, 'evaluated': 0, 'nodes': 0, 'hits': 0, 'pruned': 0, 'complete': True}
+
+        succ, vals = self.action_scores(self.s, self.Gp, probs)
+        stats['evaluated'] = self.AR
+
+        #policy-suggested next states for likely goals first, then by one-step score
+        order = []
+        for i in sorted(range(len(self.G)), key=lambda i: -probs[i]):
+            s_new = succ[self.policies[self.G[i]][self.s]]
+            if s_new not in order:
+                order.append(s_new)
+        for s_new in sorted(set(succ), key=lambda s_new: -vals[succ.index(s_new)]):
+            if s_new not in order:
+                order.append(s_new)
+
+        for depth in range(2, self.depth + 1):
+            try:
+                deeper = self.lookahead(succ, vals, probs, depth, order=order)
+            except SearchTimeout:
+                stats['complete'] = False
+                break
+            finally:
+                for k in ['nodes', 'hits', 'pruned']:
+                    stats[k] += self.search_stats[k]
+                #only the next states whose search finished (not pruned or cut off by the deadline)
+                stats['evaluated'] += self.search_stats['expanded']
+            vals = deeper
+            stats['depth'] = depth
+
+            #search the best action of this level first at the next level
+            best = max(order, key=lambda s_new: vals[succ.index(s_new)])
+            order.remove(best)
+            order.insert(0, best)
+
+        self.deadline = None
+        stats['time'] = time.time() - start
+        self.decision_stats = stats
+        return vals
+
+    """
+        This function returns the expected value of the robot's next depth decisions
+        after the human responds from state s, with the human's action predicted
+        from the policy of each goal weighted by its probability
+    """
+    def respond(self, s, probs, depth):
+        if depth == 0:
+            return 0
+        if s == self.t.terminal_state or s == self.human_goal:
+            return self.future_bound(depth) / self.discount
+
+        #group the goals by the state the human's predicted action leads to
+        outcomes = {}
+        for i, g in enumerate(self.G):
+            if probs[i] > 0:
+                s_h = self.t.act(self.policies[g][s], s, g_num=self.human_goal)
+                outcomes[s_h] = outcomes.get(s_h, 0) + probs[i]
+        total = sum(outcomes.values())
+        if total == 0:
+            return 0
+
+        v = 0
+        for s_h, w in outcomes.items():
+            if s_h == self.t.terminal_state or s_h == self.human_goal:
+                v += (w / total) * self.future_bound(depth) / self.discount
+                continue
+            #update the goal probabilities from the predicted human move
+            _, _, probs_h = self.goal_probs(s_h, s)
+            v += (w / total) * self.plan(s_h, probs_h, depth)
+        return v
+
+    """
+        This function returns the value of the best robot action from state s with
+        depth robot decisions left, using the transposition table
+    """
+    def plan(self, s, probs, depth):
+        if self.deadline != None and time.time() > self.deadline:
+            raise SearchTimeout()
+
+        #the human's goal is part of the key since it decides which moves finish the tower
+        key = (s, self.human_goal, tuple(int(round(p * self.bucket)) for p in probs), depth)
+        if key in self.table:
+            self.table.move_to_end(key)
+            self.search_stats['hits'] += 1
+            return self.table[key]
+        self.search_stats['nodes'] += 1
+
+        #the most likely goal is the one the robot tries to be legible about
+        Gp = self.G[int(np.argmax(probs))]
+        succ, scores = self.action_scores(s, Gp, probs)
+        bound = self.future_bound(depth - 1)
+
+        order = sorted(set(succ), key=lambda s_new: -scores[succ.index(s_new)])
+        if self.beam != None:
+            self.search_stats['pruned'] += max(0, len(order) - self.beam)
+            order = order[:self.beam]
+
+        best = -np.inf
+        for s_new in order:
+            score = scores[succ.index(s_new)]
+            if score + bound < best:
+                self.search_stats['pruned'] += 1
+                continue
+            best = max(best, score + self.discount * self.respond(s_new, probs, depth - 1))
+
+        self.table[key] = best
+        if len(self.table) > self.table_size:
+            self.table.popitem(last=False)
+        return best
+
+    """
+        This function returns the most the next depth robot decisions can add to
+        the value of an action
+    """
+    def future_bound(self, depth):
+        return sum(self.max_score * self.discount**i for i in range(1, depth + 1))
+
+    """
+        This function picks the actions for each teammate. If a trajectory store is
+        given, every step is written to it instead of printing the steps and the solution
+    """
+    def team(self, h_act, r_act, s=None, store=None):
         if s == None:
-            self.s = self.t.state_to_num[self.t.initial_state]
+            s = self.t.state_to_num[self.t.initial_state]
+        self.s = s
+        self.aH = None
         self.s_old = None
         #start at time 0
         t = 0
@@ -315,6 +455,7 @@ class SCA:
 
         #start by appending the indices of the initial state
         sol.append(self.num_to_output(self.s))
+        self.begin_episode(store)
         #while not in the last state (a terminal state that all goals lead to)
         while self.s != self.S - 1:
             if r_act(t) == True:
@@ -324,16 +465,29 @@ class SCA:
 
             #increase time by 1
             t += 1
-            print(t)
+            self.log(t)
 
         #print the total solution
-        print(sol)
+        if store == None:
+            print(sol)
 
         return sol
 
-    def game_init(self, s=None):
+    """
+        This function starts writing a new episode to the trajectory store, if one
+        is given (steps are then not printed)
+    """
+    def begin_episode(self, store):
+        self.store = store
+        self.quiet = store != None
+        if store != None:
+            store.begin_episode(self.config, -1 if self.human_goal == None else self.human_goal)
+
+    def game_init(self, s=None, store=None):
         if s == None:
-            self.s = self.t.state_to_num[self.t.initial_state]
+            s = self.t.state_to_num[self.t.initial_state]
+        self.s = s
+        self.aH = None
         self.s_old = None
         #start at time 0
         t = 0
@@ -342,19 +496,21 @@ class SCA:
         self.game_sol = []
         #start by appending the indices of the initial state
         self.game_sol.append(self.num_to_output(self.s))
+        self.begin_episode(store)
         return self.game_sol
 
-    def game_robot_step(self):
+    def game_robot_step(self, deadline=None):
         #while not in the last state (a terminal state that all goals lead to)
         if self.s != self.S - 1:
-                self.robot_action(self.game_sol)
+                self.robot_action(self.game_sol, deadline=deadline)
         return self.game_sol
 
     def game_human_step(self, a):
         if self.s != self.S - 1:
                 s_new = self.t.act(a,self.s, g_num=self.human_goal)
                 self.game_sol.append((self.num_to_output(s_new), 'H'))
-                print("STATE human:",self.num_to_output(self.s)," AH:", self.move_strings[a])
+                self.record('H', self.s, a, s_new)
+                self.log("STATE human:",self.num_to_output(self.s)," AH:", self.move_strings[a])
 
                 #save old state, new state
                 self.s_old = self.s
@@ -367,10 +523,11 @@ class SCA:
         #choose action based on the policies
         self.aH = self.policies[self.human_goal][self.s]
         #calculate new state
-        s_new = self.t.act(self.aH, self.s, g_num=self.human_goal)
+        s_new = self.t.sample(self.aH, self.s, g_num=self.human_goal)
 
         self.game_sol.append((self.num_to_output(s_new), 'H'))
-        print("STATE human:",self.num_to_output(self.s)," AH:", self.move_strings[self.aH])
+        self.record('H', self.s, self.aH, s_new)
+        self.log("STATE human:",self.num_to_output(self.s)," AH:", self.move_strings[self.aH])
 
         #save old state, new state
         self.s_old = self.s
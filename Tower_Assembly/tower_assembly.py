@@ -1,11 +1,22 @@
 #!/usr/bin/env python
 
+import os
+import random
+import sys
+import numpy as np
+import scipy.sparse as sp
+
+import tower_kernels
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from solver import value_iteration
+
 """
     This class implements an MDP for the tower assembly task.
 """
 
 class TowerAssembly:
-    def __init__(self):
+    def __init__(self, slip=0.0, fast=False):
         self.STO = 0
         self.BIN = 1
         self.TAB = 2
@@ -32,6 +43,17 @@ class TowerAssembly:
 
         self.terminal_state = -1
 
+        #probability that a block action fails and the state stays the same
+        self.slip = slip
+
+        #random numbers for sampling outcomes (the random module unless a
+        #random.Random is set, e.g. one per episode for reproducible runs)
+        self.rng = random
+
+        #use the compiled kernels in tower_kernels (plain Python if Numba is missing)
+        self.fast = fast
+        self.loc = None
+
     def get_table_height(self, state):
         h = 0
         for s_b in state:
@@ -123,6 +145,12 @@ class TowerAssembly:
         return d
 
     def act(self, a_num, s_num, g_num=None):
+        if self.fast:
+            if self.loc is None:
+                self.make_arrays()
+            return tower_kernels.act(a_num, s_num, -1 if g_num == None else g_num, self.loc,
+                                     self.codes, self.code_order, self.goal_nums,
+                                     self.terminal_state, self.num_block_actions)
         if s_num == self.terminal_state:
             return self.terminal_state
         try:
@@ -141,6 +169,21 @@ class TowerAssembly:
         else:
             return self.state_to_num[s_new]
 
+    """
+        This function builds the array-backed states used by the compiled kernels
+    """
+    def make_arrays(self):
+        if not hasattr(self, 'num_to_state'):
+            self.get_state_enumeration()
+        states = [self.num_to_state[i] for i in range(len(self.num_to_state))]
+        self.loc = tower_kernels.make_locations(states, self.num_blocks)
+
+        #sorted state codes for binary search, and the state number of each code
+        codes = np.array([tower_kernels.encode(row) for row in self.loc], dtype=np.int64)
+        self.code_order = np.argsort(codes)
+        self.codes = codes[self.code_order]
+        self.goal_nums = np.array([self.state_to_num[g] for g in self.goal_states if g in self.state_to_num], dtype=np.int64)
+
     def state_rewards(self, s_num, g_num):
         if s_num == g_num:
             return 100
@@ -160,3 +203,168 @@ class TowerAssembly:
             i += 1
 
         return penalty
+
+    """
+        This function returns the possible next states of action a_num at state s_num
+        and their probabilities
+    """
+    def successors(self, a_num, s_num, g_num=None):
+        s_new = self.act(a_num, s_num, g_num=g_num)
+        #finishing, no-ops and noiseless actions have a single outcome
+        if self.slip == 0 or s_new == s_num or s_new == self.terminal_state:
+            return [s_new], [1.0]
+        return [s_new, s_num], [1.0 - self.slip, self.slip]
+
+    """
+        This function draws the next state of action a_num at state s_num
+    """
+    def sample(self, a_num, s_num, g_num=None):
+        states, probs = self.successors(a_num, s_num, g_num=g_num)
+        #deterministic transitions do not use up random numbers
+        if len(states) == 1:
+            return states[0]
+        r = self.rng.random()
+        for s_new, p in zip(states, probs):
+            r -= p
+            if r < 0:
+                return s_new
+        return states[-1]
+
+    """
+        This function returns the next state number of every state for action a_num
+        (the compiled kernel over the array-backed states)
+    """
+    def next_states(self, a_num, g_num=None):
+        if self.loc is None:
+            self.make_arrays()
+        return tower_kernels.next_states(a_num, -1 if g_num == None else g_num, self.loc, self.codes,
+                                         self.code_order, self.goal_nums, self.terminal_state,
+                                         self.num_block_actions)
+
+    """
+        This function returns the reward of every state for goal g_num (the compiled
+        kernel, same rules as state_rewards)
+    """
+    def rewards(self, g_num):
+        if self.loc is None:
+            self.make_arrays()
+        return tower_kernels.rewards(g_num, self.loc, self.terminal_state)
+
+    """
+        This function builds one sparse (states x states) transition matrix per action
+        for goal g_num. The deterministic next states are enumerated once and the slip
+        probability is mixed in with array operations
+    """
+    def transition_matrices(self, g_num=None):
+        S = self.num_states
+        s = np.arange(S)
+        P = []
+        for a in range(self.get_num_actions()):
+            nxt = self.next_states(a, g_num)
+
+            #failed actions stay in place, except when finishing
+            p_stay = np.where(nxt == self.terminal_state, 0.0, self.slip)
+            data = np.concatenate([1.0 - p_stay, p_stay])
+            rows = np.concatenate([s, s])
+            cols = np.concatenate([nxt, s])
+            keep = data > 0
+            M = sp.csr_matrix((data[keep], (rows[keep], cols[keep])), shape=(S, S))
+            M.sum_duplicates()
+            P.append(M)
+        return P
+
+    """
+        This function does value iteration for goal g_num over the sparse transition
+        matrices, with the same stopping rule as mdptoolbox.mdp.ValueIteration (see
+        solver.value_iteration for stable and stats).
+        Returns the values and the policy as tuples
+    """
+    def solve_values(self, g_num, gamma=0.9, epsilon=0.01, P=None, stable=None, stats=None):
+        if P == None:
+            P = self.transition_matrices(g_num)
+        V, policy = value_iteration(P, self.rewards(g_num), gamma, epsilon, stable, stats)
+        return tuple(V.tolist()), tuple(policy.tolist())
+
+    """
+        This function returns the abstract state of state s for the goal tower g: the
+        number of blocks already stacked as in the goal (m), the number of blocks
+        stacked above them (k), and for each remaining goal block, in goal order,
+        whether it is still in storage. Blocks in the bin and blocks on top of the
+        matched part are alike for the goal (both only have to be placed, the
+        stacked ones after being taken down), so which blocks are in the bin and
+        which are stacked, and in what order, is forgotten. Rewards only depend on
+        the table height (m + k), so states with the same abstract state have the
+        same values for g
+    """
+    def abstract_state(self, s, g):
+        #blocks in the order they are stacked in the goal
+        order = sorted(range(self.num_blocks), key=lambda b: g[b][self.TAB])
+        m = 0
+        while m < self.num_blocks and s[order[m]][self.TAB] == m + 1:
+            m += 1
+        k = self.get_table_height(s) - m
+        return (m, k, tuple(s[order[i]][self.STO] for i in range(m, self.num_blocks)))
+
+    """
+        This function groups the states by their abstract state for goal g_num.
+        Returns the class of every state and one representative state per class
+        (the terminal state is a class of its own)
+    """
+    def abstraction(self, g_num):
+        if not hasattr(self, 'num_to_state'):
+            self.get_state_enumeration()
+        g = self.num_to_state[g_num]
+
+        keys = {}
+        reps = []
+        class_of = np.empty(self.num_states, dtype=np.int64)
+        for s_num in range(self.num_states - 1):
+            key = self.abstract_state(self.num_to_state[s_num], g)
+            if key not in keys:
+                keys[key] = len(reps)
+                reps.append(s_num)
+            class_of[s_num] = keys[key]
+        class_of[self.terminal_state] = len(reps)
+        reps.append(self.terminal_state)
+        return class_of, reps
+
+    """
+        This function does value iteration for goal g_num on the abstract states
+        (about 20 times fewer than the full states), moving each class like its
+        representative, and lifts the values and policy back to every state. The
+        lifted values are the ones solve_values gives, because states of a class
+        have the same values. Each state takes its first action that leads to the
+        same class as the best action of its representative
+    """
+    def solve_abstract_values(self, g_num, gamma=0.9, epsilon=0.01, stable=None, stats=None):
+        class_of, reps = self.abstraction(g_num)
+        C = len(reps)
+
+        P = []
+        for a in range(self.get_num_actions()):
+            rows = []
+            cols = []
+            data = []
+            for c, r in enumerate(reps):
+                states, probs = self.successors(a, r, g_num=g_num)
+                rows.extend([c] * len(states))
+                cols.extend(class_of[states])
+                data.extend(probs)
+            M = sp.csr_matrix((data, (rows, cols)), shape=(C, C))
+            M.sum_duplicates()
+            P.append(M)
+        R = np.array([self.state_rewards(r, g_num) for r in reps], dtype=float)
+        V_c, policy_c = value_iteration(P, R, gamma, epsilon, stable, stats)
+
+        V = V_c[class_of]
+        target = [class_of[self.act(int(policy_c[c]), r, g_num=g_num)] for c, r in enumerate(reps)]
+        policy = policy_c[class_of]
+        for s_num in range(self.num_states):
+            c = class_of[s_num]
+            if s_num == reps[c]:
+                continue
+            for a in range(self.get_num_actions()):
+                if class_of[self.act(a, s_num, g_num=g_num)] == target[c]:
+                    policy[s_num] = a
+                    break
+        return tuple(V.tolist()), tuple(policy.tolist())
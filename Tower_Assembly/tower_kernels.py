@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""
+Compiled kernels for the tower assembly task. States are passed as arrays instead
+of nested tuples: row s of loc holds one location code per block (0 = storage,
+1 = bin, 2 + h = table at height h), and every state is also packed into a single
+integer code (one base-10 digit per block) so a successor state can be found by
+binary search over the sorted codes. Compiled code is cached on disk next to this
+file, so only the first run on a machine pays the compilation cost. Without Numba
+the same functions run as plain Python and give identical results.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    #without Numba, leave the kernels as plain Python functions
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+STO = 0
+BIN = 1
+TAB = 2
+
+
+"""
+    This function returns the location codes of every block of the given state tuples
+"""
+def make_locations(states, num_blocks):
+    loc = np.zeros([len(states), num_blocks], dtype=np.int64)
+    for i, state in enumerate(states):
+        for b, s_b in enumerate(state):
+            if s_b[0] == 1:
+                loc[i, b] = STO
+            elif s_b[1] == 1:
+                loc[i, b] = BIN
+            else:
+                loc[i, b] = TAB + s_b[2]
+    return loc
+
+
+"""
+    This function packs location codes into one integer per state
+"""
+@njit(cache=True)
+def encode(loc_row):
+    code = 0
+    for b in range(loc_row.shape[0] - 1, -1, -1):
+        code = code * 10 + loc_row[b]
+    return code
+
+
+"""
+    This function returns the state number of the given location codes
+"""
+@njit(cache=True)
+def lookup(loc_row, codes, order):
+    return order[np.searchsorted(codes, encode(loc_row))]
+
+
+"""
+    This function returns the next state number given an action number and a state
+    number (same rules as TowerAssembly.act). g is the goal state number, or -1 to
+    stop at any of the goal states in goal_nums
+"""
+@njit(cache=True)
+def act(a, s, g, loc, codes, order, goal_nums, terminal, num_block_actions):
+    if s == terminal:
+        return terminal
+    if g == -1:
+        for i in range(goal_nums.shape[0]):
+            if s == goal_nums[i]:
+                return terminal
+    elif s == g:
+        return terminal
+
+    block = a // num_block_actions
+    action = a % num_block_actions
+    row = loc[s]
+    num_blocks = row.shape[0]
+
+    #table height and top block
+    h = 0
+    top = -1
+    for b in range(num_blocks):
+        if row[b] >= TAB and row[b] - TAB > h:
+            h = row[b] - TAB
+            top = b
+
+    new = row.copy()
+    #pickup from storage, put in bin
+    if action == 0 and row[block] == STO:
+        new[block] = BIN
+    #place on table
+    elif action == 1 and row[block] == BIN and h < num_blocks:
+        new[block] = TAB + h + 1
+    #remove from table
+    elif action == 3 and top == block:
+        new[block] = BIN
+    #remove from bin
+    elif action == 4 and row[block] == BIN:
+        new[block] = STO
+    #idle or invalid move
+    else:
+        return s
+    return lookup(new, codes, order)
+
+
+"""
+    This function returns the distance between the states with location codes g_row
+    and s_row (same rules as SCA.dist)
+"""
+@njit(cache=True)
+def dist(g_row, s_row):
+    d = 0
+    for i in range(g_row.shape[0]):
+        if g_row[i] == STO:
+            d += 0 if s_row[i] == STO else 1
+        elif g_row[i] == BIN:
+            d += 0 if s_row[i] == BIN else 1
+        elif s_row[i] == STO or (s_row[i] >= TAB and s_row[i] != g_row[i]):
+            d += 2
+        elif s_row[i] == BIN:
+            d += 1
+    return d
+
+
+"""
+    This function returns the legibility probability of goal G for action a at
+    state s (same rules as SCA.PrG). Finishing the tower leaves the state as it is
+"""
+@njit(cache=True)
+def PrG(G, a, s, human_goal, goals, loc, codes, order, goal_nums, terminal, num_block_actions):
+    s_new = act(a, s, human_goal, loc, codes, order, goal_nums, terminal, num_block_actions)
+    if s_new == terminal:
+        s_new = s
+
+    #if the move is away from the goal, return probability of 0
+    d_G = dist(loc[G], loc[s]) - dist(loc[G], loc[s_new])
+    if d_G < 0:
+        return 0.0
+
+    #keep track of total sum of positive distance changes for normalization
+    sum_dist = 0
+    for i in range(goals.shape[0]):
+        d = dist(loc[goals[i]], loc[s]) - dist(loc[goals[i]], loc[s_new])
+        if d > 0:
+            sum_dist += d
+
+    #if nothing changed (idle)
+    if sum_dist == 0:
+        return 0.0
+    return d_G / sum_dist
+
+
+"""
+    This function returns the next state number of every state for action a (same
+    rules as act; the terminal state loops on itself)
+"""
+@njit(cache=True)
+def next_states(a, g, loc, codes, order, goal_nums, terminal, num_block_actions):
+    nxt = np.empty(terminal + 1, dtype=np.int64)
+    for s in range(terminal + 1):
+        nxt[s] = act(a, s, g, loc, codes, order, goal_nums, terminal, num_block_actions)
+    return nxt
+
+
+"""
+    This function returns the reward of every state for goal g (same rules as
+    TowerAssembly.state_rewards): 100 at the goal, 0 at the terminal state and
+    otherwise -8 plus the number of table heights filled from the bottom up
+"""
+@njit(cache=True)
+def rewards(g, loc, terminal):
+    num_blocks = loc.shape[1]
+    R = np.empty(terminal + 1)
+    for s in range(terminal):
+        filled = np.zeros(num_blocks + 1, dtype=np.bool_)
+        for b in range(num_blocks):
+            if loc[s, b] > TAB:
+                filled[loc[s, b] - TAB] = True
+        h = 0
+        while h < num_blocks and filled[h + 1]:
+            h += 1
+        R[s] = -8 + h
+    R[terminal] = 0
+    if g != terminal:
+        R[g] = 100
+    return R
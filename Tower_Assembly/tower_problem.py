@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+"""
+Adapter that describes the tower assembly task as a Problem for the shared Engine
+(Common/engine.py). Goal inference and action scoring follow the tower SCA
+(TASC_tower.py), which makes its decisions through it.
+"""
+
+import os
+import sys
+import numpy as np
+
+import tower_kernels
+from tower_assembly import TowerAssembly
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from problem import Problem, value_goal_probs
+
+
+"""
+    This class adapts TowerAssembly to the Problem interface
+"""
+class TowerProblem(Problem):
+    def __init__(self, t=None, goals=None, slip=0.0, abstract=False):
+        if t == None:
+            t = TowerAssembly(slip=slip, fast=True)
+        if not hasattr(t, 'num_to_state'):
+            t.get_state_enumeration()
+        t.num_states = len(t.num_to_state) + 1
+        if t.fast and t.loc is None:
+            t.make_arrays()
+        self.t = t
+
+        self.num_states = t.num_states
+        self.num_actions = t.get_num_actions()
+        self.terminal = t.terminal_state
+        self.slip = t.slip
+        if goals == None:
+            goals = [t.state_to_num[g] for g in t.goal_states]
+        self.goals = list(goals)
+        self.goal_nums = np.array(self.goals, dtype=np.int64)
+        self.name = 'tower-%g' % t.slip
+        #solve goals on the abstract states (TowerAssembly.solve_abstract_values),
+        #which gives the same tables
+        self.abstract = abstract
+
+    """
+        This function returns the next state of every state for action a; only goal g
+        (or any goal if g is None) finishes the task
+    """
+    def next_states(self, a, g=None):
+        return self.t.next_states(a, g)
+
+    """
+        This function builds the transition matrices with the task's own builder
+    """
+    def transition_matrices(self, g=None):
+        return self.t.transition_matrices(g)
+
+    """
+        This function returns the reward of every state for goal g
+    """
+    def rewards(self, g):
+        return self.t.rewards(g)
+
+    """
+        This function solves goal g on the abstract states of the goal tower
+    """
+    def solve_abstract(self, g, gamma, epsilon, stable=None, stats=None):
+        return self.t.solve_abstract_values(g, gamma, epsilon, stable, stats)
+
+    """
+        Simple distance function between two states in this tower assembly problem
+    """
+    def dist(self, g, s):
+        d = 0
+        for i in range(self.t.num_blocks):
+            if g[i][0] == 1:
+                d += abs(g[i][0] - s[i][0])
+            elif g[i][1] == 1:
+                d += abs(g[i][1] - s[i][1])
+            elif g[i][2] != 0 and (s[i][0] == 1 or (s[i][2] != 0 and s[i][2] != g[i][2])):
+                d += 2
+            elif g[i][2] != 0 and s[i][1] == 1:
+                d += 1
+        return d
+
+    """
+        This function returns the legibility probability of goal G for action a at
+        state s, when working towards goal g (same rules as SCA.PrG)
+    """
+    def legibility(self, G, a, s, g=None):
+        if self.t.fast:
+            return tower_kernels.PrG(G, a, s, -1 if g == None else g, self.goal_nums, self.t.loc,
+                                     self.t.codes, self.t.code_order, self.t.goal_nums,
+                                     self.terminal, self.t.num_block_actions)
+        state = self.t.num_to_state[s]
+        goal = self.t.num_to_state[G]
+
+        #s_new is predicted new state given action a (finishing leaves the tower as it is)
+        s_new_num = self.t.act(a, s, g_num=g)
+        if s_new_num == self.terminal:
+            s_new = state
+        else:
+            s_new = self.t.num_to_state[s_new_num]
+
+        #rudimentary distance metric between states
+        d_G = self.dist(goal, state) - self.dist(goal, s_new)
+
+        #if the move is away from the goal, return probability of 0
+        if d_G < 0:
+            return 0
+
+        #calculate distance difference measure for all goals
+        #keep track of total sum of ds for normalization purposes
+        sum_dist = 0
+        for i in self.goals:
+            goal = self.t.num_to_state[i]
+            d = self.dist(goal, state) - self.dist(goal, s_new)
+
+            #disregard negative and 0 ds
+            if d > 0:
+                sum_dist += d
+
+        #if nothing changed (idle)
+        if sum_dist == 0:
+            return 0
+
+        return d_G/sum_dist
+
+    """
+        This function returns the most likely goals, their probability and the
+        probabilities of all goals from the differences in the values of the states
+        the human moved between, for each goal (see problem.value_goal_probs)
+    """
+    def goal_probs(self, engine, s, s_old, aH=None):
+        return value_goal_probs(engine.Vs, self.goals, s, s_old)
+
+    """
+        This function scores the robot actions from state s as SCA.action_scores: the
+        value gained for every goal is weighted by its probability and normalized by
+        the largest gain, and actions that lead to the same state get the same score
+    """
+    def action_scores(self, engine, s, Gp, probs, g=None):
+        succ = [self.t.act(a, s, g_num=g) for a in range(self.num_actions)]
+
+        #expected value of the states each action can end up in, for every goal
+        EV = {}
+        V_list = []
+        for a in range(self.num_actions):
+            if succ[a] not in EV:
+                states, probs_s = self.t.successors(a, s, g_num=g)
+                EV[succ[a]] = (states, probs_s, [sum(q * engine.Vs[G][j] for j, q in zip(states, probs_s))
+                                                 for G in self.goals])
+            for i, G in enumerate(self.goals):
+                V_G = EV[succ[a]][2][i] - engine.Vs[G][s]
+                V_list.append(V_G)
+        max_V = np.max(np.absolute(V_list))
+
+        seen = {}
+        vals = []
+        Ls = []
+        for a in range(self.num_actions):
+            s_new = succ[a]
+            if s_new in seen:
+                vals.append(seen[s_new][0])
+                Ls.append(seen[s_new][1])
+                continue
+
+            #calculate expected probability of effort
+            states, probs_s, ev = EV[s_new]
+            E = 0
+            for j, q in zip(states, probs_s):
+                E += q * self.effort(a, s, j)
+
+            #calculate probability that action a will be percieved as towards
+            #predicted goal
+            L = self.legibility(Gp, a, s, g)
+
+            #calculate expected value of new state
+            V = 0
+            if max_V > 0:
+                for i, G in enumerate(self.goals):
+                    V += probs[i] * ((ev[i] - engine.Vs[G][s]) / max_V)
+                #normalize
+                V = (V/2) + 0.5
+
+            #combined value of Effort, Legibility, and Value
+            val = engine.wE*E + engine.wL*L + engine.wV*V
+            seen[s_new] = (val, L)
+            vals.append(val)
+            Ls.append(L)
+
+        return succ, vals, Ls
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+"""
+Checks that the Engine reproduces every robot decision of recorded navigation SCA
+episodes (golden_trace.check), for the plain and the fast code paths.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Navigation'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from TASC_nav import SCA
+from nav_problem import NavigationProblem
+from engine import Engine
+from golden_trace import GoldenTrace, check, compare, format_divergence
+
+
+"""
+    This function returns a navigation SCA and a trace of its episodes
+"""
+def recorded(episodes=10, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sca = SCA(**kwargs)
+    trace = GoldenTrace(len(sca.G), sca.AR).record(
+        sca, range(episodes), lambda sca, store: sca.team(lambda x: x % 2 != 0, lambda x: x % 2 == 0, store=store))
+    return sca, trace
+
+
+@pytest.mark.parametrize('noise', [0.0, 0.1])
+def test_engine_reproduces_navigation_decisions(noise):
+    sca, trace = recorded(slip=noise, drift=noise)
+    assert format_divergence(check(trace, sca.engine.decide)) == 'no divergence'
+
+    #an engine on the fast MDP makes the same decisions as the plain SCA
+    with contextlib.redirect_stdout(io.StringIO()):
+        fast = SCA(slip=noise, drift=noise, fast=True)
+    engine = Engine(NavigationProblem(fast.mdp), sca.wV, sca.wE, sca.wL).set_tables(fast.Vs_robot, fast.policies)
+    assert format_divergence(check(trace, engine.decide)) == 'no divergence'
+
+
+def test_fast_navigation_matches_plain():
+    _, plain = recorded(slip=0.1, drift=0.1)
+    _, fast = recorded(slip=0.1, drift=0.1, fast=True)
+    assert format_divergence(compare(plain, fast)) == 'no divergence'
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+Checks MDP.update against solving the edited layout from scratch.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Navigation'))
+from mdp import MDP
+from nav_map import Layout
+
+EDITS = [([92, 98], [64, 15]), ([92, 97], [64, 55, 75]), ([90, 99], [64, 65]), ([92, 98], [])]
+
+
+"""
+    This function returns a solved MDP (of the default layout if goals is None)
+"""
+def solved(goals=None, obstacles=None, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        if goals == None:
+            return MDP(**kwargs)
+        return MDP(layout=Layout.from_lists(10, goals, obstacles), **kwargs)
+
+
+@pytest.mark.parametrize('goals, obstacles', EDITS)
+def test_update_matches_fresh_solve(goals, obstacles):
+    m = solved()
+    m.update(goals=goals, obstacles=obstacles)
+    fresh = solved(goals, obstacles)
+
+    assert np.allclose(m.V, fresh.V, rtol=0, atol=1e-6)
+    for g in goals:
+        assert np.allclose(m.Vs_human[g], fresh.Vs_human[g], rtol=0, atol=1e-6)
+        assert m.policies[g] == fresh.policies[g]
+        #the robot's table is its own copy
+        assert m.Vs_robot[g] == m.Vs_human[g] and m.Vs_robot[g] is not m.Vs_human[g]
+
+
+@pytest.mark.parametrize('goals, obstacles', EDITS)
+def test_noisy_update_matches_fresh_solve_up_to_offset(goals, obstacles):
+    m = solved(slip=0.1, drift=0.1)
+    m.update(goals=goals, obstacles=obstacles)
+    fresh = solved(goals, obstacles, slip=0.1, drift=0.1)
+
+    #solves that stop after a different number of sweeps are off the fixed point by different offsets
+    for g in goals:
+        assert np.ptp(np.array(m.Vs_human[g]) - np.array(fresh.Vs_human[g])) < 1e-3
+        assert m.policies[g] == fresh.policies[g]
+
+
+def test_update_leaves_unaffected_values():
+    m = solved()
+    old = dict((g, m.Vs_human[g]) for g in m.goals)
+    report = m.update(obstacles=[64, 15])
+
+    #the new obstacle does not lengthen any shortest path, so no value changes
+    assert report['states_touched'] == 0
+    for g in m.goals:
+        assert m.Vs_human[g] == old[g]
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+Checks that pages exported by nav_map.write_page hold only the layout's goals and
+obstacles, and the reading of PGM maps and named layouts.
+"""
+
+import os
+import re
+import sys
+import pytest
+
+NAVIGATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Navigation')
+sys.path.append(NAVIGATION)
+from mdp import MDP
+from nav_map import Layout, named_layout, read_pgm, write_page
+
+PAGES = ['MTurk_Nav.html', 'MTurk_Modified_Nav.html']
+
+
+@pytest.mark.parametrize('page', PAGES)
+def test_exported_page_has_no_stale_goal_lists(page, tmp_path):
+    layout = Layout.from_lists(10, [13, 57], [44, 45])
+    out = str(tmp_path / page)
+    write_page(layout, os.path.join(NAVIGATION, page), out)
+    text = open(out).read()
+
+    #every declaration and every later assignment (e.g. when a game is reset)
+    assigned = re.findall(r'\b(goals|goalStates|possibleGoalStates|obstacleStates) = (\[[^\]]*\]);', text)
+    assert set(name for name, _ in assigned) == set(['goals', 'goalStates', 'possibleGoalStates', 'obstacleStates'])
+    for name, value in assigned:
+        assert value == ('[44, 45]' if name == 'obstacleStates' else '[13, 57]')
+
+    #no goal list of the original pages is left
+    for old in ('40, 59, 92, 98', '40,59,92,98', '91, 95, 98', '91,95,98'):
+        assert '[%s]' % old not in text
+
+
+def test_plain_pgm_map(tmp_path):
+    path = str(tmp_path / 'map.pgm')
+    with open(path, 'w') as f:
+        f.write('P2\n# a comment\n4 4\n255\n0 255 255 255\n255 10 255\n255 255 255 255 255 255\n200 255 255\n')
+    layout = read_pgm(path, goals=[15])
+    assert layout.obstacles().tolist() == [0, 5]
+    assert layout.goals() == [15]
+
+
+def test_mdp_defaults_come_from_the_layout_file():
+    layout = named_layout('mdp')
+    m = MDP(solve=False)
+    assert (m.l, m.goals, m.obstacles.tolist()) == (layout.l, layout.goals(), layout.obstacles().tolist())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""
+Checks the legibility probability of the navigation adapter.
+"""
+
+import contextlib
+import io
+import math
+import os
+import sys
+import warnings
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Navigation'))
+from mdp import MDP
+from nav_problem import NavigationProblem, move_goal_probs
+from TASC_nav import SCA
+
+
+"""
+    This function returns the adapter of the default layout
+"""
+def problem(fast):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return NavigationProblem(MDP(fast=fast))
+
+
+@pytest.mark.parametrize('fast', [False, True])
+def test_legibility_is_finite(fast):
+    p = problem(fast)
+    G0, G1 = p.goals
+    for s in range(p.num_states - 1):
+        for a in range(p.num_actions):
+            for G, other in ((G0, G1), (G1, G0)):
+                pr = p.pr_goal(G, other, a, s)
+                assert math.isfinite(pr) and 0 <= pr <= 1
+
+
+def test_moving_away_from_one_goal_only():
+    #these moves leave the distance to 92 the same and move away from 98
+    for fast in (False, True):
+        p = problem(fast)
+        for s, a in ((71, 4), (82, 4)):
+            assert p.pr_goal(98, 92, a, s) == 0
+            assert p.pr_goal(92, 98, a, s) == 1
+
+
+def test_deep_lookahead_scores_are_finite():
+    with contextlib.redirect_stdout(io.StringIO()):
+        sca = SCA(depth=3)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        with contextlib.redirect_stdout(io.StringIO()):
+            sca.team(lambda x: x % 2 != 0, lambda x: x % 2 == 0)
+    assert all(math.isfinite(v) or v == -math.inf for v in sca.scores)
+
+
+def test_move_goal_probs_match_plain_rule():
+    p = problem(False)
+    for s in range(p.num_states - 1):
+        for a in range(p.num_actions):
+            s_new = p.mdp.act(a, s)
+            assert move_goal_probs(p.goals, s, s_new, p.mdp.l) == p.goal_probs(None, s, None, a)
+
+
+def test_max_value_follows_update():
+    p = problem(True)
+    assert p.max_value() == max(p.mdp.V)
+    with contextlib.redirect_stdout(io.StringIO()):
+        p.mdp.update(goals=[92, 97])
+    assert p.max_value() == max(p.mdp.V)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""
+Checks the whole-table kernels of the tower task against TowerAssembly.act and
+state_rewards, and the engine's abstract solves against its full ones.
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Tower_Assembly'))
+from tower_assembly import TowerAssembly
+from tower_problem import TowerProblem
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from engine import Engine
+
+
+@pytest.fixture(scope='module')
+def tower():
+    t = TowerAssembly()
+    t.get_state_enumeration()
+    return t
+
+
+"""
+    This function returns the state numbers of the goals
+"""
+def goal_nums(t):
+    return [t.state_to_num[g] for g in t.goal_states]
+
+
+@pytest.mark.parametrize('goal', [0, None])
+def test_next_states_match_act(tower, goal):
+    g = None if goal == None else goal_nums(tower)[goal]
+    for a in range(0, tower.get_num_actions(), 4):
+        old = np.array([tower.act(a, s, g_num=g) for s in range(tower.num_states)])
+        assert (tower.next_states(a, g) == old).all()
+
+
+def test_rewards_match_state_rewards(tower):
+    for g in goal_nums(tower):
+        old = np.array([tower.state_rewards(s, g) for s in range(tower.num_states)], dtype=float)
+        assert (tower.rewards(g) == old).all()
+
+
+def test_abstract_solve_matches_full_solve(tower):
+    g = goal_nums(tower)[0]
+    V, policy = Engine(TowerProblem(tower)).solve(g)
+    V_abs, policy_abs = Engine(TowerProblem(tower, abstract=True)).solve(g)
+    assert (V_abs == V).all()
+    assert (policy_abs == policy).all()
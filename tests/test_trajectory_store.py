@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+Checks that a TrajectoryStore reopened after a crashed writer keeps every episode's
+rows apart.
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from trajectory_store import TrajectoryStore
+
+
+"""
+    This function writes an episode of the given number of steps
+"""
+def write_episode(store, steps, goal=0):
+    store.begin_episode({'task': 'test'}, goal)
+    for i in range(steps):
+        store.append('H' if i % 2 == 0 else 'R', i, 0, i + 1)
+
+
+def test_reopen_after_crash_mid_episode(tmp_path):
+    path = str(tmp_path / 'store')
+    store = TrajectoryStore(path, chunk_size=4)
+    write_episode(store, 3)
+    write_episode(store, 2)
+    store.end_episode()
+    store.flush()
+    #the next episode fills two chunks (written to disk) before the writer crashes
+    write_episode(store, 7)
+    del store
+
+    store = TrajectoryStore(path)
+    assert store.rows == 5
+    assert store.begin_episode({'task': 'test'}, 1) == 2
+    for i in range(3):
+        store.append('H', 100 + i, 0, 101 + i)
+    store.close()
+
+    store = TrajectoryStore(path)
+    assert store.episode_index()['steps'].tolist() == [3, 2, 3]
+    episode = np.concatenate([chunk['episode'] for chunk in store.scan(['episode'])])
+    assert episode.tolist() == [0, 0, 0, 1, 1, 2, 2, 2]
+    assert store.episode(2, ['state'])['state'].tolist() == [100, 101, 102]
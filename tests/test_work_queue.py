@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Checks the claim locks of WorkQueue: staleness does not depend on the clocks of
+other hosts, workers only change claims they own, and a worker killed mid-task is
+taken over.
+"""
+
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+from work_queue import WorkQueue
+
+
+"""
+    This function returns a queue in tmp_path with one task, claimed by worker 'a'
+    of queue a
+"""
+def claimed(tmp_path, timeout=0.2):
+    a = WorkQueue(str(tmp_path), timeout=timeout, poll=0.01)
+    b = WorkQueue(str(tmp_path), timeout=timeout, poll=0.01)
+    task_id = a.add([{'x': 1}])[0]
+    assert a.try_claim(task_id, 'a')
+    return a, b, task_id, a.path('claims', task_id + '.lock')
+
+
+def test_claim_records_owner_and_time(tmp_path):
+    a, b, task_id, lock = claimed(tmp_path)
+    info = json.loads(open(lock).read())
+    assert info['owner'] == 'a'
+    assert info['claimed'] == info['time']
+
+
+def test_live_claim_with_skewed_clock_is_not_taken(tmp_path):
+    a, b, task_id, lock = claimed(tmp_path)
+    #the owner's clock is an hour behind, but its heartbeats keep changing
+    for i in range(4):
+        beat = a.beat_path(lock, a.held[lock])
+        with open(beat, 'w') as f:
+            f.write(json.dumps({'time': time.time() - 3600 + i}))
+        os.utime(beat, (0, 0))
+        assert not b.try_claim(task_id, 'b')
+        time.sleep(0.1)
+    assert a.holds(lock)
+
+
+def test_abandoned_claim_is_taken_over(tmp_path):
+    a, b, task_id, lock = claimed(tmp_path)
+    assert not b.try_claim(task_id, 'b')
+    time.sleep(0.3)
+    assert b.try_claim(task_id, 'b')
+    assert json.loads(open(lock).read())['owner'] == 'b'
+
+
+def test_release_leaves_a_claim_taken_over(tmp_path):
+    a, b, task_id, lock = claimed(tmp_path)
+    b.try_claim(task_id, 'b')
+    time.sleep(0.3)
+    assert b.try_claim(task_id, 'b')
+
+    #the first worker finishes late; its release must not remove the new claim
+    a.release(task_id)
+    assert os.path.exists(lock)
+    assert b.holds(lock)
+    b.release(task_id)
+    assert not os.path.exists(lock)
+
+
+def test_heartbeat_of_a_replaced_owner_keeps_the_new_claim(tmp_path):
+    a, b, task_id, lock = claimed(tmp_path)
+    b.try_claim(task_id, 'b')
+    time.sleep(0.3)
+    assert b.try_claim(task_id, 'b')
+
+    #the first worker beats once more, as if it had checked its claim just before
+    #the takeover
+    a.holds = lambda path: True
+    stop = threading.Event()
+    beat = threading.Thread(target=a.keep_alive, args=(lock, stop))
+    a.heartbeat = 0.01
+    beat.start()
+    time.sleep(0.05)
+    stop.set()
+    beat.join()
+    assert json.loads(open(lock).read())['owner'] == 'b'
+    assert b.holds(lock)
+
+
+def test_run_finishes_every_task(tmp_path):
+    q = WorkQueue(str(tmp_path), heartbeat=0.01, poll=0.01)
+    q.add([{'x': i} for i in range(5)])
+    assert q.run(lambda task, context: task['x'] * 2, worker='w') == 5
+    rows, missing = q.merge()
+    assert [row['result'] for row in rows] == [0, 2, 4, 6, 8]
+    assert missing == []
+    assert os.listdir(q.path('claims')) == []
+
+
+"""
+    This function runs the tasks of the queue in root as worker; the worker
+    'killed' stops in task 2 until it is killed
+"""
+def run_worker(root, worker):
+    q = WorkQueue(root, timeout=0.5, heartbeat=0.05, poll=0.02)
+
+    def work(task, context):
+        if worker == 'killed' and task['x'] == 2:
+            open(os.path.join(root, 'started'), 'w').close()
+            time.sleep(60)
+        return task['x'] * 2
+    q.run(work, worker=worker)
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_killed_worker_is_taken_over(tmp_path):
+    root = str(tmp_path)
+    q = WorkQueue(root)
+    ids = q.add([{'x': i} for i in range(6)])
+    ctx = multiprocessing.get_context('fork')
+
+    killed = ctx.Process(target=run_worker, args=(root, 'killed'))
+    killed.start()
+    while not os.path.exists(os.path.join(root, 'started')):
+        assert killed.is_alive()
+        time.sleep(0.01)
+    other = ctx.Process(target=run_worker, args=(root, 'other'))
+    other.start()
+    #the killed worker's heartbeats keep its claim until it dies mid-task
+    time.sleep(0.7)
+    assert os.path.exists(q.path('claims', ids[2] + '.lock'))
+    os.kill(killed.pid, signal.SIGKILL)
+    killed.join()
+    other.join(30)
+    assert other.exitcode == 0
+
+    #the other worker moved the stale claim aside and ran the task
+    assert os.listdir(q.path('claims')) == [ids[2] + '.lock.stale.other']
+    rows, missing = q.merge()
+    assert [row['task'] for row in rows] == ids
+    assert [row['result'] for row in rows] == [0, 2, 4, 6, 8, 10]
+    assert [row['worker'] for row in rows if row['task'] == ids[2]] == ['other']
+    assert missing == []